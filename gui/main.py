@@ -104,6 +104,12 @@ class ConsoleUIController:
         
         max_attempts = num_schedules_to_generate * (MAX_SCHEDULE_GENERATION_ATTEMPTS // MAX_DISTINCT_SCHEDULES_TO_GENERATE)
 
+        bottlenecks = self.engine.analyze_feasibility()
+        if bottlenecks:
+            print("\n--- Feasibility Check (worst first) ---")
+            for bottleneck in bottlenecks[:10]:
+                print(f"  [{bottleneck['severity'].upper()}] {bottleneck['message']}")
+
         print(f"\n--- Telling Engine to Generate Schedules (Max Attempts: {max_attempts}) ---")
         success = self.engine.generate_schedules(num_schedules_to_generate, max_attempts)
 
@@ -2,9 +2,22 @@ import datetime
 import math
 import random
 import copy
-import json
+import time
 import calendar
-from collections import defaultdict
+import os
+import heapq
+import multiprocessing
+import sys
+from abc import ABC, abstractmethod
+from array import array
+from collections import defaultdict, deque, namedtuple
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # --- Constants ---
 ELEMENTARY_MIN_HOURS = 950
@@ -21,6 +34,85 @@ PERIODS_PER_TYPICAL_OPTION_BLOCK = 5
 
 TARGET_SUGGESTIONS_PER_TERM = 12
 
+# Run-level search settings, kept separate from the school parameters.
+# num_workers: 1 runs attempts in-process, >1 fans them out to a process pool, None uses os.cpu_count().
+# random_seed: base seed; attempt N uses random_seed + N. None picks a fresh seed per run (logged).
+DEFAULT_ENGINE_OPTIONS = {
+    'num_workers': 1,
+    'random_seed': None,
+    'time_limit': None,  # Seconds for a whole generate_schedules() run; None means attempts run to max_total_attempts.
+    # Portfolio: run PORTFOLIO_STRATEGIES (or 'portfolio_strategies') in parallel processes under 'portfolio_time_limit'.
+    # 'first' keeps the first strategy to find a valid schedule, 'best' waits for all and ranks every schedule by score.
+    'portfolio': False,
+    'portfolio_strategies': None,
+    'portfolio_time_limit': 60.0,
+    'portfolio_mode': 'first',
+    'early_abort': True,  # Stop an attempt as soon as completion or grade-coverage bounds show it cannot pass.
+    # 'dynamic' places the most constrained item next and tries its least-constraining slots first (random tie-breaks);
+    # 'static' keeps the (required grade, periods) sort, shuffled after the first attempt, with random slots.
+    # 'exact' runs a complete backtracking search per term first and only falls back to randomized attempts if it hits its
+    # limits or proves a term infeasible (the attempts then supply the Best_Failed_Attempt).
+    'solver': 'greedy',
+    'exact_node_limit': 200000,  # Search nodes per term.
+    'exact_time_limit': 20.0,    # Seconds for the whole exact search.
+    'ordering': 'dynamic',
+    'domain_filtering': True,  # Pre-compute and propagate each item's feasible slots once per run; attempts only sample from them.
+    'coverage_first': True,  # High school: match each required grade's courses to every slot before the main placement loop.
+    'teacher_assignment': 'flow',  # 'flow' solves each term's teacher assignment once per run; 'greedy' picks per item per attempt.
+    'squeaky_wheel': True,  # Carry per-item priorities across attempts: items that fail to place or leave grade gaps go earlier.
+    # Local-search repair of the best failed attempts, run when a pass of attempts yields no valid schedule.
+    'repair': True,
+    'repair_seeds': 3,          # How many of the best failed attempts to repair.
+    'repair_iterations': 4000,  # Simulated-annealing moves per repaired attempt, split across its terms.
+    'repair_time_limit': 5.0,   # Seconds for the whole repair stage.
+    'repair_weights': {'grade_slot': 10, 'prep': 10, 'unplaced': 1},
+    # Large-neighbourhood search in the same stage: free one day, subject area or teacher's classes and re-place exactly.
+    'lns': True,
+    'lns_iterations': 60,    # Neighbourhoods tried per repaired term.
+    'lns_max_items': 5,      # Most items freed in one neighbourhood.
+    'lns_node_limit': 4000,  # Search nodes per neighbourhood; the best placement found so far is kept when hit.
+    'symmetry_breaking': True,  # Detect interchangeable teachers and identical sections; skip their symmetric variants.
+    # Diversity: stop at num_schedules_to_generate schedules that each differ from all others in at least
+    # 'diversity_min_difference' of their placements; (course, slot) pairs already used are tabu for later attempts.
+    'diversity': False,
+    'diversity_min_difference': 0.2,
+    # Objective: weights of OBJECTIVE_TERMS by name, kept up to date on every placement. It breaks ties in slot
+    # choice, is hill-climbed on each valid schedule for 'objective_polish_iterations' moves and ranks schedules
+    # after the core-course score. Empty weights turn it off.
+    'objective_weights': {'core_availability': 10.0, 'load_balance': 1.0, 'day_spread': 1.0, 'prep_distribution': 1.0},
+    'objective_polish_iterations': 300,
+    # Logging: records below 'log_level' are dropped unformatted; the run keeps the newest 'log_buffer_size'.
+    # Without 'log_attempt_detail' each attempt adds one summary record instead of its full log.
+    'log_level': 'INFO',
+    'log_buffer_size': 5000,
+    'log_attempt_detail': False,
+    'log_echo': False,  # Also print run log records as they are logged. Portfolio workers never print; the parent echoes the log it keeps.
+    'vectorized_evaluation': True,  # Rank and re-validate finished schedules with ScheduleEvaluator when NumPy is installed.
+}
+REPAIR_SEED_OFFSET = 1000000
+POLISH_SEED_OFFSET = 2000000
+# Each strategy is a name plus engine option overrides.
+PORTFOLIO_STRATEGIES = [
+    {'name': 'greedy-restarts', 'ordering': 'static', 'teacher_assignment': 'greedy', 'coverage_first': False, 'squeaky_wheel': False, 'repair': False, 'lns': False},
+    {'name': 'most-constrained', 'ordering': 'dynamic', 'repair': False, 'lns': False},
+    {'name': 'local-search', 'ordering': 'dynamic', 'repair_seeds': 5, 'repair_time_limit': 30.0},
+    {'name': 'exact', 'solver': 'exact', 'exact_node_limit': 2000000, 'exact_time_limit': 60.0},
+]
+PORTFOLIO_GRACE_SECONDS = 5.0  # Extra wait past the budget for strategies to return their results.
+SQUEAKY_WHEEL_DECAY = 0.9
+# Attempts run in generations of this many: learned priorities and diversity tabu masks only change between
+# generations, so attempt N sees what attempts before N - N % ATTEMPT_GENERATION_SIZE taught, for any worker count.
+ATTEMPT_GENERATION_SIZE = 16
+FEASIBILITY_TIGHT_UTILIZATION = 0.9  # analyze_feasibility() reports demand at or above this share of capacity as tight.
+TEACHER_PLAN_LOAD_COST = 100       # Cost of filling a teacher to capacity in the assignment flow, spread over its unit arcs.
+TEACHER_PLAN_OPTIONAL_COST = 1000  # Extra cost per period for items outside the required grades.
+SQUEAKY_WHEEL_REPORT_LIMIT = 15
+REPAIR_START_TEMPERATURE = 2.0
+FINGERPRINT_SEED = 0x5C4ED   # Fixed so fingerprints agree across worker processes and runs.
+FINGERPRINT_MASK = (1 << 64) - 1
+FINGERPRINT_TERM_MULTIPLIER = 0x100000001B3  # Combines term fingerprints in term order.
+REPAIR_END_TEMPERATURE = 0.05
+
 QUALIFIABLE_SUBJECTS = [
     "Math", "Science", "Social Studies", "English", "French",
     "PE", "Cree", "CTS", "Other"
@@ -202,6 +294,983 @@ def parse_scheduling_constraint(constraint_str, num_periods):
                 parsed_constraints.append({'type': 'NOT', 'day': day_apply_final, 'period': p_idx_con})
     return parsed_constraints
 
+# --- Input snapshots ---
+class FrozenDict(dict):
+    """Read-only dict for engine input snapshots. Still a dict, so .get(), iteration and json.dump work unchanged."""
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs): raise TypeError("Engine inputs are read-only snapshots; use dict(...) for a mutable copy.")
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self): return self
+    def __deepcopy__(self, memo): return self
+    def __reduce__(self): return (FrozenDict, (dict(self),))
+
+class FrozenList(tuple):
+    """Read-only list for engine input snapshots."""
+    __slots__ = ()
+
+    def __copy__(self): return self
+    def __deepcopy__(self, memo): return self
+
+def freeze(value):
+    """Read-only snapshot of JSON-like input data: dicts become FrozenDicts, lists and tuples FrozenLists.
+
+    Building a snapshot visits every nested value once, so it is O(n) like the deepcopy it replaces
+    (with less work per value); a lazy view would be cheaper but would still see the caller's later
+    edits and could not be pickled to portfolio workers. Parts that are already snapshots are shared
+    rather than copied, so passing engine data back to the engine (or between engines) is O(1) and
+    callers can never alter what a run reads.
+    """
+    if isinstance(value, (FrozenDict, FrozenList, frozenset)): return value
+    if isinstance(value, dict): return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)): return FrozenList(freeze(item) for item in value)
+    if isinstance(value, set): return frozenset(value)
+    return value
+
+# --- Run log ---
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+def format_log_message(record):
+    _, _, _, message, fields = record
+    return message.format(**fields) if fields else message
+
+def format_log_record(record):
+    return f"[{record[1]}] {time.strftime('%H:%M:%S', time.localtime(record[0]))} {format_log_message(record)}"
+
+class RunLog:
+    """Leveled log of structured records, optionally bounded to the newest `capacity` records.
+
+    A record is (time, level, event, message, fields). It is called like the old log functions,
+    log(message, level), plus an optional event code and fields; with fields, message is a
+    str.format template that is only rendered by lines(). Records below the level threshold are
+    dropped before anything else happens, so disabled DEBUG calls cost one dict lookup.
+    """
+    def __init__(self, level="INFO", capacity=None, echo=False):
+        self.threshold = LOG_LEVELS.get(level, LOG_LEVELS['INFO'])
+        self.records = deque(maxlen=capacity)
+        self.echo = echo
+        self.evicted = 0
+
+    def enabled(self, level): return LOG_LEVELS.get(level, LOG_LEVELS['INFO']) >= self.threshold
+
+    def __call__(self, message, level="INFO", event=None, **fields):
+        if LOG_LEVELS.get(level, LOG_LEVELS['INFO']) < self.threshold: return
+        self._append((time.time(), level, event, message, fields))
+
+    def extend(self, records):
+        for record in records:
+            if self.enabled(record[1]): self._append(record)
+
+    def _append(self, record):
+        if len(self.records) == self.records.maxlen: self.evicted += 1
+        self.records.append(record)
+        if self.echo: print(format_log_record(record))
+
+    def count(self, level): return sum(1 for record in self.records if record[1] == level)
+
+    def summary(self):
+        """What a stored result keeps of its attempt log: record counts per level and the last WARN-or-worse message."""
+        counts, last_reason = dict.fromkeys(LOG_LEVELS, 0), None
+        for record in self.records:
+            counts[record[1]] = counts.get(record[1], 0) + 1
+            if LOG_LEVELS.get(record[1], 0) >= LOG_LEVELS['WARN']: last_reason = format_log_message(record)
+        return {'counts': counts, 'last_reason': last_reason}
+
+    def lines(self): return [format_log_record(record) for record in self.records]
+    def __iter__(self): return iter(self.records)
+    def __len__(self): return len(self.records)
+
+# --- Schedule objective ---
+# Terms score one TermState (higher is better). place_delta() is the change placing item at slot with
+# t_id would make, read from the state before the placement; TermState adds it on place() and takes it
+# back on unplace(), so the weighted total is always current without rescoring the term.
+OBJECTIVE_TERMS = {}
+
+def register_objective_term(term_cls):
+    """Class decorator adding an ObjectiveTerm subclass to OBJECTIVE_TERMS under its name."""
+    OBJECTIVE_TERMS[term_cls.name] = term_cls
+    return term_cls
+
+class ObjectiveTerm(ABC):
+    """Base class for objective terms: set name and implement place_delta()."""
+    name = None
+
+    @abstractmethod
+    def place_delta(self, state, item, t_id, slot):
+        """Change in this term's score from placing item at slot with t_id, read before the placement."""
+
+@register_objective_term
+class CoreAvailabilityTerm(ObjectiveTerm):
+    """Grade 11 and 12 core courses offered at all, as counted by the final ranking."""
+    name = 'core_availability'
+    def place_delta(self, state, item, t_id, slot):
+        return 1.0 if state.problem.item_is_ranked_core[item] and not state.item_placed[item] else 0.0
+
+@register_objective_term
+class LoadBalanceTerm(ObjectiveTerm):
+    """Minus the sum of squared teacher loads, per week slot: lower when classes pile onto few teachers."""
+    name = 'load_balance'
+    def place_delta(self, state, item, t_id, slot):
+        return -(2 * state.teacher_load[t_id] + 1) / max(1, state.problem.num_slots)
+
+@register_objective_term
+class DaySpreadTerm(ObjectiveTerm):
+    """Distinct days each course meets on."""
+    name = 'day_spread'
+    def place_delta(self, state, item, t_id, slot):
+        return 0.0 if state.item_slot_mask[item] & state.problem.day_masks[state.problem.slot_day[slot]] else 1.0
+
+@register_objective_term
+class PrepDistributionTerm(ObjectiveTerm):
+    """Minus the (teacher, day) pairs where a teacher teaches but has no free available period left."""
+    name = 'prep_distribution'
+    def place_delta(self, state, item, t_id, slot):
+        problem = state.problem
+        free_today = problem.teacher_avail_masks[t_id] & problem.day_masks[problem.slot_day[slot]] & ~state.teacher_busy[t_id]
+        return -1.0 if free_today == 1 << slot else 0.0
+
+class ScheduleObjective:
+    """Weighted sum of registered ObjectiveTerms; see the 'objective_weights' engine option."""
+    def __init__(self, weights):
+        self.terms = [(OBJECTIVE_TERMS[name](), float(weight)) for name, weight in weights.items() if weight and name in OBJECTIVE_TERMS]
+
+    def place_delta(self, state, item, t_id, slot):
+        return sum(weight * term.place_delta(state, item, t_id, slot) for term, weight in self.terms)
+
+Placement = namedtuple('Placement', 'course teacher')
+Placement.__doc__ = "One schedule cell. A plain (course, teacher) tuple for the GUI, with attribute access inside the engine."
+
+class CourseRecord:
+    """One course or subject as the engine reads it: the fields it uses as slots, everything else in extra.
+
+    from_dict() applies the grade and periods-per-week normalisation the engine has always done;
+    to_dict() gives back the course dict the GUI and the 'placed_courses' lists expect.
+    """
+    __slots__ = ('name', 'credits', 'grade_level', 'subject_area', 'term_assignment', 'constraints_raw', 'periods_per_week', 'extra', 'missing')
+    FIELDS = (('name', 'name'), ('credits', 'credits'), ('grade_level', 'grade_level'), ('subject_area', 'subject_area'),
+              ('term_assignment', 'term_assignment'), ('scheduling_constraints_raw', 'constraints_raw'))
+
+    @classmethod
+    def from_dict(cls, item_data):
+        record = cls()
+        record.name = sys.intern(item_data['name'])
+        record.credits = item_data.get('credits', 0)
+        grade_level = item_data.get('grade_level')
+        record.grade_level = int(grade_level) if grade_level and isinstance(grade_level, str) and grade_level.isdigit() else grade_level
+        subject_area = item_data.get('subject_area')
+        record.subject_area = sys.intern(subject_area) if isinstance(subject_area, str) else subject_area
+        record.term_assignment = item_data.get('term_assignment', 1)
+        record.constraints_raw = item_data.get('scheduling_constraints_raw', '')
+        if record.credits >= 5: record.periods_per_week = 5
+        elif record.credits >= 3: record.periods_per_week = 3
+        else: record.periods_per_week = 1
+        known = {key for key, _ in cls.FIELDS} | {'periods_per_week_in_active_term'}
+        record.extra = {key: value for key, value in item_data.items() if key not in known}
+        record.missing = frozenset(key for key, _ in cls.FIELDS if key not in item_data)
+        return record
+
+    def to_dict(self):
+        data = {key: getattr(self, attr) for key, attr in self.FIELDS if key not in self.missing}
+        data.update(self.extra)
+        data['periods_per_week_in_active_term'] = self.periods_per_week
+        return data
+
+class TeacherRecord:
+    """One teacher as the engine reads it, with availability held as a slot bitmask (see CompiledProblem.slot_id)."""
+    __slots__ = ('name', 'qualifications', 'availability_mask')
+
+    @classmethod
+    def from_dict(cls, teacher, num_periods_per_day):
+        record = cls()
+        record.name = sys.intern(teacher['name'])
+        record.qualifications = frozenset(sys.intern(q) if isinstance(q, str) else q for q in teacher.get('qualifications', []))
+        availability = teacher.get('availability', {})
+        record.availability_mask = 0
+        for d_idx, day_k in enumerate(DAYS_OF_WEEK):
+            for period_k in range(num_periods_per_day):
+                if availability.get(day_k, {}).get(period_k, False): record.availability_mask |= 1 << (d_idx * num_periods_per_day + period_k)
+        return record
+
+    def is_qualified(self, subject_area): return subject_area == "Other" or subject_area in self.qualifications
+
+class CompiledProblem:
+    """Frozen, integer-indexed view of the engine inputs, built once per generation run.
+
+    Teachers, items (courses or subjects), days and periods are mapped to dense ids. A slot id is
+    day_idx * num_periods_per_day + period_idx. Attempts only read this object and keep their own
+    small mutable state, so it is also what gets shipped to worker processes.
+    """
+    def __init__(self):
+        self.input_error = None
+        self.num_periods_per_day = 1
+        self.num_days = len(DAYS_OF_WEEK)
+        self.num_slots = 0
+        self.num_terms = 1
+        self.num_tracks = 1
+        self.is_hs = False
+        self.force_same_time = False
+        self.allow_multiple_same_day = True
+        self.required_grades = ()
+        self.slot_day = ()
+        self.slot_period = ()
+        self.all_slots_mask = 0
+        self.day_masks = ()
+        self.period_masks = ()
+        self.teacher_names = ()
+        self.teacher_quals = ()
+        self.teacher_avail_count = ()
+        self.teacher_max_teaching = ()
+        self.teacher_avail_masks = ()
+        self.item_names = ()
+        self.item_grades = ()
+        self.item_subjects = ()
+        self.item_periods = ()
+        self.item_constraints = ()
+        self.item_not_masks = ()
+        self.item_assign_slots = ()
+        self.item_assign_masks = ()
+        self.item_is_cts = ()
+        self.item_is_ranked_core = ()
+        self.item_qualified_teachers = ()
+        self.item_conflicts = ()
+        self.item_conflict_bits = ()
+        self.item_domain_masks = ()
+        self.item_static_domain_masks = ()
+        self.item_records = ()
+        self.fingerprint_keys = ()
+        self.fingerprint_teacher_keys = ()
+        self.item_class = ()
+        self.teacher_class = ()
+        self.symmetry_counts = {}
+        self.objective = None
+        self.layout = None
+        self.term_items = {}
+        self.pinned_states = {}
+        self.pin_conflicts = []
+        self.term_teacher_plan = {}
+        self.domain_conflicts = []
+
+    def slot_id(self, day_idx, period_idx): return day_idx * self.num_periods_per_day + period_idx
+
+    def placement_key(self, item, t_id, slot):
+        return self.fingerprint_keys[self.item_class[item] * self.num_slots + slot] ^ self.fingerprint_teacher_keys[t_id]
+
+    def result_layout(self):
+        """The ScheduleLayout shared by this problem's results, built on first use after compilation."""
+        if self.layout is None: self.layout = ScheduleLayout(self)
+        return self.layout
+
+    def empty_schedule(self): return self.result_layout().empty_schedule()
+    def build_term_items(self, term_idx, item_teachers, item_placed_counts): return self.result_layout().build_term_items(term_idx, item_teachers, item_placed_counts)
+
+class ScheduleLayout:
+    """The names, course records and grid shape a CompactSchedule needs to rebuild the dict format.
+
+    One layout is shared by every schedule of a compiled problem (see CompiledProblem.result_layout()).
+    """
+    __slots__ = ('num_terms', 'num_periods_per_day', 'num_tracks', 'is_hs', 'teacher_names', 'item_names',
+                 'item_records', 'item_periods', 'item_constraints', 'item_is_cts', 'term_items', 'item_ids', 'teacher_ids')
+
+    def __init__(self, problem):
+        for name in self.__slots__[:-2]: setattr(self, name, getattr(problem, name))
+        self.item_ids = {name: i for i, name in enumerate(self.item_names)}
+        self.teacher_ids = {name: t_id for t_id, name in enumerate(self.teacher_names)}
+
+    def __getstate__(self): return {name: getattr(self, name) for name in self.__slots__}
+    def __setstate__(self, state):
+        for name, value in state.items(): setattr(self, name, value)
+
+    def empty_schedule(self):
+        return {t: {d: [[None] * self.num_tracks for _ in range(self.num_periods_per_day)] for d in DAYS_OF_WEEK} for t in range(1, self.num_terms + 1)}
+
+    def build_term_items(self, term_idx, item_teachers, item_placed_counts):
+        """Rebuilds the per-term course dicts that callers store as 'placed_courses'."""
+        item_type = 'course' if self.is_hs else 'subject'
+        return [{**self.item_records[i].to_dict(), 'teacher': self.teacher_names[item_teachers[i]] if item_teachers[i] is not None else None,
+                 'periods_to_schedule_this_week': self.item_periods[i], 'constraints': self.item_constraints[i],
+                 'type': item_type, 'placed_this_term_count': item_placed_counts[i], 'is_cts_course': self.item_is_cts[i]}
+                for i in self.term_items.get(term_idx, ())]
+
+class CompactSchedule:
+    """Integer-array form of one schedule and its per-term course list.
+
+    cells holds item_id * num_teachers + teacher_id + 1 per (term, day, period, track), 0 for an empty
+    cell. item_teachers (teacher id + 1, 0 for none) and placed_counts hold one entry per (term, item),
+    for the terms listed in course_terms. schedule() and placed_courses() rebuild the dict formats.
+    """
+    __slots__ = ('layout', 'cells', 'item_teachers', 'placed_counts', 'course_terms')
+
+    def __init__(self, layout, schedule, placed_courses):
+        self.layout = layout
+        num_teachers, num_items = len(layout.teacher_names), len(layout.item_names)
+        self.cells = array('i')
+        for term_idx in range(1, layout.num_terms + 1):
+            term_grid = schedule.get(term_idx, {})
+            for day_name in DAYS_OF_WEEK:
+                day_periods = term_grid.get(day_name, [])
+                for p_idx in range(layout.num_periods_per_day):
+                    tracks = day_periods[p_idx] if p_idx < len(day_periods) else ()
+                    for track_idx in range(layout.num_tracks):
+                        entry = tracks[track_idx] if track_idx < len(tracks) else None
+                        self.cells.append(layout.item_ids[entry[0]] * num_teachers + layout.teacher_ids[entry[1]] + 1 if entry else 0)
+        self.course_terms = tuple(sorted((placed_courses or {}).keys()))
+        self.item_teachers = array('i', [0] * (len(self.course_terms) * num_items))
+        self.placed_counts = array('h', [0] * (len(self.course_terms) * num_items))
+        for n, term_idx in enumerate(self.course_terms):
+            for course in placed_courses[term_idx]:
+                i = n * num_items + layout.item_ids[course['name']]
+                self.item_teachers[i] = layout.teacher_ids[course['teacher']] + 1 if course.get('teacher') in layout.teacher_ids else 0
+                self.placed_counts[i] = course.get('placed_this_term_count', 0)
+
+    def schedule(self):
+        layout = self.layout
+        num_teachers = len(layout.teacher_names)
+        schedule, cells = layout.empty_schedule(), iter(self.cells)
+        for term_idx in range(1, layout.num_terms + 1):
+            for day_name in DAYS_OF_WEEK:
+                for tracks in schedule[term_idx][day_name]:
+                    for track_idx in range(layout.num_tracks):
+                        code = next(cells)
+                        if code: tracks[track_idx] = Placement(layout.item_names[(code - 1) // num_teachers], layout.teacher_names[(code - 1) % num_teachers])
+        return schedule
+
+    def placed_courses(self):
+        num_items = len(self.layout.item_names)
+        placed_courses = {}
+        for n, term_idx in enumerate(self.course_terms):
+            row = slice(n * num_items, (n + 1) * num_items)
+            placed_courses[term_idx] = self.layout.build_term_items(term_idx, [t - 1 if t else None for t in self.item_teachers[row]], self.placed_counts[row])
+        return placed_courses
+
+class ScheduleResult(MutableMapping):
+    """A generated or failed schedule entry: a mapping with the keys callers have always used.
+
+    'schedule' and 'placed_courses' are rebuilt from the CompactSchedule on each read, so only the
+    integer arrays are kept per result; assigning either key stores the given value instead.
+    """
+    LAZY_KEYS = ('schedule', 'placed_courses')
+
+    def __init__(self, compact, **fields):
+        self.compact = compact
+        self.fields = fields
+
+    def __getitem__(self, key):
+        if key in self.fields: return self.fields[key]
+        if key == 'schedule': return self.compact.schedule()
+        if key == 'placed_courses': return self.compact.placed_courses()
+        raise KeyError(key)
+
+    def __setitem__(self, key, value): self.fields[key] = value
+
+    def __delitem__(self, key):
+        if key in self.LAZY_KEYS and key not in self.fields: raise KeyError(f"{key} is rebuilt from the compact schedule and cannot be deleted")
+        del self.fields[key]
+
+    def __iter__(self):
+        yield from self.fields
+        yield from (key for key in self.LAZY_KEYS if key not in self.fields)
+
+    def __len__(self): return len(self.fields) + sum(1 for key in self.LAZY_KEYS if key not in self.fields)
+
+    def copy(self, **updates): return ScheduleResult(self.compact, **{**self.fields, **updates})
+
+class ScheduleEvaluator:
+    """NumPy evaluation of finished term schedules, one array operation per check over a batch.
+
+    A term schedule is an int array of shape (num_slots, num_tracks) holding the CompactSchedule
+    cell code (item_id * num_teachers + teacher_id + 1, 0 for an empty cell); a batch stacks such
+    arrays on a leading axis. evaluate_term() gives the completion, prep, ASSIGN pin and required-grade
+    results of SchedulingEngine._validate_term_state, and core_counts()/score_tuples() the ranking
+    score, for every schedule in the batch at once. Requires NumPy.
+    """
+    def __init__(self, problem):
+        if np is None: raise ImportError("ScheduleEvaluator requires NumPy.")
+        self.problem = problem
+        num_items = len(problem.item_names)
+        self.num_teachers = len(problem.teacher_names)
+        self.item_periods = np.array(problem.item_periods, dtype=np.int64)
+        self.term_masks = {t: np.isin(np.arange(num_items), ids) for t, ids in problem.term_items.items()}
+        self.teacher_avail = np.array(problem.teacher_avail_count, dtype=np.int64)
+        self.teacher_unusable = np.array(problem.teacher_max_teaching, dtype=np.int64) < 0
+        grades = problem.required_grades if problem.is_hs else ()
+        # Row g marks the items of required grade g; the last column is the empty-cell sentinel.
+        self.grade_items = np.zeros((len(grades), num_items + 1), dtype=bool)
+        for g_idx, grade in enumerate(grades):
+            self.grade_items[g_idx, :num_items] = [item_grade == grade for item_grade in problem.item_grades]
+        # (items, slots) of every pinned placement per term; each must hold its item on some track.
+        self.term_pins = {}
+        for t, pinned_state in problem.pinned_states.items():
+            pins = [(item, slot) for slot, tracks in enumerate(pinned_state.cells) for item in tracks if item is not None]
+            self.term_pins[t] = (np.array([item for item, _ in pins], dtype=np.int64), np.array([slot for _, slot in pins], dtype=np.int64))
+        self.item_ids = {name: i for i, name in enumerate(problem.item_names)}
+        self.teacher_ids = {name: t_id for t_id, name in enumerate(problem.teacher_names)}
+
+    def encode_term(self, term_grid):
+        """Cell codes for one term of a dict schedule. Cells naming unknown courses or teachers are left empty."""
+        problem = self.problem
+        codes = np.zeros((problem.num_slots, problem.num_tracks), dtype=np.int64)
+        for day_idx, day_name in enumerate(DAYS_OF_WEEK):
+            for p_idx, tracks in enumerate(term_grid.get(day_name, [])[:problem.num_periods_per_day]):
+                for track_idx, entry in enumerate(tracks[:problem.num_tracks]):
+                    if entry and entry[0] in self.item_ids and entry[1] in self.teacher_ids:
+                        codes[problem.slot_id(day_idx, p_idx), track_idx] = self.item_ids[entry[0]] * self.num_teachers + self.teacher_ids[entry[1]] + 1
+        return codes
+
+    @staticmethod
+    def _bincount_rows(values, size):
+        offsets = np.arange(len(values))[:, None] * size
+        return np.bincount((values + offsets).ravel(), minlength=len(values) * size).reshape(len(values), size)
+
+    def evaluate_term(self, term_idx, codes):
+        """Checks a batch of term schedules (shape (batch, num_slots, num_tracks)).
+
+        Returns a dict of per-schedule arrays: placed (periods per item, term items only), completion_rate,
+        unmet_prep_teachers_count, unmet_grade_slots_count and is_valid.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        batch_size, num_slots, num_tracks = codes.shape
+        num_items, num_teachers = len(self.item_periods), self.num_teachers
+        cells = codes.reshape(batch_size, num_slots * num_tracks)
+        term_mask = self.term_masks.get(term_idx, np.zeros(num_items, dtype=bool))
+        items = np.where(cells > 0, (cells - 1) // num_teachers, num_items)
+        in_term = np.append(term_mask, False)[items]  # Like TermState.from_schedule, courses of other terms are ignored.
+        items = np.where(in_term, items, num_items)
+        teachers = np.where(in_term, (cells - 1) % num_teachers, num_teachers)
+        placed = self._bincount_rows(items, num_items + 1)[:, :num_items]
+        load = self._bincount_rows(teachers, num_teachers + 1)[:, :num_teachers]
+        needed = self.item_periods[term_mask].sum()
+        completion = placed.sum(axis=1) / needed if needed > 0 else np.ones(batch_size)
+        unmet_prep = ((self.teacher_unusable & (load > 0)) | (self.teacher_avail - load < MIN_PREP_BLOCKS_PER_WEEK)).sum(axis=1)
+        is_valid = (completion >= MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE) & (unmet_prep == 0)
+        pin_items, pin_slots = self.term_pins.get(term_idx, ((), ()))
+        if len(pin_items):
+            slot_items = items.reshape(batch_size, num_slots, num_tracks)
+            is_valid &= (slot_items[:, pin_slots, :] == pin_items[None, :, None]).any(axis=2).all(axis=1)
+        unmet_grade_slots = np.zeros(batch_size, dtype=np.int64)
+        if len(self.grade_items):
+            covered = self.grade_items[:, items].reshape(len(self.grade_items), batch_size, num_slots, num_tracks).any(axis=3)
+            unmet_grade_slots = (~covered).sum(axis=(0, 2))
+            any_grade_placed = ((placed > 0) & self.grade_items[:, :num_items].any(axis=0)).any(axis=1)
+            is_valid &= any_grade_placed & (unmet_grade_slots == 0)
+        return {'placed': placed, 'completion_rate': completion, 'unmet_prep_teachers_count': unmet_prep,
+                'unmet_grade_slots_count': unmet_grade_slots, 'is_valid': is_valid}
+
+    @staticmethod
+    def core_counts(item_records, placed):
+        """Distinct grade 11 and grade 12 core courses with at least one placed period, per row of placed (batch, items)."""
+        placed = np.asarray(placed).reshape(-1, len(item_records)) > 0
+        counts = []
+        for grade in (11, 12):
+            core_items = [i for i, r in enumerate(item_records) if r.subject_area in CORE_SUBJECTS_HS and r.grade_level == grade]
+            names = sorted({item_records[i].name for i in core_items})
+            membership = np.zeros((len(item_records), len(names)), dtype=np.int64)
+            for i in core_items: membership[i, names.index(item_records[i].name)] = 1
+            counts.append(((placed.astype(np.int64) @ membership) > 0).sum(axis=1))
+        return counts[0], counts[1]
+
+    @staticmethod
+    def score_tuples(g11_counts, g12_counts):
+        """The ranking score tuple (see SchedulingEngine.generate_schedules) as a (batch, 4) array."""
+        return np.stack([g11_counts >= 2, g11_counts, g12_counts >= 2, g12_counts], axis=1).astype(np.int64)
+
+class TermState:
+    """Mutable occupancy for one term of one attempt, with every feasibility test kept as a slot bitmask.
+
+    Bit s of a mask is slot s of the week (see CompiledProblem). The candidate slots for an item are a
+    single AND over the teacher's availability and busy masks, the item's NOT mask, its same-day block
+    and the mask of slots whose tracks are all taken. The counters used by the repair penalty
+    (unplaced periods, uncovered required-grade slots, teachers short of prep) are kept up to date
+    by place() and unplace() so moves can be scored incrementally.
+
+    The fingerprint is kept up to date by place() and unplace() too. Each item sums a random key per
+    placed (slot, teacher), keyed by its section class, and the term sums a mix of those per-item
+    values (all mod 2**64). The track an item lands on is not part of the key, and identical sections
+    share keys, so schedules that differ only by track order or by swapping identical sections share
+    a fingerprint. objective_value is the problem's ScheduleObjective for the term, kept the same way.
+    """
+    def __init__(self, problem, term_idx):
+        self.problem = problem
+        self.term_idx = term_idx
+        num_teachers = len(problem.teacher_names)
+        term_item_ids = problem.term_items.get(term_idx, ())
+        self.cells = [[None] * problem.num_tracks for _ in range(problem.num_slots)]
+        self.free_tracks = [problem.num_tracks] * problem.num_slots
+        self.full_mask = 0 if problem.num_tracks > 0 else problem.all_slots_mask
+        self.teacher_busy = [0] * num_teachers
+        self.teacher_load = [0] * num_teachers
+        self.item_teacher = {}
+        self.item_placed = dict.fromkeys(term_item_ids, 0)
+        self.item_slot_mask = dict.fromkeys(term_item_ids, 0)
+        self.item_day_block = dict.fromkeys(term_item_ids, 0)
+        tracked_grades = problem.required_grades if problem.is_hs else ()
+        self.grade_cover = {g: 0 for g in problem.required_grades}
+        self.grade_cover_count = {g: [0] * problem.num_slots for g in tracked_grades}
+        self.slot_items = [0] * problem.num_slots
+        self.cohort_block = dict.fromkeys(term_item_ids, 0)
+        self.unplaced_periods = sum(problem.item_periods[i] for i in term_item_ids)
+        self.uncovered_slots = len(tracked_grades) * problem.num_slots
+        self.prep_violations = sum(1 for t_id in range(num_teachers) if problem.teacher_max_teaching[t_id] < 0)
+        self.item_fingerprint = dict.fromkeys(term_item_ids, 0)
+        self.fingerprint = 0
+        self.objective_value = 0.0
+
+    def candidate_mask(self, item, t_id, forced_period=None):
+        problem = self.problem
+        mask = problem.item_domain_masks[item] & problem.teacher_avail_masks[t_id] & ~(self.teacher_busy[t_id] | problem.item_not_masks[item] | self.full_mask | self.item_day_block[item] | self.item_slot_mask[item] | self.cohort_block[item])
+        if forced_period is not None: mask &= problem.period_masks[forced_period]
+        return mask
+
+    def forced_period(self, item):
+        """The period an item is locked to under force_same_time, or None."""
+        if not self.problem.force_same_time or not self.item_slot_mask[item]: return None
+        return self.problem.slot_period[next(_iter_bits(self.item_slot_mask[item]))]
+
+    def place(self, item, t_id, slot):
+        problem = self.problem
+        if problem.objective is not None: self.objective_value += problem.objective.place_delta(self, item, t_id, slot)
+        bit = 1 << slot
+        tracks = self.cells[slot]
+        track_idx = tracks.index(None)
+        tracks[track_idx] = item
+        self.free_tracks[slot] -= 1
+        if self.free_tracks[slot] == 0: self.full_mask |= bit
+        self.teacher_busy[t_id] |= bit
+        self.item_slot_mask[item] |= bit
+        self.item_placed[item] += 1
+        self.unplaced_periods -= 1
+        self._change_fingerprint(item, problem.placement_key(item, t_id, slot))
+        self._change_teacher_load(t_id, 1)
+        if not problem.allow_multiple_same_day: self.item_day_block[item] |= problem.day_masks[problem.slot_day[slot]]
+        cover_counts = self.grade_cover_count.get(problem.item_grades[item])
+        if cover_counts is not None:
+            if cover_counts[slot] == 0:
+                self.grade_cover[problem.item_grades[item]] |= bit
+                self.uncovered_slots -= 1
+            cover_counts[slot] += 1
+        self.slot_items[slot] |= 1 << item
+        for other in problem.item_conflicts[item]:
+            if other in self.cohort_block: self.cohort_block[other] |= bit
+        return track_idx
+
+    def unplace(self, item, slot):
+        problem = self.problem
+        bit = 1 << slot
+        t_id = self.item_teacher[item]
+        tracks = self.cells[slot]
+        tracks[tracks.index(item)] = None
+        self.free_tracks[slot] += 1
+        self.full_mask &= ~bit
+        self.teacher_busy[t_id] &= ~bit
+        self.item_slot_mask[item] &= ~bit
+        self.item_placed[item] -= 1
+        self.unplaced_periods += 1
+        self._change_fingerprint(item, -problem.placement_key(item, t_id, slot))
+        self._change_teacher_load(t_id, -1)
+        if not problem.allow_multiple_same_day: self.item_day_block[item] &= ~problem.day_masks[problem.slot_day[slot]]
+        cover_counts = self.grade_cover_count.get(problem.item_grades[item])
+        if cover_counts is not None:
+            cover_counts[slot] -= 1
+            if cover_counts[slot] == 0:
+                self.grade_cover[problem.item_grades[item]] &= ~bit
+                self.uncovered_slots += 1
+        self.slot_items[slot] &= ~(1 << item)
+        for other in problem.item_conflicts[item]:
+            if other in self.cohort_block and not self.slot_items[slot] & problem.item_conflict_bits[other]:
+                self.cohort_block[other] &= ~bit
+        if problem.objective is not None: self.objective_value -= problem.objective.place_delta(self, item, t_id, slot)
+
+    def _change_fingerprint(self, item, key_delta):
+        old = self.item_fingerprint[item]
+        new = self.item_fingerprint[item] = (old + key_delta) & FINGERPRINT_MASK
+        self.fingerprint = (self.fingerprint + _mix64(new) - _mix64(old)) & FINGERPRINT_MASK
+
+    def _change_teacher_load(self, t_id, delta):
+        max_teaching = self.problem.teacher_max_teaching[t_id]
+        was_violating = self.teacher_load[t_id] > max_teaching
+        self.teacher_load[t_id] += delta
+        self.prep_violations += (self.teacher_load[t_id] > max_teaching) - was_violating
+
+    def penalty(self, weights):
+        return weights['grade_slot'] * self.uncovered_slots + weights['prep'] * self.prep_violations + weights['unplaced'] * self.unplaced_periods
+
+    def has_cohort_clash(self, item, slot):
+        return bool(self.slot_items[slot] & self.problem.item_conflict_bits[item])
+
+    def copy(self):
+        clone = TermState.__new__(TermState)
+        clone.problem = self.problem
+        clone.term_idx = self.term_idx
+        clone.cells = [list(tracks) for tracks in self.cells]
+        clone.free_tracks = list(self.free_tracks)
+        clone.full_mask = self.full_mask
+        clone.teacher_busy = list(self.teacher_busy)
+        clone.teacher_load = list(self.teacher_load)
+        clone.item_teacher = dict(self.item_teacher)
+        clone.item_placed = dict(self.item_placed)
+        clone.item_slot_mask = dict(self.item_slot_mask)
+        clone.item_day_block = dict(self.item_day_block)
+        clone.grade_cover = dict(self.grade_cover)
+        clone.grade_cover_count = {g: list(counts) for g, counts in self.grade_cover_count.items()}
+        clone.slot_items = list(self.slot_items)
+        clone.cohort_block = dict(self.cohort_block)
+        clone.unplaced_periods = self.unplaced_periods
+        clone.uncovered_slots = self.uncovered_slots
+        clone.prep_violations = self.prep_violations
+        clone.item_fingerprint = dict(self.item_fingerprint)
+        clone.fingerprint = self.fingerprint
+        clone.objective_value = self.objective_value
+        return clone
+
+    def write_schedule(self, term_grid):
+        problem = self.problem
+        for slot, tracks in enumerate(self.cells):
+            grid_tracks = term_grid[DAYS_OF_WEEK[problem.slot_day[slot]]][problem.slot_period[slot]]
+            for track_idx, item in enumerate(tracks):
+                if item is not None: grid_tracks[track_idx] = Placement(problem.item_names[item], problem.teacher_names[self.item_teacher[item]])
+
+    @classmethod
+    def from_schedule(cls, problem, term_idx, term_grid, placed_items, pinned_state=None):
+        """Rebuilds a TermState from the dict schedule and placed-course list an attempt returned.
+
+        With pinned_state the rebuild starts from a copy of it: pinned items keep their teacher and the
+        grid's cells for pinned placements are skipped rather than placed twice.
+        """
+        state = pinned_state.copy() if pinned_state else cls(problem, term_idx)
+        item_by_name = {problem.item_names[i]: i for i in state.item_placed}
+        teacher_by_name = {name: t_id for t_id, name in enumerate(problem.teacher_names)}
+        for placed_item in placed_items or []:
+            item = item_by_name.get(placed_item.get('name'))
+            if item is not None and placed_item.get('teacher') in teacher_by_name:
+                state.item_teacher.setdefault(item, teacher_by_name[placed_item['teacher']])
+        for day_idx, day_name in enumerate(DAYS_OF_WEEK):
+            for p_idx, tracks in enumerate(term_grid.get(day_name, [])):
+                for entry in tracks:
+                    if not entry: continue
+                    item = item_by_name.get(entry[0])
+                    if item is None or entry[1] not in teacher_by_name: continue
+                    slot = problem.slot_id(day_idx, p_idx)
+                    if pinned_state is not None and pinned_state.item_slot_mask[item] >> slot & 1: continue
+                    state.item_teacher.setdefault(item, teacher_by_name[entry[1]])
+                    state.place(item, state.item_teacher[item], slot)
+        return state
+
+class ExactTermSolver:
+    """Complete depth-first search for one term: forward checking plus conflict-directed backjumping.
+
+    Variables are the next unplaced period of each item. A value is a (teacher, slot) pair, or closing
+    the item so its remaining periods stay unplaced, which is allowed while the term's unplaced periods
+    stay within the validation threshold. An item's periods are placed in increasing slot order and
+    its teacher is fixed by its first searched period, so no schedule is visited twice. After every
+    assignment each open item must keep a slot (or fit in the unplaced budget) and every uncovered
+    required-grade slot must stay reachable. Each dead end returns the set of search depths that caused
+    it (as a bitmask), so the search jumps straight back to the deepest of them. Mirror schedules are
+    skipped: only the first unused teacher of an interchangeable class is tried, and identical
+    sections start in order of id.
+
+    solve() returns 'solved' (self.state then holds a valid term), 'infeasible' (the search space was
+    exhausted, given the pinned placements) or 'limit' (node or time limit hit first).
+    """
+    def __init__(self, problem, term_idx, node_limit, deadline):
+        # Search the static domains: the propagated ones assume every item is fully placed.
+        problem = copy.copy(problem)
+        problem.item_domain_masks = problem.item_static_domain_masks
+        self.problem = problem
+        pinned_state = problem.pinned_states.get(term_idx)
+        self.state = pinned_state.copy() if pinned_state else TermState(problem, term_idx)
+        self.state.problem = problem
+        term_item_ids = problem.term_items.get(term_idx, ())
+        total_periods = sum(problem.item_periods[i] for i in term_item_ids)
+        self.budget = int(total_periods * (1 - MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE) + 1e-9)
+        self.items = [i for i in term_item_ids if problem.item_periods[i] > self.state.item_placed[i]]
+        self.grades = problem.required_grades if problem.is_hs else ()
+        self.node_limit = node_limit
+        self.deadline = deadline
+        num_teachers = len(problem.teacher_names)
+        self.teacher_slot_depths = [[0] * problem.num_slots for _ in range(num_teachers)]
+        self.teacher_depths = [0] * num_teachers
+        self.slot_depths = [0] * problem.num_slots
+        self.item_slot_depth = {}
+        self.item_depths = dict.fromkeys(self.items, 0)
+        self.item_last_slot = dict.fromkeys(self.items, -1)
+        self.search_teacher = set()
+        # Identical sections: whenever two have started, the lower id's first slot is no later than the other's.
+        classes = defaultdict(list)
+        for i in self.items:
+            if i not in self.state.item_teacher and not self.state.item_placed[i]: classes[problem.item_class[i]].append(i)
+        self.twins = {i: [j for j in members if j != i] for members in classes.values() if len(members) > 1 for i in members}
+        self.closed = set()
+        self.lost = 0
+        self.closed_depths = 0
+        self.all_depths = 0
+        self.nodes = 0
+        self.limit_hit = False
+
+    def solve(self):
+        result = self._search()
+        if result is True: return 'solved'
+        return 'limit' if self.limit_hit else 'infeasible'
+
+    def _teachers(self, item):
+        if item in self.state.item_teacher: return [self.state.item_teacher[item]]
+        return [t for t in _break_teacher_symmetry(self.problem, self.problem.item_qualified_teachers[item], self.state.teacher_load)
+                if self.state.teacher_load[t] < self.problem.teacher_max_teaching[t]]
+
+    def _domain(self, item, t_id):
+        if self.state.teacher_load[t_id] >= self.problem.teacher_max_teaching[t_id]: return 0
+        mask = self.state.candidate_mask(item, t_id, self.state.forced_period(item)) & ~((1 << (self.item_last_slot[item] + 1)) - 1)
+        if not self.state.item_placed[item]:
+            for twin in self.twins.get(item, ()):
+                twin_slots = self.state.item_slot_mask[twin]
+                if not twin_slots: continue
+                first_slot = (twin_slots & -twin_slots).bit_length() - 1
+                mask &= ~((1 << first_slot) - 1) if twin < item else (1 << (first_slot + 1)) - 1
+        return mask
+
+    def _explain(self, item):
+        """Depths whose assignments removed any (teacher, slot) value from item."""
+        problem, state = self.problem, self.state
+        reasons = self.item_depths[item]
+        if not state.item_placed[item]:
+            for twin in self.twins.get(item, ()): reasons |= self.item_depths[twin]
+        teachers = [state.item_teacher[item]] if item in state.item_teacher else problem.item_qualified_teachers[item]
+        for t_id in teachers:
+            if state.teacher_load[t_id] >= problem.teacher_max_teaching[t_id]:
+                reasons |= self.teacher_depths[t_id]
+                continue
+            static = problem.item_domain_masks[item] & problem.teacher_avail_masks[t_id] & ~problem.item_not_masks[item]
+            for slot in _iter_bits(static & ~self._domain(item, t_id)):
+                bit = 1 << slot
+                if state.teacher_busy[t_id] & bit: reasons |= self.teacher_slot_depths[t_id][slot]
+                if state.full_mask & bit: reasons |= self.slot_depths[slot]
+                if state.cohort_block[item] & bit:
+                    for other in problem.item_conflicts[item]: reasons |= self.item_slot_depth.get((other, slot), 0)
+        return reasons
+
+    def _assign(self, item, t_id, slot, depth):
+        bit = 1 << depth
+        new_teacher = item not in self.state.item_teacher
+        if new_teacher:
+            self.state.item_teacher[item] = t_id
+            self.search_teacher.add(item)
+        self.state.place(item, t_id, slot)
+        self.teacher_slot_depths[t_id][slot] = bit
+        self.teacher_depths[t_id] |= bit
+        self.slot_depths[slot] |= bit
+        self.item_slot_depth[(item, slot)] = bit
+        self.item_depths[item] |= bit
+        self.all_depths |= bit
+        previous_last = self.item_last_slot[item]
+        self.item_last_slot[item] = slot
+        return new_teacher, previous_last
+
+    def _unassign(self, item, t_id, slot, depth, new_teacher, previous_last):
+        bit = ~(1 << depth)
+        self.state.unplace(item, slot)
+        if new_teacher:
+            del self.state.item_teacher[item]
+            self.search_teacher.discard(item)
+        self.teacher_slot_depths[t_id][slot] = 0
+        self.teacher_depths[t_id] &= bit
+        self.slot_depths[slot] &= bit
+        del self.item_slot_depth[(item, slot)]
+        self.item_depths[item] &= bit
+        self.all_depths &= bit
+        self.item_last_slot[item] = previous_last
+
+    def _search(self):
+        """Returns True when the state is a solution, None when a limit was hit, else the conflict bitmask.
+
+        Each search depth is an _ExactFrame on an explicit stack, so deep searches (one depth per placed
+        period or closed item) never reach Python's recursion limit. A frame's open branch is undone
+        before its result moves up to the parent frame, except a solution, which is kept in place.
+        """
+        stack, node = [], self._open_node(0)
+        while True:
+            if isinstance(node, _ExactFrame):
+                stack.append(node)
+            elif not stack or node is True:
+                return node
+            else:
+                node = self._end_branch(stack[-1], node)
+                if node is not _ExactFrame.CONTINUE:
+                    stack.pop()
+                    continue
+            opened, node = self._next_branch(stack[-1])
+            if not opened: stack.pop()
+
+    def _open_node(self, depth):
+        """Checks the state at depth; returns True, None or a conflict bitmask as _search does, or the frame to branch on."""
+        problem, state = self.problem, self.state
+        self.nodes += 1
+        if self.nodes > self.node_limit or (self.nodes % 256 == 0 and time.monotonic() > self.deadline):
+            self.limit_hit = True
+            return None
+        open_items, domains, wiped_loss, wiped_reasons = [], {}, 0, 0
+        for i in self.items:
+            if i in self.closed or state.item_placed[i] >= problem.item_periods[i]: continue
+            domain = 0
+            for t_id in self._teachers(i): domain |= self._domain(i, t_id)
+            if domain:
+                open_items.append(i)
+                domains[i] = domain
+            else:
+                wiped_loss += problem.item_periods[i] - state.item_placed[i]
+                wiped_reasons |= self._explain(i)
+        if self.lost + wiped_loss > self.budget: return wiped_reasons | self.closed_depths
+        # Counting bounds: open periods beyond the free tracks they can reach, or beyond their fixed teacher's capacity, are lost too.
+        reachable, open_periods, teacher_periods = 0, 0, defaultdict(int)
+        for i in open_items:
+            reachable |= domains[i]
+            open_periods += problem.item_periods[i] - state.item_placed[i]
+            if i in state.item_teacher: teacher_periods[state.item_teacher[i]] += problem.item_periods[i] - state.item_placed[i]
+        bound_loss = max(0, open_periods - sum(state.free_tracks[slot] for slot in _iter_bits(reachable)))
+        bound_loss = max(bound_loss, sum(max(0, n - (problem.teacher_max_teaching[t] - state.teacher_load[t])) for t, n in teacher_periods.items()))
+        if self.lost + wiped_loss + bound_loss > self.budget: return self.all_depths
+        for grade in self.grades:
+            uncovered = problem.all_slots_mask & ~state.grade_cover[grade]
+            if not uncovered: continue
+            grade_items = [i for i in open_items if problem.item_grades[i] == grade]
+            reachable = 0
+            for i in grade_items: reachable |= domains[i]
+            if uncovered & ~reachable or _popcount(uncovered) > sum(problem.item_periods[i] - state.item_placed[i] for i in grade_items):
+                return self.all_depths
+        if not open_items: return True
+        item = min(open_items, key=lambda i: (_popcount(domains[i]), problem.item_grades[i] not in self.grades))
+        uncovered = problem.all_slots_mask & ~state.grade_cover[problem.item_grades[item]] if problem.item_grades[item] in self.grades else 0
+        return _ExactFrame(depth, item, self._explain(item), self._values(item, uncovered))
+
+    def _values(self, item, uncovered):
+        """(teacher, slot) values of item, slots of still uncovered required-grade periods first.
+
+        Values go slot by slot, every teacher before the next slot: identical sections must start in slot
+        order, so packing one teacher's early slots first would push the later sections out of the week.
+        """
+        domains = [(t_id, self._domain(item, t_id)) for t_id in self._teachers(item)]
+        reachable = 0
+        for _, domain in domains: reachable |= domain
+        for slot in [*_iter_bits(reachable & uncovered), *_iter_bits(reachable & ~uncovered)]:
+            for t_id, domain in domains:
+                if domain >> slot & 1: yield t_id, slot
+
+    def _next_branch(self, frame):
+        """Opens frame's next branch: returns (True, child node), or (False, frame's result) once none is left."""
+        for t_id, slot in frame.values:
+            frame.branch = (t_id, slot, self._assign(frame.item, t_id, slot, frame.depth))
+            return True, self._open_node(frame.depth + 1)
+        remaining = self.problem.item_periods[frame.item] - self.state.item_placed[frame.item]
+        if self.lost + remaining > self.budget: return False, frame.conflicts | self.closed_depths
+        depth_bit = 1 << frame.depth
+        self.closed.add(frame.item)
+        self.lost += remaining
+        self.closed_depths |= depth_bit
+        self.all_depths |= depth_bit
+        frame.branch = remaining
+        return True, self._open_node(frame.depth + 1)
+
+    def _end_branch(self, frame, result):
+        """Undoes frame's open branch, whose subtree failed with result (None or a conflict bitmask).
+
+        Returns _ExactFrame.CONTINUE to try the next branch, else frame's own result.
+        """
+        depth_bit = 1 << frame.depth
+        if isinstance(frame.branch, tuple):
+            t_id, slot, undo = frame.branch
+            self._unassign(frame.item, t_id, slot, frame.depth, *undo)
+            if result is None or not result & depth_bit: return result
+            frame.conflicts |= result & ~depth_bit
+            return _ExactFrame.CONTINUE
+        self.closed.discard(frame.item)
+        self.lost -= frame.branch
+        self.closed_depths &= ~depth_bit
+        self.all_depths &= ~depth_bit
+        if result is None or not result & depth_bit: return result
+        return frame.conflicts | (result & ~depth_bit)
+
+class _ReplaceFrame:
+    """One node of SchedulingEngine._exact_replace's search: the item being placed, its untried slots and the placed one."""
+    __slots__ = ('idx', 'remaining', 'item', 'still_needed', 'slots', 'placed')
+
+    def __init__(self, idx, remaining, item, still_needed, slots):
+        self.idx = idx
+        self.remaining = remaining
+        self.item = item
+        self.still_needed = still_needed
+        self.slots = iter(slots)
+        self.placed = None
+
+class _ExactFrame:
+    """One depth of ExactTermSolver's search. branch is the open (teacher, slot, undo) assignment, or the unplaced periods of a closed item."""
+    __slots__ = ('depth', 'item', 'conflicts', 'values', 'branch')
+    CONTINUE = object()
+
+    def __init__(self, depth, item, conflicts, values):
+        self.depth = depth
+        self.item = item
+        self.conflicts = conflicts
+        self.values = values
+        self.branch = None
+
+def _popcount(mask): return bin(mask).count("1")
+
+def _mix64(value):
+    """splitmix64 finalizer: a 64-bit bijection with _mix64(0) == 0."""
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & FINGERPRINT_MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & FINGERPRINT_MASK
+    return value ^ (value >> 31)
+
+def _break_teacher_symmetry(problem, teachers, teacher_load):
+    """Keeps only the first unused teacher of each interchangeable class; the others would give mirror schedules."""
+    kept, seen_classes = [], set()
+    for t_id in teachers:
+        if teacher_load[t_id] == 0:
+            if problem.teacher_class[t_id] in seen_classes: continue
+            seen_classes.add(problem.teacher_class[t_id])
+        kept.append(t_id)
+    return kept
+
+def _iter_bits(mask):
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+def _min_cost_flow(num_nodes, arcs, source, sink):
+    """Successive-shortest-path min-cost max-flow. arcs is a list of (u, v, capacity, cost); returns the flow on each arc."""
+    graph = [[] for _ in range(num_nodes)]
+    arc_to, arc_cap, arc_cost = [], [], []
+    for u, v, capacity, cost in arcs:
+        graph[u].append(len(arc_to)); arc_to.append(v); arc_cap.append(capacity); arc_cost.append(cost)
+        graph[v].append(len(arc_to)); arc_to.append(u); arc_cap.append(0); arc_cost.append(-cost)
+    while True:
+        dist = [float('inf')] * num_nodes
+        prev_arc = [-1] * num_nodes
+        in_queue = [False] * num_nodes
+        dist[source] = 0
+        queue = deque([source])
+        while queue:
+            u = queue.popleft()
+            in_queue[u] = False
+            for a in graph[u]:
+                v = arc_to[a]
+                if arc_cap[a] > 0 and dist[u] + arc_cost[a] < dist[v]:
+                    dist[v] = dist[u] + arc_cost[a]
+                    prev_arc[v] = a
+                    if not in_queue[v]:
+                        in_queue[v] = True
+                        queue.append(v)
+        if dist[sink] == float('inf'): break
+        push, v = float('inf'), sink
+        while v != source:
+            push = min(push, arc_cap[prev_arc[v]])
+            v = arc_to[prev_arc[v] ^ 1]
+        v = sink
+        while v != source:
+            arc_cap[prev_arc[v]] -= push
+            arc_cap[prev_arc[v] ^ 1] += push
+            v = arc_to[prev_arc[v] ^ 1]
+    return [arc_cap[2 * k + 1] for k in range(len(arcs))]
+
 class SchedulingEngine:
     def __init__(self):
         self.params = {
@@ -211,27 +1280,44 @@ class SchedulingEngine:
         self.courses_data = []
         self.subjects_data = []
         self.cohort_constraints = []
-        self.high_school_credits_db = copy.deepcopy(HIGH_SCHOOL_COURSE_CREDITS_TEMPLATE)
+        self.high_school_credits_db = freeze(HIGH_SCHOOL_COURSE_CREDITS_TEMPLATE)
         self.generated_schedules_details = []
-        self.current_run_log = []
+        self.engine_options = dict(DEFAULT_ENGINE_OPTIONS)
+        self.current_run_log = self._new_log(run=True)
+        self.run_seed = 0
+        self.learned_item_priorities = {}
+        self.symmetry_report = {}
+        self.portfolio_history = []
+        self.run_deadline = None
 
     def set_parameters(self, params_dict):
-        self.params = copy.deepcopy(params_dict)
-        self._log_message(f"Engine received parameters: num_periods_per_day={self.params.get('num_periods_per_day')}, num_terms={self.params.get('num_terms')}, school_type={self.params.get('school_type')}, num_concurrent_tracks_per_period={self.params.get('num_concurrent_tracks_per_period')}", "DEBUG")
-
-    def set_teachers(self, teachers_list): self.teachers_data = copy.deepcopy(teachers_list)
-    def set_courses(self, courses_list): self.courses_data = copy.deepcopy(courses_list)
-    def set_subjects(self, subjects_list): self.subjects_data = copy.deepcopy(subjects_list)
-    def set_cohort_constraints(self, constraints_list): self.cohort_constraints = copy.deepcopy(constraints_list)
-    def set_hs_credits_db(self, db_dict): self.high_school_credits_db = copy.deepcopy(db_dict)
-    def get_parameters(self): return copy.deepcopy(self.params)
+        self.params = freeze(params_dict)
+        self._log_message("Engine received parameters: num_periods_per_day={periods}, num_terms={terms}, school_type={school_type}, num_concurrent_tracks_per_period={tracks}", "DEBUG", 'parameters',
+                          periods=self.params.get('num_periods_per_day'), terms=self.params.get('num_terms'), school_type=self.params.get('school_type'), tracks=self.params.get('num_concurrent_tracks_per_period'))
+
+    def set_teachers(self, teachers_list): self.teachers_data = freeze(teachers_list)
+    def set_courses(self, courses_list): self.courses_data = freeze(courses_list)
+    def set_subjects(self, subjects_list): self.subjects_data = freeze(subjects_list)
+    def set_cohort_constraints(self, constraints_list): self.cohort_constraints = freeze(constraints_list)
+    def set_hs_credits_db(self, db_dict): self.high_school_credits_db = freeze(db_dict)
+    def set_engine_options(self, options_dict): self.engine_options = {**DEFAULT_ENGINE_OPTIONS, **copy.deepcopy(options_dict)}
+    def get_engine_options(self): return dict(self.engine_options)
+    # Top-level keys of the copy may be changed freely; nested values are shared read-only snapshots.
+    def get_parameters(self): return dict(self.params)
     def get_generated_schedules(self): return self.generated_schedules_details
-    def get_run_log(self): return self.current_run_log
+    def get_run_log(self): return self.current_run_log.lines()
+    def get_learned_priorities(self): return dict(self.learned_item_priorities)
+    def get_portfolio_history(self): return list(self.portfolio_history)
+    def get_symmetry_report(self): return dict(self.symmetry_report)
 
-    def _log_message(self, message, level="INFO"):
-        log_entry = f"[{level}] {datetime.datetime.now().strftime('%H:%M:%S')} {message}"
-        print(log_entry)
-        self.current_run_log.append(log_entry)
+    def _log_message(self, message, level="INFO", event=None, **fields):
+        self.current_run_log(message, level, event, **fields)
+
+    def _new_log(self, run=False):
+        """A RunLog at the configured level: the run log is bounded (and echoed with log_echo), attempt and stage logs are not."""
+        level = self.engine_options.get('log_level', 'INFO')
+        if not run: return RunLog(level)
+        return RunLog(level, int(self.engine_options.get('log_buffer_size') or 0) or None, self.engine_options.get('log_echo', False))
 
     def suggest_non_instructional_days(self):
         # This function is unchanged.
@@ -247,99 +1333,143 @@ class SchedulingEngine:
         return []
 
 
+    def analyze_feasibility(self):
+        """Checks necessary conditions on the current inputs without running any attempt.
+
+        Compiles the problem (pins and slot domains included) and compares demand with capacity using
+        counting and flow bounds: track capacity per term, teacher capacity per term, a max-flow of
+        course periods onto qualified teachers (shortfall per subject area), each teacher's share of
+        the periods they are qualified for (an estimate, so 'tight' at most), and per required grade the course periods and reachable
+        slots against the slots that need a class. Returns a list of bottleneck dicts ranked worst
+        first, with keys kind, name, term, demand, capacity, utilization, severity and message.
+        Severity is 'infeasible' (no attempt can pass validation), 'shortfall' (some periods cannot be
+        placed) or 'tight' (at least FEASIBILITY_TIGHT_UTILIZATION of capacity is needed).
+        """
+        problem = self._compile_problem(lambda *args, **fields: None)
+        findings = []
+        def add(kind, name, term, demand, capacity, severity, message):
+            utilization = demand / capacity if capacity > 0 else float('inf') if demand > 0 else 0.0
+            if severity is None:
+                if demand > capacity: severity = 'shortfall'
+                elif utilization >= FEASIBILITY_TIGHT_UTILIZATION: severity = 'tight'
+                else: return
+            findings.append({'kind': kind, 'name': name, 'term': term, 'demand': demand, 'capacity': capacity,
+                             'utilization': utilization, 'severity': severity, 'message': message})
+        if problem.input_error:
+            add('input', 'inputs', None, 0, 0, 'infeasible', problem.input_error[0])
+            return findings
+        for conflict in problem.pin_conflicts:
+            add('pin', 'ASSIGN constraints', None, 0, 0, 'infeasible', conflict)
+        for conflict in problem.domain_conflicts:
+            add('domain', 'slot domains', None, 0, 0, 'infeasible', conflict)
+        num_teachers = len(problem.teacher_names)
+        teacher_capacity = [max(0, m) for m in problem.teacher_max_teaching]
+        for term_idx, term_item_ids in sorted(problem.term_items.items()):
+            items = [i for i in term_item_ids if problem.item_periods[i] > 0]
+            if not items: continue
+            demand = sum(problem.item_periods[i] for i in items)
+            track_capacity = problem.num_slots * problem.num_tracks
+            add('term', f"Term {term_idx} tracks", term_idx, demand, track_capacity, None,
+                f"Term {term_idx} needs {demand} periods but has {track_capacity} track slots ({problem.num_slots} slots x {problem.num_tracks} tracks).")
+            add('term', f"Term {term_idx} teachers", term_idx, demand, sum(teacher_capacity), None,
+                f"Term {term_idx} needs {demand} periods but all teachers together can teach {sum(teacher_capacity)} (availability minus {MIN_PREP_BLOCKS_PER_WEEK} prep).")
+            # Max-flow of periods onto qualified teachers, within each course's slot domain.
+            teacher_node = lambda t: 1 + len(items) + t
+            sink = 1 + len(items) + num_teachers
+            arcs = [(0, 1 + n, problem.item_periods[i], 0) for n, i in enumerate(items)]
+            for n, i in enumerate(items):
+                for t in problem.item_qualified_teachers[i]:
+                    if teacher_capacity[t] and problem.teacher_avail_masks[t] & problem.item_static_domain_masks[i]:
+                        arcs.append((1 + n, teacher_node(t), problem.item_periods[i], 0))
+            arcs.extend((teacher_node(t), sink, teacher_capacity[t], 0) for t in range(num_teachers))
+            flows = _min_cost_flow(sink + 1, arcs, 0, sink)
+            subject_demand, subject_assigned, subject_teachers = defaultdict(int), defaultdict(int), defaultdict(set)
+            for n, i in enumerate(items):
+                subject_demand[problem.item_subjects[i]] += problem.item_periods[i]
+                subject_assigned[problem.item_subjects[i]] += flows[n]
+                subject_teachers[problem.item_subjects[i]].update(t for t in problem.item_qualified_teachers[i] if teacher_capacity[t])
+            for subject, subject_periods in subject_demand.items():
+                assignable = subject_assigned[subject]
+                qualified_capacity = sum(teacher_capacity[t] for t in subject_teachers[subject])
+                if assignable < subject_periods:
+                    add('subject', subject, term_idx, subject_periods, assignable, 'shortfall',
+                        f"Term {term_idx}: only {assignable} of {subject_periods} {subject} periods can be given a qualified teacher with capacity ({len(subject_teachers[subject])} qualified teacher(s)).")
+                else:
+                    add('subject', subject, term_idx, subject_periods, qualified_capacity, None,
+                        f"Term {term_idx}: {subject} needs {subject_periods} periods from {len(subject_teachers[subject])} qualified teacher(s) with {qualified_capacity} teaching periods between them.")
+            # Each teacher's fair share of the periods they are qualified for, and periods only they can teach.
+            share, exclusive = [0.0] * num_teachers, [0] * num_teachers
+            for i in items:
+                teachers = [t for t in problem.item_qualified_teachers[i] if teacher_capacity[t]]
+                for t in teachers: share[t] += problem.item_periods[i] / len(teachers)
+                if len(teachers) == 1: exclusive[teachers[0]] += problem.item_periods[i]
+            for t in range(num_teachers):
+                if exclusive[t] > teacher_capacity[t]:
+                    add('teacher', problem.teacher_names[t], term_idx, exclusive[t], teacher_capacity[t], 'shortfall',
+                        f"Term {term_idx}: {problem.teacher_names[t]} is the only qualified teacher for {exclusive[t]} periods but can teach {teacher_capacity[t]}.")
+                elif share[t] and share[t] >= FEASIBILITY_TIGHT_UTILIZATION * teacher_capacity[t]:
+                    # A proportional share is an estimate, not a bound, so it is never reported as a shortfall.
+                    add('teacher', problem.teacher_names[t], term_idx, round(share[t], 1), teacher_capacity[t], 'tight',
+                        f"Term {term_idx}: {problem.teacher_names[t]} carries about {share[t]:.1f} periods of shared demand against {teacher_capacity[t]} teaching periods.")
+            if not problem.is_hs: continue
+            for grade in problem.required_grades:
+                grade_items = [i for i in items if problem.item_grades[i] == grade]
+                grade_periods = sum(min(problem.item_periods[i], self._domain_capacity(problem, problem.item_static_domain_masks[i])) for i in grade_items)
+                if grade_periods < problem.num_slots:
+                    add('grade', f"Grade {grade}", term_idx, problem.num_slots, grade_periods, 'infeasible',
+                        f"Term {term_idx}: Grade {grade} needs a class in all {problem.num_slots} slots but its {len(grade_items)} course(s) can fill at most {grade_periods} periods.")
+                else:
+                    add('grade', f"Grade {grade}", term_idx, problem.num_slots, grade_periods, None,
+                        f"Term {term_idx}: Grade {grade} needs a class in all {problem.num_slots} slots from {grade_periods} placeable course periods.")
+        severity_rank = {'infeasible': 0, 'shortfall': 1, 'tight': 2}
+        findings.sort(key=lambda f: (severity_rank[f['severity']], -min(f['utilization'], 1e9)))
+        return findings
+
     # --- MODIFIED FUNCTION ---
     def generate_schedules(self, num_schedules_to_generate, max_total_attempts):
-        self.current_run_log = []
-        self._log_message(f"--- Starting Schedule Generation Run (Internal Target: {MAX_DISTINCT_SCHEDULES_TO_GENERATE}, Max Attempts: {max_total_attempts}) ---", "INFO")
+        self.current_run_log = self._new_log(run=True)
+        diversity = self.engine_options.get('diversity', False)
+        target = self._schedule_target(num_schedules_to_generate)
+        self._log_message(f"--- Starting Schedule Generation Run ({'Diverse' if diversity else 'Internal'} Target: {target}, Max Attempts: {max_total_attempts}) ---", "INFO")
         self.generated_schedules_details = []
-        generated_schedule_hashes = set()
-
-        best_failed_schedule_data = {
-            'schedule': None, 'log': [], 'placed_courses': None,
-            'metrics': {'overall_completion_rate': 0.0, 'unmet_grade_slots_count': float('inf'), 'unmet_prep_teachers_count': float('inf')}
+        self.learned_item_priorities = {}
+        run_state = {
+            'target': target,
+            'placements': [] if diversity else None,
+            'tabu': {},
+            'hashes': set(),
+            'best_failed': {
+                'schedule': None, 'log_summary': None, 'placed_courses': None,
+                'metrics': {'overall_completion_rate': 0.0, 'unmet_grade_slots_count': float('inf'), 'unmet_prep_teachers_count': float('inf')}
+            },
         }
-
-        original_courses_data = copy.deepcopy(self.courses_data)
-        original_cohort_constraints = copy.deepcopy(self.cohort_constraints)
-
-        for attempt_num in range(max_total_attempts):
-            if len(self.generated_schedules_details) >= MAX_DISTINCT_SCHEDULES_TO_GENERATE:
-                self._log_message(f"Internal target of {MAX_DISTINCT_SCHEDULES_TO_GENERATE} distinct schedules reached. Stopping generation.", "INFO")
-                break
-
-            self._log_message(f"--- Overall Schedule Gen Attempt {attempt_num + 1}/{max_total_attempts} ---", "DEBUG")
-
-            single_attempt_log_capture = []
-            # MODIFIED: Capture the final course list from the attempt
-            current_schedule, is_successful_attempt, attempt_metrics, placed_courses = self._generate_single_schedule_attempt(attempt_seed_modifier=attempt_num, attempt_log_list=single_attempt_log_capture)
-
-            self.current_run_log.extend(single_attempt_log_capture)
-
-            if current_schedule is None:
-                self._log_message("CRITICAL ERROR: Fundamental input issues prevent scheduling. Check detailed logs from attempt.", "ERROR")
+        self.run_seed = self._resolve_run_seed()
+        num_workers = self._resolve_num_workers()
+        self._log_message(f"Run seed: {self.run_seed}, worker processes: {num_workers}.", "INFO")
+        time_limit = self.engine_options.get('time_limit')
+        self.run_deadline = time.monotonic() + float(time_limit) if time_limit else None
+        if self.engine_options.get('portfolio'):
+            return self._run_portfolio(num_schedules_to_generate, max_total_attempts)
+
+        original_courses_data = self.courses_data
+        original_cohort_constraints = self.cohort_constraints
+
+        use_exact = self.engine_options.get('solver', 'greedy') == 'exact'
+        exact_outcome = self._run_exact_solver(run_state) if use_exact else None
+        if exact_outcome is False:
+            return False
+        if exact_outcome == 'infeasible':
+            self._log_message("EXACT: Running randomized attempts to report the closest failed schedule.", "INFO")
+        if exact_outcome != 'solved':
+            completed = self._run_attempt_batch(range(max_total_attempts), max_total_attempts, num_workers, run_state)
+            if completed is False:
                 return False
 
-            if is_successful_attempt:
-                schedule_hash = hash(json.dumps(current_schedule, sort_keys=True, default=str))
-                if schedule_hash not in generated_schedule_hashes:
-                    s_id = len(self.generated_schedules_details) + 1
-                    # MODIFIED: Store the placed_courses data with the schedule
-                    self.generated_schedules_details.append({
-                        'id': s_id, 'schedule': current_schedule, 'log': single_attempt_log_capture,
-                        'metrics': attempt_metrics, 'placed_courses': placed_courses
-                    })
-                    generated_schedule_hashes.add(schedule_hash)
-                    self._log_message(f"SUCCESS: Found new distinct valid schedule (ID: {s_id}).", "INFO")
-                else:
-                    self._log_message("INFO: Generated a schedule identical to a previous one. Trying again.", "DEBUG")
-            else:
-                self._log_message(f"INFO: Attempt {attempt_num + 1} did not yield a valid schedule. (Completion: {attempt_metrics.get('overall_completion_rate', 0)*100:.2f}%)", "DEBUG")
-                current_is_better = (attempt_metrics['unmet_grade_slots_count'] < best_failed_schedule_data['metrics']['unmet_grade_slots_count']) or \
-                                   (attempt_metrics['unmet_grade_slots_count'] == best_failed_schedule_data['metrics']['unmet_grade_slots_count'] and \
-                                    attempt_metrics['unmet_prep_teachers_count'] < best_failed_schedule_data['metrics']['unmet_prep_teachers_count']) or \
-                                   (attempt_metrics['unmet_grade_slots_count'] == best_failed_schedule_data['metrics']['unmet_grade_slots_count'] and \
-                                    attempt_metrics['unmet_prep_teachers_count'] == best_failed_schedule_data['metrics']['unmet_prep_teachers_count'] and \
-                                    attempt_metrics['overall_completion_rate'] > best_failed_schedule_data['metrics']['overall_completion_rate'])
-                if current_is_better:
-                    # MODIFIED: Store placed_courses for the best failed attempt
-                    best_failed_schedule_data = {'schedule': current_schedule, 'log': single_attempt_log_capture,
-                                                 'metrics': attempt_metrics, 'placed_courses': placed_courses}
-                    self._log_message("This is the best failed attempt found so far.", "DEBUG")
-
         # --- This logic runs AFTER initial attempts, before returning ---
         if not self.generated_schedules_details and self.params.get('school_type') == 'High School' and self._attempt_course_combination():
             self._log_message("--- RE-ATTEMPTING WITH COMBINED COURSES ---", "INFO")
-            for attempt_num_opt in range(max_total_attempts):
-                if len(self.generated_schedules_details) >= MAX_DISTINCT_SCHEDULES_TO_GENERATE:
-                    self._log_message(f"Internal target of {MAX_DISTINCT_SCHEDULES_TO_GENERATE} distinct schedules reached. Stopping generation.", "INFO")
-                    break
-                self._log_message(f"--- Overall Schedule Gen Attempt {attempt_num_opt + 1}/{max_total_attempts} (OPTIMIZED RUN) ---", "DEBUG")
-
-                single_attempt_log_capture_opt = []
-                current_schedule_opt, is_successful_attempt_opt, attempt_metrics_opt, placed_courses_opt = \
-                    self._generate_single_schedule_attempt(attempt_seed_modifier=attempt_num_opt + max_total_attempts, attempt_log_list=single_attempt_log_capture_opt)
-
-                self.current_run_log.extend(single_attempt_log_capture_opt)
-                if current_schedule_opt is None: self._log_message("CRITICAL ERROR during optimized run.", "ERROR"); break
-
-                if is_successful_attempt_opt:
-                    schedule_hash_opt = hash(json.dumps(current_schedule_opt, sort_keys=True, default=str))
-                    if schedule_hash_opt not in generated_schedule_hashes:
-                        s_id_opt = len(self.generated_schedules_details) + 1
-                        self.generated_schedules_details.append({
-                            'id': f"{s_id_opt}-Optimized", 'schedule': current_schedule_opt, 'log': single_attempt_log_capture_opt,
-                            'metrics': attempt_metrics_opt, 'placed_courses': placed_courses_opt
-                        })
-                        generated_schedule_hashes.add(schedule_hash_opt)
-                        self._log_message(f"SUCCESS: Found new distinct valid schedule (ID: {s_id_opt}-Optimized).", "INFO")
-                else: # (Logic for tracking best failed optimized run is unchanged but uses new data)
-                    current_is_better_opt = (attempt_metrics_opt['unmet_grade_slots_count'] < best_failed_schedule_data['metrics']['unmet_grade_slots_count']) or \
-                               (attempt_metrics_opt['unmet_grade_slots_count'] == best_failed_schedule_data['metrics']['unmet_grade_slots_count'] and \
-                                attempt_metrics_opt['unmet_prep_teachers_count'] < best_failed_schedule_data['metrics']['unmet_prep_teachers_count'])
-                    if current_is_better_opt:
-                        best_failed_schedule_data = {'schedule': current_schedule_opt, 'log': single_attempt_log_capture_opt,
-                                                     'metrics': attempt_metrics_opt, 'placed_courses': placed_courses_opt}
-                        self._log_message("This (optimized) is the new best failed attempt found so far.", "DEBUG")
+            if not use_exact or self._run_exact_solver(run_state, optimized=True) in ('limit', 'infeasible'):
+                self._run_attempt_batch(range(max_total_attempts, 2 * max_total_attempts), max_total_attempts, num_workers, run_state, optimized=True)
 
         self.courses_data = original_courses_data
         self.cohort_constraints = original_cohort_constraints
@@ -347,6 +1477,7 @@ class SchedulingEngine:
         # --- NEW: RANKING LOGIC ---
         if not self.generated_schedules_details:
             self._log_message("FINAL: Could not generate any valid schedules, even after optimization attempts.", "ERROR")
+            best_failed_schedule_data = run_state['best_failed']
             if best_failed_schedule_data['schedule']:
                 best_failed_schedule_data['id'] = "Best_Failed_Attempt"
                 self.generated_schedules_details.append(best_failed_schedule_data)
@@ -354,233 +1485,980 @@ class SchedulingEngine:
 
         self._log_message(f"Generated {len(self.generated_schedules_details)} valid schedule(s). Now ranking them.", "INFO")
 
-        for s_detail in self.generated_schedules_details:
-            placed_courses_by_term = s_detail.get('placed_courses', {})
-            g11_core_courses = set()
-            g12_core_courses = set()
-
-            if placed_courses_by_term:
-                for term, courses in placed_courses_by_term.items():
-                    for course in courses:
-                         if course.get('placed_this_term_count', 0) > 0:
-                            is_core = course.get('subject_area') in CORE_SUBJECTS_HS
-                            grade = course.get('grade_level')
-                            if is_core:
-                                if grade == 11: g11_core_courses.add(course['name'])
-                                elif grade == 12: g12_core_courses.add(course['name'])
-
-            s_detail['metrics']['g11_core_count'] = len(g11_core_courses)
-            s_detail['metrics']['g12_core_count'] = len(g12_core_courses)
-            score_tuple = (
-                1 if len(g11_core_courses) >= 2 else 0,
-                len(g11_core_courses),
-                1 if len(g12_core_courses) >= 2 else 0,
-                len(g12_core_courses)
-            )
-            s_detail['score'] = score_tuple
-
-        self.generated_schedules_details.sort(key=lambda x: x.get('score', (-1,)), reverse=True)
+        for s_detail, (g11_core_count, g12_core_count) in zip(self.generated_schedules_details, self._core_course_counts(self.generated_schedules_details)):
+            s_detail['metrics']['g11_core_count'] = g11_core_count
+            s_detail['metrics']['g12_core_count'] = g12_core_count
+            s_detail['score'] = self._core_score_tuple(g11_core_count, g12_core_count)
+
+        self.generated_schedules_details = heapq.nlargest(run_state['target'], self.generated_schedules_details, key=self._ranking_key)
 
         if self.generated_schedules_details:
             best_schedule = self.generated_schedules_details[0]
-            self._log_message(f"Best schedule selected (ID: {best_schedule['id']}) with G11 Cores: {best_schedule['metrics']['g11_core_count']}, G12 Cores: {best_schedule['metrics']['g12_core_count']}.", "INFO")
+            self._log_message(f"Best schedule selected (ID: {best_schedule['id']}) with G11 Cores: {best_schedule['metrics']['g11_core_count']}, G12 Cores: {best_schedule['metrics']['g12_core_count']}, Objective: {best_schedule['metrics'].get('objective', 0.0)}.", "INFO")
 
         self._log_message(f"SUCCESS: Generated and ranked {len(self.generated_schedules_details)} valid schedule(s).", "INFO")
         return True
 
 
-    # --- MODIFIED FUNCTION ---
-    def _generate_single_schedule_attempt(self, attempt_seed_modifier=0, attempt_log_list=None):
-        log_fn = lambda msg, level="INFO": (attempt_log_list.append(f"[{level}] {datetime.datetime.now().strftime('%H:%M:%S')} {msg}") if attempt_log_list is not None else self._log_message(msg, level))
+    def _use_vectorized_evaluation(self): return np is not None and self.engine_options.get('vectorized_evaluation', True)
+
+    @staticmethod
+    def _core_score_tuple(g11_core_count, g12_core_count):
+        return (1 if g11_core_count >= 2 else 0, g11_core_count, 1 if g12_core_count >= 2 else 0, g12_core_count)
+
+    @staticmethod
+    def _placed_core_courses(placed_courses_by_term):
+        """Names of the grade 11 and grade 12 core courses with at least one placed period."""
+        g11_core_courses, g12_core_courses = set(), set()
+        for courses in (placed_courses_by_term or {}).values():
+            for course in courses:
+                if course.get('placed_this_term_count', 0) > 0 and course.get('subject_area') in CORE_SUBJECTS_HS:
+                    grade = course.get('grade_level')
+                    if grade == 11: g11_core_courses.add(course['name'])
+                    elif grade == 12: g12_core_courses.add(course['name'])
+        return g11_core_courses, g12_core_courses
+
+    def _core_course_counts(self, details):
+        """(grade 11, grade 12) core course counts per schedule detail, batched per layout when vectorized."""
+        if not self._use_vectorized_evaluation() or not all(isinstance(s_detail, ScheduleResult) for s_detail in details):
+            return [tuple(len(names) for names in self._placed_core_courses(s_detail.get('placed_courses'))) for s_detail in details]
+        counts = [None] * len(details)
+        by_layout = defaultdict(list)
+        for n, s_detail in enumerate(details): by_layout[id(s_detail.compact.layout)].append(n)
+        for members in by_layout.values():
+            layout = details[members[0]].compact.layout
+            placed = np.stack([np.asarray(details[n].compact.placed_counts, dtype=np.int64).reshape(-1, len(layout.item_names)).sum(axis=0) for n in members])
+            g11_counts, g12_counts = ScheduleEvaluator.core_counts(layout.item_records, placed)
+            for n, g11_count, g12_count in zip(members, g11_counts.tolist(), g12_counts.tolist()): counts[n] = (g11_count, g12_count)
+        return counts
+
+    def evaluate_schedules(self, schedules):
+        """Re-validates finished schedules, e.g. after editing.
+
+        Each entry is either a dict schedule, checked against the current inputs, or a schedule detail
+        from get_generated_schedules(), checked against the course set it was generated from (so
+        combined-course schedules keep their combined courses). Returns one dict per entry with
+        overall_completion_rate, unmet_grade_slots_count, unmet_prep_teachers_count, is_valid,
+        g11_core_count, g12_core_count and score, or an empty list if the inputs cannot be compiled.
+        With NumPy each term of a batch is checked in one ScheduleEvaluator call; otherwise each
+        schedule goes through the attempt validation.
+        """
+        null_log = lambda *args, **fields: None
+        by_layout = defaultdict(list)
+        for n, entry in enumerate(schedules): by_layout[entry.compact.layout if isinstance(entry, ScheduleResult) else None].append(n)
+        results = [None] * len(schedules)
+        for layout, members in by_layout.items():
+            problem = self._compile_problem_for_layout(layout, null_log)
+            if problem.input_error: return []
+            batch = [schedules[n]['schedule'] if layout is not None else schedules[n] for n in members]
+            for n, result in zip(members, self._evaluate_schedule_batch(problem, batch)): results[n] = result
+        return results
+
+    def _compile_problem_for_layout(self, layout, log_fn):
+        """Compiles the current inputs, with the course or subject list replaced by the one a result layout was built from."""
+        if layout is None: return self._compile_problem(log_fn)
+        source_attr = 'courses_data' if layout.is_hs else 'subjects_data'
+        current_source = getattr(self, source_attr)
+        setattr(self, source_attr, freeze([record.to_dict() for record in layout.item_records]))
+        try:
+            return self._compile_problem(log_fn)
+        finally:
+            setattr(self, source_attr, current_source)
+
+    def _evaluate_schedule_batch(self, problem, schedules):
+        null_log = lambda *args, **fields: None
+        results = []
+        if not self._use_vectorized_evaluation():
+            for schedule in schedules:
+                term_states = {t: TermState.from_schedule(problem, t, schedule.get(t, {}), None) for t in problem.term_items}
+                _, is_valid, metrics, placed_courses = self._attempt_result_from_states(problem, term_states, null_log)
+                g11_core_count, g12_core_count = (len(names) for names in self._placed_core_courses(placed_courses))
+                results.append({'overall_completion_rate': metrics['overall_completion_rate'], 'unmet_grade_slots_count': metrics['unmet_grade_slots_count'],
+                                'unmet_prep_teachers_count': metrics['unmet_prep_teachers_count'], 'is_valid': is_valid,
+                                'g11_core_count': g11_core_count, 'g12_core_count': g12_core_count, 'score': self._core_score_tuple(g11_core_count, g12_core_count)})
+            return results
+        evaluator = ScheduleEvaluator(problem)
+        num_schedules = len(schedules)
+        completion = np.zeros(num_schedules)
+        unmet_grade_slots = np.zeros(num_schedules, dtype=np.int64)
+        unmet_prep = np.zeros(num_schedules, dtype=np.int64)
+        is_valid = np.ones(num_schedules, dtype=bool)
+        placed = np.zeros((num_schedules, len(problem.item_names)), dtype=np.int64)
+        for term_idx in range(1, problem.num_terms + 1):
+            if not problem.term_items.get(term_idx):
+                completion += 1.0
+                continue
+            term = evaluator.evaluate_term(term_idx, np.stack([evaluator.encode_term(schedule.get(term_idx, {})) for schedule in schedules]))
+            completion += term['completion_rate']
+            unmet_grade_slots += term['unmet_grade_slots_count']
+            unmet_prep += term['unmet_prep_teachers_count']
+            is_valid &= term['is_valid']
+            placed += term['placed']
+        g11_counts, g12_counts = ScheduleEvaluator.core_counts(problem.item_records, placed)
+        for n, score in enumerate(ScheduleEvaluator.score_tuples(g11_counts, g12_counts).tolist()):
+            results.append({'overall_completion_rate': float(completion[n]) / problem.num_terms if problem.num_terms else 0.0,
+                            'unmet_grade_slots_count': int(unmet_grade_slots[n]), 'unmet_prep_teachers_count': int(unmet_prep[n]), 'is_valid': bool(is_valid[n]),
+                            'g11_core_count': int(g11_counts[n]), 'g12_core_count': int(g12_counts[n]), 'score': tuple(score)})
+        return results
+
+    def _run_portfolio(self, num_schedules_to_generate, max_total_attempts):
+        """Runs several strategy configurations at once, one process each, under one time budget.
+
+        Each strategy is a full generate_schedules() run on a copy of the inputs, with its option overrides
+        and 'time_limit' set to the shared budget. In 'first' mode the first strategy to produce a valid
+        schedule wins and the rest are stopped; in 'best' mode all finish and the schedules are merged and
+        ranked by score, the winner being the strategy with the top one. The winner is logged and appended
+        to portfolio_history.
+        """
+        strategies = self.engine_options.get('portfolio_strategies') or PORTFOLIO_STRATEGIES
+        time_limit = float(self.engine_options.get('portfolio_time_limit') or 0)
+        first_wins = self.engine_options.get('portfolio_mode', 'first') == 'first'
+        inputs = {'params': self.params, 'teachers': self.teachers_data, 'courses': self.courses_data, 'subjects': self.subjects_data,
+                  'cohort_constraints': self.cohort_constraints, 'credits_db': self.high_school_credits_db}
+        payloads = []
+        for strategy in strategies:
+            overrides = {k: v for k, v in strategy.items() if k != 'name'}
+            options = {**self.engine_options, **overrides, 'portfolio': False, 'num_workers': 1, 'random_seed': self.run_seed, 'time_limit': time_limit}
+            payloads.append((strategy['name'], inputs, options, num_schedules_to_generate, max_total_attempts))
+        self._log_message(f"--- PORTFOLIO: {len(payloads)} strategies ({', '.join(p[0] for p in payloads)}), {time_limit}s budget, mode '{'first' if first_wins else 'best'}' ---", "INFO")
+        started = time.monotonic()
+        outcomes, winner = [], None
+        pool = multiprocessing.Pool(processes=len(payloads))
+        try:
+            results = pool.imap_unordered(_run_portfolio_strategy, payloads)
+            for _ in payloads:
+                try:
+                    result = results.next(timeout=max(0.0, started + time_limit + PORTFOLIO_GRACE_SECONDS - time.monotonic()))
+                except multiprocessing.TimeoutError:
+                    self._log_message("PORTFOLIO: Time budget exhausted; stopping the remaining strategies.", "WARN")
+                    break
+                result['elapsed'] = time.monotonic() - started
+                outcomes.append(result)
+                self._log_message(f"PORTFOLIO: '{result['strategy']}' finished in {result['elapsed']:.2f}s: {'success' if result['success'] else 'no valid schedule'} ({sum(1 for s in result['schedules'] if s.get('id') != 'Best_Failed_Attempt')} valid).", "INFO")
+                if first_wins and result['success']: break
+        finally:
+            pool.terminate()
+            pool.join()
+
+        valid, seen_hashes, best_failed = [], set(), None
+        for result in outcomes:
+            for s_detail in result['schedules']:
+                if s_detail.get('id') == 'Best_Failed_Attempt':
+                    if best_failed is None or self._is_better_failed_attempt(s_detail['metrics'], best_failed['metrics']): best_failed = s_detail
+                    continue
+                schedule_hash = s_detail['metrics']['fingerprint']
+                if schedule_hash in seen_hashes: continue
+                seen_hashes.add(schedule_hash)
+                valid.append(s_detail.copy(id=f"{s_detail['id']}-{result['strategy']}", strategy=result['strategy']))
+        valid.sort(key=self._ranking_key, reverse=True)
+        self.generated_schedules_details = valid[:self._schedule_target(num_schedules_to_generate)]
+        if valid:
+            winner = next(r for r in outcomes if r['strategy'] == valid[0]['strategy'])
+            self.current_run_log.extend(winner['log'])
+            self._log_message(f"PORTFOLIO: Strategy '{winner['strategy']}' won in {winner['elapsed']:.2f}s (best schedule ID: {valid[0]['id']}).", "INFO")
+        else:
+            self._log_message("PORTFOLIO: No strategy produced a valid schedule.", "ERROR")
+            if best_failed is not None: self.generated_schedules_details.append(best_failed)
+        self.portfolio_history.append({'run_seed': self.run_seed, 'winner': winner['strategy'] if winner else None,
+                                       'elapsed': winner['elapsed'] if winner else time.monotonic() - started,
+                                       'outcomes': {r['strategy']: (r['success'], round(r['elapsed'], 2)) for r in outcomes}})
+        return bool(valid)
+
+    def _schedule_target(self, num_schedules_to_generate):
+        """Number of distinct schedules a run stops at: the request in diversity mode, else the internal cap."""
+        if not self.engine_options.get('diversity', False): return MAX_DISTINCT_SCHEDULES_TO_GENERATE
+        return max(1, min(num_schedules_to_generate, MAX_DISTINCT_SCHEDULES_TO_GENERATE))
+
+    def _deadline(self, seconds):
+        """Monotonic deadline seconds from now, capped by the run's time limit."""
+        deadline = time.monotonic() + float(seconds or 0)
+        return min(deadline, self.run_deadline) if self.run_deadline is not None else deadline
+
+    def _resolve_run_seed(self):
+        seed = self.engine_options.get('random_seed')
+        if seed is None: seed = random.SystemRandom().randrange(2**31)
+        return int(seed)
+
+    def _resolve_num_workers(self):
+        num_workers = self.engine_options.get('num_workers', 1)
+        if num_workers is None: num_workers = os.cpu_count() or 1
+        return max(1, int(num_workers))
+
+    def _iter_attempt_results(self, problem, attempt_seed_modifiers, num_workers, item_priorities=None, tabu_masks=None):
+        """Yields (seed_modifier, attempt_result) in the order the modifiers were given.
+
+        With more than one worker the attempts run in a process pool, but results are still
+        consumed strictly in attempt order so the merge matches a serial run with the same seeds.
+        item_priorities and tabu_masks (item -> slot mask to avoid), if given, may be updated by the
+        caller between results. They are copied once per generation of ATTEMPT_GENERATION_SIZE attempts,
+        after every result of the earlier generations has been consumed, so what an attempt sees does not
+        depend on the worker count. In a pool, the attempts of the next generation wait for that point.
+        """
+        seed_mods = list(attempt_seed_modifiers)
+        adaptive = item_priorities is not None or tabu_masks is not None
+        generation_size = ATTEMPT_GENERATION_SIZE if adaptive else max(1, len(seed_mods))
+        snapshot = lambda: (dict(item_priorities) if item_priorities is not None else None, dict(tabu_masks) if tabu_masks else None)
+        if num_workers <= 1:
+            for n, seed_mod in enumerate(seed_mods):
+                if n % generation_size == 0: priorities, tabu = snapshot()
+                attempt_log = self._new_log()
+                yield seed_mod, self._generate_single_schedule_attempt(attempt_seed_modifier=seed_mod, attempt_log_list=attempt_log, problem=problem, item_priorities=priorities, tabu_masks=tabu) + (attempt_log,)
+            return
+        pool = ProcessPoolExecutor(max_workers=num_workers, initializer=_init_attempt_worker, initargs=(problem, self.run_seed, self.engine_options))
+        try:
+            pending, submitted, consumed = deque(), 0, 0
+            while True:
+                while submitted < len(seed_mods) and len(pending) < 2 * num_workers and submitted - submitted % generation_size <= consumed:
+                    if submitted % generation_size == 0: priorities, tabu = snapshot()
+                    pending.append((seed_mods[submitted], pool.submit(_run_attempt_in_worker, seed_mods[submitted], priorities, tabu)))
+                    submitted += 1
+                if not pending: break
+                seed_mod, future = pending.popleft()
+                yield seed_mod, future.result()
+                consumed += 1
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _polish_valid_schedule(self, problem, seed_mod, current_schedule, attempt_metrics, placed_courses):
+        """Hill-climbs a valid schedule on the objective. Returns the (schedule, metrics, placed_courses) to keep.
+
+        Moves are the repair moves, accepted when they lower the repair penalty or keep it while not
+        lowering the objective, so validity is never traded away. The polished schedule replaces the
+        original only if it still validates and scores higher.
+        """
+        iterations = int(self.engine_options.get('objective_polish_iterations', 0) or 0)
+        if problem.objective is None or iterations <= 0: return current_schedule, attempt_metrics, placed_courses
+        weights = {**DEFAULT_ENGINE_OPTIONS['repair_weights'], **(self.engine_options.get('repair_weights') or {})}
+        rng = random.Random(self.run_seed + POLISH_SEED_OFFSET + seed_mod)
+        term_states = {t: TermState.from_schedule(problem, t, current_schedule.get(t, {}), (placed_courses or {}).get(t))
+                       for t in range(1, problem.num_terms + 1) if problem.term_items.get(t)}
+        for state in term_states.values():
+            items = [i for i in state.item_placed if problem.item_periods[i] > 0]
+            penalty = state.penalty(weights)
+            for _ in range(iterations // max(1, len(term_states))):
+                objective_before = state.objective_value
+                undo = self._apply_random_repair_move(state, items, rng)
+                if undo is None: continue
+                new_penalty = state.penalty(weights)
+                if new_penalty < penalty or (new_penalty == penalty and state.objective_value >= objective_before): penalty = new_penalty
+                else: undo()
+        polished_schedule, is_valid, polished_metrics, polished_courses = self._attempt_result_from_states(problem, term_states, lambda *args, **fields: None)
+        if not is_valid or polished_metrics['objective'] <= attempt_metrics.get('objective', 0.0): return current_schedule, attempt_metrics, placed_courses
+        self._log_message("POLISH: Objective raised from {before} to {after}.", "DEBUG", 'polished', before=attempt_metrics.get('objective', 0.0), after=polished_metrics['objective'])
+        return polished_schedule, polished_metrics, polished_courses
+
+    @staticmethod
+    def _ranking_key(s_detail):
+        """Schedules rank by the core-course score tuple, then by the objective computed during the search."""
+        return (s_detail.get('score', (-1,)), s_detail.get('metrics', {}).get('objective', 0.0))
+
+    @staticmethod
+    def _failed_attempt_rank(metrics):
+        """Sort key for failed attempts: fewer unmet grade slots, then fewer prep shortfalls, then higher completion."""
+        return (metrics['unmet_grade_slots_count'], metrics['unmet_prep_teachers_count'], -metrics['overall_completion_rate'])
+
+    def _is_better_failed_attempt(self, metrics, best_metrics):
+        return self._failed_attempt_rank(metrics) < self._failed_attempt_rank(best_metrics)
+
+    def _record_valid_schedule(self, problem, run_state, current_schedule, attempt_metrics, placed_courses, attempt_log, id_suffix="", source_fingerprint=None):
+        """Adds a valid schedule unless it duplicates one already kept.
+
+        source_fingerprint is the fingerprint of the schedule before polishing. It counts for the
+        duplicate check too, so attempts that found the same schedule stay duplicates however their
+        polish went.
+        """
+        schedule_hashes = {attempt_metrics['fingerprint'], source_fingerprint} - {None}
+        if schedule_hashes & run_state['hashes']:
+            self._log_message("INFO: Generated a schedule identical to a previous one. Trying again.", "DEBUG", 'duplicate')
+            return False
+        if run_state['placements'] is not None:
+            placements = self._schedule_placements(current_schedule)
+            difference = min((self._placement_difference(placements, other) for other in run_state['placements']), default=1.0)
+            if difference < float(self.engine_options.get('diversity_min_difference', 0) or 0):
+                self._log_message("INFO: Valid schedule differs from an earlier one in only {difference:.1f}% of placements. Trying again.", "DEBUG", 'too_similar', difference=difference * 100)
+                return False
+            run_state['placements'].append(placements)
+        s_id = len(self.generated_schedules_details) + 1
+        if id_suffix: s_id = f"{s_id}-{id_suffix}"
+        # MODIFIED: Store the placed_courses data with the schedule, both kept in compact form
+        self.generated_schedules_details.append(ScheduleResult(CompactSchedule(problem.result_layout(), current_schedule, placed_courses),
+                                                               id=s_id, log_summary=attempt_log.summary(), metrics=attempt_metrics))
+        run_state['hashes'].update(schedule_hashes)
+        self._log_message(f"SUCCESS: Found new distinct valid schedule (ID: {s_id}).", "INFO")
+        return True
 
-        log_fn(f"Attempting Schedule Generation (Seed Mod: {attempt_seed_modifier}, Min Prep: {MIN_PREP_BLOCKS_PER_WEEK})", "DEBUG")
+    @staticmethod
+    def _schedule_placements(schedule):
+        """The set of (term, course, day index, period) placements in a schedule, ignoring tracks and teachers."""
+        return frozenset((term_idx, entry[0], day_idx, p_idx) for term_idx, term_grid in schedule.items() for day_idx, day_name in enumerate(DAYS_OF_WEEK)
+                         for p_idx, tracks in enumerate(term_grid.get(day_name, [])) for entry in tracks if entry)
+
+    @staticmethod
+    def _placement_difference(placements, other):
+        """Share of placements not common to both schedules, relative to the larger one."""
+        return 1.0 - len(placements & other) / max(len(placements), len(other), 1)
+
+    @staticmethod
+    def _add_tabu_placements(problem, tabu_masks, placements):
+        item_by_name = {name: i for i, name in enumerate(problem.item_names)}
+        for _, name, day_idx, p_idx in placements:
+            if name in item_by_name:
+                i = item_by_name[name]
+                tabu_masks[i] = tabu_masks.get(i, 0) | 1 << problem.slot_id(day_idx, p_idx)
+
+    def _record_failed_attempt(self, problem, run_state, current_schedule, attempt_metrics, placed_courses, attempt_log):
+        """Keeps a failed attempt if it is the best so far or ranks into the repair pool; others are dropped unencoded."""
+        rank = self._failed_attempt_rank(attempt_metrics)
+        is_best = rank < self._failed_attempt_rank(run_state['best_failed']['metrics'])
+        pool = run_state.setdefault('failed_pool', [])
+        pool_size = max(0, int(self.engine_options.get('repair_seeds', 0) or 0))
+        joins_pool = len(pool) < pool_size or (pool_size > 0 and rank < self._failed_attempt_rank(pool[-1]['metrics']))
+        if not is_best and not joins_pool: return
+        failed_result = ScheduleResult(CompactSchedule(problem.result_layout(), current_schedule, placed_courses), log_summary=attempt_log.summary(), metrics=attempt_metrics)
+        if is_best:
+            # MODIFIED: Store placed_courses for the best failed attempt
+            run_state['best_failed'] = failed_result
+            self._log_message("This is the best failed attempt found so far.", "DEBUG", 'best_failed')
+        if joins_pool:
+            pool.append(failed_result)
+            pool.sort(key=lambda r: self._failed_attempt_rank(r['metrics']))
+            del pool[pool_size:]
+
+    def _run_attempt_batch(self, attempt_seed_modifiers, max_total_attempts, num_workers, run_state, optimized=False):
+        """Runs one pass of attempts and merges each result into the run state in attempt order.
+
+        Returns False if the inputs are fundamentally unschedulable, True otherwise.
+        """
+        run_label = " (OPTIMIZED RUN)" if optimized else ""
+        run_state['failed_pool'] = []
+        first_seed_mod = attempt_seed_modifiers[0] if len(attempt_seed_modifiers) else 0
+        problem = self._compile_problem()
+        if problem.pin_conflicts:
+            self._log_pin_conflicts(problem)
+            return False
+        if problem.domain_conflicts:
+            for conflict in problem.domain_conflicts:
+                self._log_message(f"INFEASIBLE: {conflict}", "ERROR")
+            self._log_message("CRITICAL ERROR: Slot domains show no attempt can pass validation. Running a single attempt to report the closest schedule.", "ERROR")
+            attempt_seed_modifiers = attempt_seed_modifiers[:1]
+        item_priorities = {} if self.engine_options.get('squeaky_wheel', True) else None
+        # Item ids change when the problem is recompiled, so the tabu masks are rebuilt from the schedules kept so far.
+        tabu_masks = run_state['tabu'] = {}
+        for placements in run_state['placements'] or (): self._add_tabu_placements(problem, tabu_masks, placements)
+        results = self._iter_attempt_results(problem, attempt_seed_modifiers, num_workers, item_priorities, tabu_masks if run_state['placements'] is not None else None)
+        try:
+            for seed_mod, (current_schedule, is_successful_attempt, attempt_metrics, placed_courses, attempt_log) in results:
+                if len(self.generated_schedules_details) >= run_state['target']:
+                    self._log_message(f"Target of {run_state['target']} distinct schedules reached. Stopping generation.", "INFO")
+                    break
+                if self.run_deadline is not None and time.monotonic() > self.run_deadline:
+                    self._log_message("Run time limit reached. Stopping generation.", "INFO")
+                    break
+                attempt_num = seed_mod - first_seed_mod
+                self._log_message("--- Overall Schedule Gen Attempt {attempt}/{total}{label} ---", "DEBUG", 'attempt_start', attempt=attempt_num + 1, total=max_total_attempts, label=run_label)
+                if self.engine_options.get('log_attempt_detail', False):
+                    self.current_run_log.extend(attempt_log)
+                else:
+                    self._log_message("Attempt {attempt}{label}: {outcome}, completion {completion:.2f}%, {unmet_grade_slots} unmet grade slot(s), {warnings} warning(s), {errors} error(s).",
+                                      "INFO", 'attempt_summary', attempt=attempt_num + 1, label=run_label, outcome="valid" if is_successful_attempt else "invalid",
+                                      completion=attempt_metrics.get('overall_completion_rate', 0) * 100, unmet_grade_slots=attempt_metrics.get('unmet_grade_slots_count', 0),
+                                      warnings=attempt_log.count("WARN"), errors=attempt_log.count("ERROR"))
+
+                if current_schedule is None:
+                    if optimized:
+                        self._log_message("CRITICAL ERROR during optimized run.", "ERROR")
+                    else:
+                        self._log_message("CRITICAL ERROR: Fundamental input issues prevent scheduling. Check detailed logs from attempt.", "ERROR")
+                    return False
+
+                if is_successful_attempt:
+                    source_fingerprint = attempt_metrics['fingerprint']
+                    if source_fingerprint not in run_state['hashes']:
+                        current_schedule, attempt_metrics, placed_courses = self._polish_valid_schedule(problem, seed_mod, current_schedule, attempt_metrics, placed_courses)
+                    if self._record_valid_schedule(problem, run_state, current_schedule, attempt_metrics, placed_courses, attempt_log, "Optimized" if optimized else "", source_fingerprint) and run_state['placements']:
+                        self._add_tabu_placements(problem, tabu_masks, run_state['placements'][-1])
+                else:
+                    self._log_message("INFO: Attempt {attempt} did not yield a valid schedule. (Completion: {completion:.2f}%)", "DEBUG", 'attempt_invalid', attempt=attempt_num + 1, completion=attempt_metrics.get('overall_completion_rate', 0) * 100)
+                    self._record_failed_attempt(problem, run_state, current_schedule, attempt_metrics, placed_courses, attempt_log)
+                if item_priorities is not None: self._update_item_priorities(problem, item_priorities, current_schedule, placed_courses)
+        finally:
+            results.close()
+        if item_priorities is not None: self._report_item_priorities(problem, item_priorities)
+        if not self.generated_schedules_details and not problem.domain_conflicts and (self.engine_options.get('repair', True) or self.engine_options.get('lns', True)) and run_state.get('failed_pool'):
+            self._repair_failed_attempts(problem, run_state, "Optimized-Repaired" if optimized else "Repaired")
+        return True
+
+    def _update_item_priorities(self, problem, item_priorities, current_schedule, placed_courses):
+        """Squeaky-wheel update from one attempt: decay every weight, then add blame.
+
+        An item is blamed one point per period it failed to place. Each required-grade slot left
+        uncovered in a term adds one point, shared among that grade's items in the term.
+        """
+        for i in item_priorities: item_priorities[i] *= SQUEAKY_WHEEL_DECAY
+        for term_idx, term_records in (placed_courses or {}).items():
+            term_item_ids = problem.term_items.get(term_idx, ())
+            for i, record in zip(term_item_ids, term_records):
+                shortfall = problem.item_periods[i] - record.get('placed_this_term_count', 0)
+                if shortfall > 0: item_priorities[i] = item_priorities.get(i, 0.0) + shortfall
+            if not problem.is_hs or not current_schedule or term_idx not in current_schedule: continue
+            grade_by_name = {problem.item_names[i]: problem.item_grades[i] for i in term_item_ids}
+            covered = {g: 0 for g in problem.required_grades}
+            for slot in range(problem.num_slots):
+                for cell in current_schedule[term_idx][DAYS_OF_WEEK[problem.slot_day[slot]]][problem.slot_period[slot]]:
+                    if cell and grade_by_name.get(cell[0]) in covered: covered[grade_by_name[cell[0]]] |= 1 << slot
+            for grade, cover_mask in covered.items():
+                gap = problem.num_slots - _popcount(cover_mask)
+                grade_items = [i for i in term_item_ids if problem.item_grades[i] == grade]
+                if not gap or not grade_items: continue
+                for i in grade_items: item_priorities[i] = item_priorities.get(i, 0.0) + gap / len(grade_items)
+
+    def _report_item_priorities(self, problem, item_priorities):
+        ranked = sorted(((weight, problem.item_names[i]) for i, weight in item_priorities.items() if weight >= 0.01), reverse=True)
+        self.learned_item_priorities = {name: round(weight, 2) for weight, name in ranked}
+        if not ranked: return
+        self._log_message(f"SQUEAKY WHEEL: Learned priorities for {len(ranked)} item(s) (highest first):", "INFO")
+        for weight, name in ranked[:SQUEAKY_WHEEL_REPORT_LIMIT]:
+            self._log_message(f"  {name}: {weight:.2f}", "INFO")
+
+    def _run_exact_solver(self, run_state, optimized=False):
+        """Runs ExactTermSolver on every term of the current inputs.
+
+        Returns 'solved' (a valid schedule was recorded), 'infeasible' (some term was proven to have
+        no valid schedule), 'limit' (a node or time limit was hit first) or False on input errors.
+        """
+        run_label = " (OPTIMIZED RUN)" if optimized else ""
+        problem = self._compile_problem()
+        if problem.input_error:
+            self._log_message(*problem.input_error)
+            return False
+        if problem.pin_conflicts:
+            self._log_pin_conflicts(problem)
+            return False
+        node_limit = int(self.engine_options.get('exact_node_limit', 0) or 0)
+        deadline = self._deadline(self.engine_options.get('exact_time_limit'))
+        self._log_message(f"--- EXACT SEARCH{run_label}: node limit {node_limit} per term, {self.engine_options.get('exact_time_limit')}s overall ---", "INFO")
+        term_states = {}
+        for term_idx in sorted(problem.term_items):
+            if not problem.term_items[term_idx]: continue
+            solver = ExactTermSolver(problem, term_idx, node_limit, deadline)
+            outcome = solver.solve()
+            self._log_message(f"EXACT (Term {term_idx}): {outcome} after {solver.nodes} node(s).", "INFO")
+            if outcome == 'infeasible':
+                self._log_message(f"EXACT (Term {term_idx}): No schedule meets the completion, prep and grade-coverage rules given the pinned placements. Proven infeasible.", "ERROR")
+                return outcome
+            if outcome == 'limit':
+                self._log_message("EXACT: Search limit reached before a schedule or a proof was found.", "WARN")
+                return outcome
+            term_states[term_idx] = solver.state
+        exact_log = log_fn = self._new_log()
+        current_schedule, is_valid, attempt_metrics, placed_courses = self._attempt_result_from_states(problem, term_states, log_fn)
+        attempt_metrics['exact'] = True
+        self.current_run_log.extend(exact_log)
+        if not is_valid:
+            self._log_message("EXACT: The solved schedule failed validation; falling back to randomized attempts.", "ERROR")
+            self._record_failed_attempt(problem, run_state, current_schedule, attempt_metrics, placed_courses, exact_log)
+            return 'limit'
+        self._record_valid_schedule(problem, run_state, current_schedule, attempt_metrics, placed_courses, exact_log, "Optimized-Exact" if optimized else "Exact")
+        return 'solved'
+
+    def _log_pin_conflicts(self, problem):
+        for conflict in problem.pin_conflicts:
+            self._log_message(f"PIN CONFLICT: {conflict}", "ERROR")
+        self._log_message(f"CRITICAL ERROR: {len(problem.pin_conflicts)} ASSIGN constraint conflict(s) make every attempt invalid. Fix the pins above and run again.", "ERROR")
+
+    def _compile_problem(self, log_fn=None):
+        """Turns the current engine inputs into a CompiledProblem. Runs once per generation run."""
+        log_fn = log_fn or self._log_message
+        problem = CompiledProblem()
         num_p_day = self.params.get('num_periods_per_day', 1)
         if not isinstance(num_p_day, int) or num_p_day <= 0: num_p_day = 1
         num_terms = self.params.get('num_terms', 1)
-        num_tracks = self.params.get('num_concurrent_tracks_per_period', 1)
         is_hs = self.params.get('school_type') == 'High School'
-        force_same_time = self.params.get('force_same_time', False)
+        problem.num_periods_per_day = num_p_day
+        problem.num_slots = len(DAYS_OF_WEEK) * num_p_day
+        problem.num_terms = num_terms
+        problem.num_tracks = self.params.get('num_concurrent_tracks_per_period', 1)
+        problem.is_hs = is_hs
+        problem.force_same_time = self.params.get('force_same_time', False)
+        problem.allow_multiple_same_day = self.params.get('multiple_times_same_day', True) is not False
+        problem.required_grades = tuple(self.params.get('grades_requiring_full_schedule', []))
+        problem.slot_day = tuple(d for d in range(len(DAYS_OF_WEEK)) for _ in range(num_p_day))
+        problem.slot_period = tuple(p for _ in range(len(DAYS_OF_WEEK)) for p in range(num_p_day))
+        problem.all_slots_mask = (1 << problem.num_slots) - 1
+        problem.day_masks = tuple(((1 << num_p_day) - 1) << (d * num_p_day) for d in range(len(DAYS_OF_WEEK)))
+        problem.period_masks = tuple(sum(1 << (d * num_p_day + p) for d in range(len(DAYS_OF_WEEK))) for p in range(num_p_day))
 
-        current_schedule = {t: {d: [[None] * num_tracks for _ in range(num_p_day)] for d in DAYS_OF_WEEK} for t in range(1, num_terms + 1)}
-        items_by_term = defaultdict(list)
         source_data = self.subjects_data if not is_hs else self.courses_data
-
-        metrics_template = {'overall_completion_rate': 0, 'unmet_grade_slots_count': float('inf'), 'unmet_prep_teachers_count': float('inf')}
         if not source_data:
-            log_fn("No subjects/courses defined. Cannot generate schedule.", "ERROR")
-            return None, False, metrics_template, {} # MODIFIED: Consistent return
+            problem.input_error = ("No subjects/courses defined. Cannot generate schedule.", "ERROR")
+            return problem
         if not self.teachers_data:
-            log_fn("No teachers defined. Cannot generate schedule.", "ERROR")
-            return None, False, metrics_template, {} # MODIFIED: Consistent return
-
+            problem.input_error = ("No teachers defined. Cannot generate schedule.", "ERROR")
+            return problem
         p_dur_min = self.params.get('period_duration_minutes', 60)
         weeks_per_term = self.params.get('weeks_per_term', 18)
         if self.params.get('scheduling_model') == "Full Year": weeks_per_term = self.params.get('num_instructional_weeks', 36)
-
         if p_dur_min <= 0 or weeks_per_term <= 0:
-            log_fn("Period duration or weeks per term is zero, cannot calculate period loads.", "CRITICAL")
-            return None, False, metrics_template, {} # MODIFIED: Consistent return
+            problem.input_error = ("Period duration or weeks per term is zero, cannot calculate period loads.", "CRITICAL")
+            return problem
 
-        # (The rest of the function logic is mostly the same, it just operates on local variables)
+        teachers = tuple(TeacherRecord.from_dict(teacher, num_p_day) for teacher in self.teachers_data)
+        teacher_avail_count, teacher_max_teaching = [], []
+        for teacher in teachers:
+            total_avail_slots = _popcount(teacher.availability_mask)
+            max_t = total_avail_slots - MIN_PREP_BLOCKS_PER_WEEK
+            if max_t < 0: log_fn(f"WARN Teacher {teacher.name}: {total_avail_slots} avail, < {MIN_PREP_BLOCKS_PER_WEEK} prep. Max teach {max_t}. Cannot teach.", "WARN")
+            teacher_avail_count.append(total_avail_slots)
+            teacher_max_teaching.append(max_t)
+        problem.teacher_names = tuple(teacher.name for teacher in teachers)
+        problem.teacher_quals = tuple(teacher.qualifications for teacher in teachers)
+        problem.teacher_avail_count = tuple(teacher_avail_count)
+        problem.teacher_max_teaching = tuple(teacher_max_teaching)
+        problem.teacher_avail_masks = tuple(teacher.availability_mask for teacher in teachers)
+
+        records, constraints_list, not_masks_list, assign_slots_list, qualified_list = [], [], [], [], []
+        term_items = defaultdict(list)
+        day_index = {d: i for i, d in enumerate(DAYS_OF_WEEK)}
         for item_data_orig in source_data:
-            item_data = copy.deepcopy(item_data_orig)
-            if item_data is None: continue
-
-            grade_level_raw = item_data.get('grade_level')
-            if grade_level_raw and isinstance(grade_level_raw, str) and grade_level_raw.isdigit():
-                item_data['grade_level'] = int(grade_level_raw)
-            credits = item_data.get('credits', 0)
-            if credits >= 5: periods_per_week = 5
-            elif credits >= 3: periods_per_week = 3
-            else: periods_per_week = 1
-
-            item_data['periods_per_week_in_active_term'] = periods_per_week
-            log_fn(f"Calculated {periods_per_week} p/wk for '{item_data['name']}' ({credits} credits)", "DEBUG")
-            term_num_item = item_data.get('term_assignment', 1)
-            terms_to_sched_in = list(range(1, num_terms + 1)) if not is_hs and num_terms > 1 else [term_num_item]
+            if item_data_orig is None: continue
+            item = CourseRecord.from_dict(item_data_orig)
+            log_fn("Calculated {periods} p/wk for '{item}' ({credits} credits)", "DEBUG", 'item_periods', periods=item.periods_per_week, item=item.name, credits=item.credits)
+
+            item_id = len(records)
+            constraints = parse_scheduling_constraint(item.constraints_raw, num_p_day)
+            records.append(item)
+            constraints_list.append(constraints)
+            not_masks_list.append(sum(1 << slot for slot in {day_index[c['day']] * num_p_day + c['period'] for c in constraints if c.get('type') == 'NOT'}))
+            assign_slots_list.append(tuple(day_index[c['day']] * num_p_day + c['period'] for c in constraints if c.get('type') == 'ASSIGN'))
+            qualified_list.append(tuple(t_id for t_id, teacher in enumerate(teachers) if teacher.is_qualified(item.subject_area)))
+
+            terms_to_sched_in = list(range(1, num_terms + 1)) if not is_hs and num_terms > 1 else [item.term_assignment]
             for term_actual in terms_to_sched_in:
-                if 1 <= term_actual <= num_terms:
-                    items_by_term[term_actual].append({**item_data, 'teacher': None, 'periods_to_schedule_this_week': item_data.get('periods_per_week_in_active_term', 0),'constraints': parse_scheduling_constraint(item_data.get('scheduling_constraints_raw', ''), num_p_day), 'type': 'subject' if not is_hs else 'course', 'placed_this_term_count': 0, 'is_cts_course': "cts" in item_data.get('subject_area','').lower() if is_hs else False,})
-        teacher_max_teaching_this_week = {}
-        for teacher in self.teachers_data:
-            teacher_name = teacher['name']
-            total_avail_slots = 0
-            for day_k in DAYS_OF_WEEK:
-                for period_k in range(num_p_day):
-                    if teacher.get('availability', {}).get(day_k, {}).get(period_k, False): total_avail_slots += 1
-            max_t = total_avail_slots - MIN_PREP_BLOCKS_PER_WEEK
-            teacher_max_teaching_this_week[teacher_name] = max_t
-            if max_t < 0: log_fn(f"WARN Teacher {teacher_name}: {total_avail_slots} avail, < {MIN_PREP_BLOCKS_PER_WEEK} prep. Max teach {max_t}. Cannot teach.", "WARN")
+                if 1 <= term_actual <= num_terms: term_items[term_actual].append(item_id)
+
+        problem.item_records = tuple(records)
+        problem.item_names = tuple(r.name for r in records)
+        problem.item_grades = tuple(r.grade_level for r in records)
+        problem.item_subjects = tuple(r.subject_area for r in records)
+        problem.item_periods = tuple(r.periods_per_week for r in records)
+        problem.item_constraints = tuple(constraints_list)
+        problem.item_not_masks = tuple(not_masks_list)
+        problem.item_assign_slots = tuple(assign_slots_list)
+        problem.item_assign_masks = tuple(sum(1 << slot for slot in set(pins)) for pins in assign_slots_list)
+        problem.item_is_cts = tuple(("cts" in (r.subject_area or '').lower()) if is_hs else False for r in records)
+        problem.item_is_ranked_core = tuple(r.subject_area in CORE_SUBJECTS_HS and r.grade_level in (11, 12) for r in records)
+        objective_weights = self.engine_options.get('objective_weights') or {}
+        for name in objective_weights:
+            if name not in OBJECTIVE_TERMS: log_fn(f"Unknown objective term '{name}' ignored.", "WARN")
+        problem.objective = ScheduleObjective(objective_weights) if any(objective_weights.get(name) for name in OBJECTIVE_TERMS) else None
+        problem.item_qualified_teachers = tuple(qualified_list)
+        problem.term_items = {t: tuple(ids) for t, ids in term_items.items()}
+        problem.item_conflicts = self._build_cohort_conflict_graph(problem.item_names)
+        problem.item_conflict_bits = tuple(sum(1 << other for other in conflicts) for conflicts in problem.item_conflicts)
+        key_rng = random.Random(FINGERPRINT_SEED)
+        problem.fingerprint_keys = tuple(key_rng.getrandbits(64) for _ in range(len(problem.item_names) * problem.num_slots))
+        problem.fingerprint_teacher_keys = tuple(key_rng.getrandbits(64) for _ in problem.teacher_names)
+        problem.item_class = tuple(range(len(problem.item_names)))
+        problem.teacher_class = tuple(range(len(problem.teacher_names)))
+        problem.item_domain_masks = problem.item_static_domain_masks = (problem.all_slots_mask,) * len(problem.item_names)
+        self._place_pinned_items(problem, log_fn)
+        if self.engine_options.get('domain_filtering', True): self._propagate_item_domains(problem, log_fn)
+        if self.engine_options.get('teacher_assignment', 'flow') == 'flow': self._plan_teacher_assignment(problem, log_fn)
+        if self.engine_options.get('symmetry_breaking', True): self._find_symmetry_classes(problem, log_fn)
+        return problem
+
+    def _find_symmetry_classes(self, problem, log_fn):
+        """Groups interchangeable teachers and identical course sections into equivalence classes.
+
+        Teachers are interchangeable when they have the same availability, prep limit, qualifications and
+        set of items they may teach. Items are identical sections when they share term, grade, subject,
+        credits, periods, constraints, teachers, cohort conflicts and slot domain, and are not pinned.
+        problem.teacher_class and problem.item_class map each id to the lowest id of its class. Tracks
+        are always interchangeable: items take the lowest free track and fingerprints ignore tracks.
+        """
+        teacher_items = [[] for _ in problem.teacher_names]
+        for i, qualified in enumerate(problem.item_qualified_teachers):
+            for t_id in qualified: teacher_items[t_id].append(i)
+        teacher_reps = {}
+        problem.teacher_class = tuple(teacher_reps.setdefault((problem.teacher_avail_masks[t_id], problem.teacher_max_teaching[t_id], problem.teacher_quals[t_id], tuple(teacher_items[t_id])), t_id)
+                                      for t_id in range(len(problem.teacher_names)))
+        item_term = {i: term_idx for term_idx, term_item_ids in problem.term_items.items() for i in term_item_ids}
+        item_reps, item_class = {}, []
+        for i in range(len(problem.item_names)):
+            if problem.item_assign_masks[i]:
+                item_class.append(i)
+                continue
+            key = (item_term.get(i), problem.item_grades[i], problem.item_subjects[i], problem.item_records[i].credits, problem.item_periods[i], problem.item_not_masks[i],
+                   problem.item_is_cts[i], tuple(sorted(problem.item_qualified_teachers[i])), frozenset(problem.item_conflicts[i]), problem.item_static_domain_masks[i])
+            item_class.append(item_reps.setdefault(key, i))
+        problem.item_class = tuple(item_class)
+        teacher_sizes = [n for n in (problem.teacher_class.count(c) for c in set(problem.teacher_class)) if n > 1]
+        section_sizes = [n for n in (problem.item_class.count(c) for c in set(problem.item_class)) if n > 1]
+        problem.symmetry_counts = {'teacher_classes': len(teacher_sizes), 'interchangeable_teachers': sum(teacher_sizes),
+                                   'track_classes': 1 if problem.num_tracks > 0 else 0, 'interchangeable_tracks': problem.num_tracks,
+                                   'section_classes': len(section_sizes), 'identical_sections': sum(section_sizes)}
+        self.symmetry_report = dict(problem.symmetry_counts)
+        log_fn(f"SYMMETRY: {len(teacher_sizes)} class(es) of interchangeable teachers ({sum(teacher_sizes)} teachers), "
+               f"{problem.symmetry_counts['track_classes']} class of {problem.num_tracks} interchangeable tracks, "
+               f"{len(section_sizes)} class(es) of identical sections ({sum(section_sizes)} sections).", "INFO")
+
+    def _build_cohort_conflict_graph(self, item_names):
+        """Returns, per item id, the ids of items sharing a cohort group with it (matched on base name)."""
+        ids_by_base_name = defaultdict(list)
+        for item_id, name in enumerate(item_names):
+            ids_by_base_name[name.split(' (')[0].strip()].append(item_id)
+        conflicts = [set() for _ in item_names]
+        for clash_group in self.cohort_constraints:
+            if not isinstance(clash_group, (list, tuple)): continue
+            members = {item_id for name in clash_group for item_id in ids_by_base_name.get(str(name).split(' (')[0].strip(), ())}
+            for item_id in members:
+                conflicts[item_id].update(members - {item_id})
+        return tuple(frozenset(c) for c in conflicts)
+
+    def _place_pinned_items(self, problem, log_fn):
+        """Places every ASSIGN slot once per run, before any randomized attempt.
+
+        Pinned items are deterministic, so the resulting per-term TermState is stored on the problem
+        and copied by each attempt. Pins that cannot all be honoured are recorded in
+        problem.pin_conflicts with the exact slot, item and teacher involved.
+        """
+        slot_label = lambda slot: f"{DAYS_OF_WEEK[problem.slot_day[slot]]} P{problem.slot_period[slot] + 1}"
+        for term_idx, term_item_ids in problem.term_items.items():
+            pinned_items = [i for i in term_item_ids if problem.item_assign_slots[i]]
+            if not pinned_items: continue
+            state = TermState(problem, term_idx)
+            pinned_by_slot = defaultdict(list)
+            for item in pinned_items:
+                item_name = problem.item_names[item]
+                pins = list(dict.fromkeys(problem.item_assign_slots[item]))
+                if len(pins) > problem.item_periods[item]:
+                    log_fn(f"WARN (Term {term_idx}): '{item_name}' has {len(pins)} ASSIGN slots but only {problem.item_periods[item]} p/wk. Extra pins ignored.", "WARN")
+                    pins = pins[:problem.item_periods[item]]
+                pins_mask = sum(1 << slot for slot in pins)
+                if pins_mask & problem.item_not_masks[item]:
+                    clashing = ", ".join(slot_label(slot) for slot in _iter_bits(pins_mask & problem.item_not_masks[item]))
+                    problem.pin_conflicts.append(f"Term {term_idx}: '{item_name}' is both ASSIGNed and NOT-constrained at {clashing}.")
+                    continue
+                full_pins = [slot for slot in pins if state.free_tracks[slot] == 0]
+                for slot in full_pins:
+                    others = ", ".join(f"'{problem.item_names[o]}'" for o in pinned_by_slot[slot])
+                    problem.pin_conflicts.append(f"Term {term_idx} {slot_label(slot)}: '{item_name}' is pinned to a slot whose {problem.num_tracks} track(s) are already pinned by {others}.")
+                if full_pins: continue
+                cohort_pins = [slot for slot in pins if state.has_cohort_clash(item, slot)]
+                for slot in cohort_pins:
+                    others = ", ".join(f"'{problem.item_names[o]}'" for o in pinned_by_slot[slot] if o in problem.item_conflicts[item])
+                    problem.pin_conflicts.append(f"Term {term_idx} {slot_label(slot)}: '{item_name}' is pinned alongside cohort-mate {others}.")
+                if cohort_pins: continue
+                candidates = [t_id for t_id in problem.item_qualified_teachers[item]
+                              if problem.teacher_max_teaching[t_id] >= state.teacher_load[t_id] + problem.item_periods[item]]
+                free_teachers = [t_id for t_id in candidates if problem.teacher_avail_masks[t_id] & pins_mask == pins_mask and not state.teacher_busy[t_id] & pins_mask]
+                if not free_teachers:
+                    if not candidates:
+                        problem.pin_conflicts.append(f"Term {term_idx}: '{item_name}' is pinned but no qualified teacher has capacity for it.")
+                    else:
+                        busy_notes = []
+                        for t_id in candidates:
+                            for slot in _iter_bits(pins_mask & (state.teacher_busy[t_id] | ~problem.teacher_avail_masks[t_id])):
+                                holder = next((o for o in pinned_by_slot[slot] if state.item_teacher.get(o) == t_id), None)
+                                reason = f"teaching pinned '{problem.item_names[holder]}'" if holder is not None else "unavailable"
+                                busy_notes.append(f"{problem.teacher_names[t_id]} {reason} at {slot_label(slot)}")
+                        problem.pin_conflicts.append(f"Term {term_idx}: no qualified teacher is free for every pin of '{item_name}' ({'; '.join(busy_notes)}).")
+                    continue
+                t_id = max(free_teachers, key=lambda t: (problem.teacher_max_teaching[t] - state.teacher_load[t], -t))
+                state.item_teacher[item] = t_id
+                for slot in _iter_bits(pins_mask):
+                    state.place(item, t_id, slot)
+                    pinned_by_slot[slot].append(item)
+                if self.current_run_log.enabled("DEBUG"):
+                    log_fn("PINNED (Term {term}): '{item}' (T:{teacher}) at {slots}.", "DEBUG", 'pinned', term=term_idx, item=item_name,
+                           teacher=problem.teacher_names[t_id], slots=', '.join(slot_label(slot) for slot in _iter_bits(pins_mask)))
+            problem.pinned_states[term_idx] = state
+
+    def _propagate_item_domains(self, problem, log_fn):
+        """Computes every item's feasible slot domain once per run and propagates it to a fixpoint.
+
+        A domain starts as the union, over qualified teachers with capacity, of the teacher's available
+        slots, less NOT slots, slots whose tracks are all pinned, the teacher's pinned classes and slots
+        where a cohort-mate is pinned; under force_same_time it keeps only periods with enough days. An
+        item whose open slots exactly match the periods it still needs is committed to them, which removes
+        those slots from its cohort-mates, from other items that could only use the same teacher, and from
+        everyone once the committed items fill a slot's tracks. Repeats until nothing changes.
+
+        Stores problem.item_domain_masks (what attempts sample from). Commitments assume items get all their
+        periods, which validation does not demand, so shortfalls and proofs use only the static domains
+        (before commitments, any teacher with capacity left): problem.item_static_domain_masks, WARN logs
+        for items that cannot get all their periods and problem.domain_conflicts for terms where no
+        attempt can pass.
+        """
+        domains = [problem.all_slots_mask & ~problem.item_not_masks[i] for i in range(len(problem.item_names))]
+        static_domains = list(domains)
+        slot_label = lambda slot: f"{DAYS_OF_WEEK[problem.slot_day[slot]]} P{problem.slot_period[slot] + 1}"
+        for term_idx, term_item_ids in problem.term_items.items():
+            state = problem.pinned_states.get(term_idx) or TermState(problem, term_idx)
+            needed = {i: problem.item_periods[i] - state.item_placed[i] for i in term_item_ids}
+            teacher_domains, teacher_room = {}, {}
+            for i in term_item_ids:
+                teachers = [state.item_teacher[i]] if i in state.item_teacher else \
+                    [t for t in problem.item_qualified_teachers[i] if problem.teacher_max_teaching[t] > state.teacher_load[t]]
+                teacher_room[i] = max((problem.teacher_max_teaching[t] - state.teacher_load[t] for t in teachers), default=0)
+                static_domains[i] = state.item_slot_mask[i]
+                for t in teachers: static_domains[i] |= state.candidate_mask(i, t)
+                teacher_domains[i] = {t: state.candidate_mask(i, t) for t in teachers if problem.teacher_max_teaching[t] - state.teacher_load[t] >= needed[i]}
+            committed = {}
+            changed = True
+            while changed:
+                changed = False
+                open_slots = {i: self._usable_domain(problem, state, i, needed[i], teacher_domains[i]) for i in term_item_ids}
+                slot_commitments = [problem.num_tracks - state.free_tracks[slot] for slot in range(problem.num_slots)]
+                for i, slots in committed.items():
+                    for slot in _iter_bits(slots): slot_commitments[slot] += 1
+                full_slots = sum(1 << slot for slot in range(problem.num_slots) if slot_commitments[slot] >= problem.num_tracks)
+                for i in term_item_ids:
+                    if needed[i] <= 0: continue
+                    removed = 0 if i in committed else full_slots
+                    for j, slots in committed.items():
+                        if j == i: continue
+                        if j in problem.item_conflicts[i]: removed |= slots
+                    for t, mask in teacher_domains[i].items():
+                        blocked = removed | sum(slots for j, slots in committed.items() if j != i and set(teacher_domains[j]) == {t})
+                        if mask & blocked:
+                            teacher_domains[i][t] = mask & ~blocked
+                            changed = True
+                    if i not in committed and open_slots[i] and _popcount(open_slots[i]) == needed[i] == self._domain_capacity(problem, open_slots[i]):
+                        committed[i] = open_slots[i]
+                        changed = True
+            term_total = sum(problem.item_periods[i] for i in term_item_ids)
+            lost_periods = 0
+            for i in term_item_ids:
+                usable = self._usable_domain(problem, state, i, needed[i], teacher_domains[i])
+                domains[i] = usable | state.item_slot_mask[i]
+                capacity = min(teacher_room[i], self._domain_capacity(problem, static_domains[i] & ~state.item_slot_mask[i]))
+                if capacity >= needed[i]: continue
+                lost_periods += needed[i] - capacity
+                reason = "no qualified teacher has enough capacity" if capacity == teacher_room[i] else "teacher availability, constraints, pins and cohort conflicts leave too few slots"
+                log_fn(f"DOMAIN (Term {term_idx}): '{problem.item_names[i]}' can take at most {capacity} of its {needed[i]} remaining periods ({reason}).", "WARN")
+            if term_total and lost_periods > term_total * (1 - MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE):
+                problem.domain_conflicts.append(f"Term {term_idx}: at least {lost_periods}/{term_total} periods cannot be placed, so completion cannot reach {MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE*100:.0f}%.")
+            if problem.is_hs:
+                for grade in problem.required_grades:
+                    reachable = state.grade_cover[grade]
+                    for i in term_item_ids:
+                        if problem.item_grades[i] == grade: reachable |= static_domains[i]
+                    unreachable = problem.all_slots_mask & ~reachable
+                    if unreachable:
+                        problem.domain_conflicts.append(f"Term {term_idx}: no Grade {grade} course can be placed at {', '.join(slot_label(slot) for slot in _iter_bits(unreachable))}.")
+        problem.item_domain_masks = tuple(domains)
+        problem.item_static_domain_masks = tuple(static_domains)
+
+    @staticmethod
+    def _usable_domain(problem, state, item, needed, teacher_domains):
+        """Union of an item's per-teacher open slots, trimmed to periods that can still hold it under force_same_time."""
+        mask = 0
+        for teacher_mask in teacher_domains.values(): mask |= teacher_mask
+        if not problem.force_same_time or needed <= 0: return mask
+        forced_period = state.forced_period(item)
+        periods = [forced_period] if forced_period is not None else range(problem.num_periods_per_day)
+        aligned = [problem.period_masks[p] & mask for p in periods]
+        return sum(m for m in aligned if SchedulingEngine._domain_capacity(problem, m) >= needed) or max(aligned, key=_popcount, default=0)
+
+    @staticmethod
+    def _domain_capacity(problem, mask):
+        """Most periods an item can place in mask: one per day unless several are allowed, and one period index under force_same_time."""
+        if problem.force_same_time:
+            return max((SchedulingEngine._domain_capacity_unaligned(problem, mask & period_mask) for period_mask in problem.period_masks), default=0)
+        return SchedulingEngine._domain_capacity_unaligned(problem, mask)
+
+    @staticmethod
+    def _domain_capacity_unaligned(problem, mask):
+        if problem.allow_multiple_same_day: return _popcount(mask)
+        return sum(1 for day_mask in problem.day_masks if mask & day_mask)
+
+    def _plan_teacher_assignment(self, problem, log_fn):
+        """Assigns a teacher to every unpinned item of each term at once, before slot placement.
+
+        Solved as a min-cost flow: source -> item (its periods) -> qualified teacher -> sink, with the
+        teacher's remaining capacity split into unit arcs of rising cost so load is spread by utilization,
+        and required-grade items made cheaper so they win when capacity is short. Items whose flow splits
+        across teachers go to the teacher carrying most of it; any overload this causes is moved to a
+        teacher with spare capacity or left to the per-attempt greedy choice. Stored in
+        problem.term_teacher_plan as {term: {item: teacher}}.
+        """
+        num_teachers = len(problem.teacher_names)
+        for term_idx, term_item_ids in problem.term_items.items():
+            pinned_state = problem.pinned_states.get(term_idx)
+            pinned_teachers = pinned_state.item_teacher if pinned_state else {}
+            items = [i for i in term_item_ids if i not in pinned_teachers and problem.item_periods[i] > 0]
+            if not items: continue
+            capacity = [problem.teacher_max_teaching[t] - (pinned_state.teacher_load[t] if pinned_state else 0) for t in range(num_teachers)]
+            teacher_node = lambda t: 1 + len(items) + t
+            sink = 1 + len(items) + num_teachers
+            arcs, item_arcs = [], []
+            for n, i in enumerate(items):
+                periods = problem.item_periods[i]
+                arcs.append((0, 1 + n, periods, 0 if problem.item_grades[i] in problem.required_grades else TEACHER_PLAN_OPTIONAL_COST))
+                open_slots = problem.item_domain_masks[i] & ~problem.item_not_masks[i]
+                for t in problem.item_qualified_teachers[i]:
+                    usable = problem.teacher_avail_masks[t] & open_slots
+                    usable_count = _popcount(usable) if problem.allow_multiple_same_day else sum(1 for day_mask in problem.day_masks if usable & day_mask)
+                    if capacity[t] < periods or usable_count < periods: continue
+                    item_arcs.append((n, t, len(arcs)))
+                    arcs.append((1 + n, teacher_node(t), periods, 0))
+            for t in range(num_teachers):
+                for k in range(1, capacity[t] + 1):
+                    arcs.append((teacher_node(t), sink, 1, (k * TEACHER_PLAN_LOAD_COST) // capacity[t]))
+            flows = _min_cost_flow(sink + 1, arcs, 0, sink)
+            best_flow = {}
+            for n, t, arc_idx in item_arcs:
+                if flows[arc_idx] > best_flow.get(n, (0, None))[0]: best_flow[n] = (flows[arc_idx], t)
+            plan = {items[n]: t for n, (flow, t) in best_flow.items()}
+            load = [0] * num_teachers
+            for i, t in plan.items(): load[t] += problem.item_periods[i]
+            for i in sorted(plan, key=lambda i: problem.item_periods[i]):
+                t = plan[i]
+                if load[t] <= capacity[t]: continue
+                spare = [o for o in problem.item_qualified_teachers[i] if o != t and capacity[o] - load[o] >= problem.item_periods[i]]
+                load[t] -= problem.item_periods[i]
+                if spare:
+                    plan[i] = max(spare, key=lambda o: (capacity[o] - load[o], -o))
+                    load[plan[i]] += problem.item_periods[i]
+                else:
+                    del plan[i]
+            problem.term_teacher_plan[term_idx] = plan
+            unassigned = [problem.item_names[i] for i in items if i not in plan]
+            log_fn("TEACHER PLAN (Term {term}): Assigned teachers to {assigned}/{total} items in one flow solve.", "DEBUG", 'teacher_plan', term=term_idx, assigned=len(plan), total=len(items))
+            if unassigned:
+                log_fn(f"WARN (Term {term_idx}): No teacher capacity left in the assignment plan for {', '.join(unassigned)}; these fall back to per-attempt selection.", "WARN")
+
+    # --- MODIFIED FUNCTION ---
+    def _generate_single_schedule_attempt(self, attempt_seed_modifier=0, attempt_log_list=None, problem=None, item_priorities=None, tabu_masks=None):
+        log_fn = attempt_log_list if attempt_log_list is not None else self._log_message
+
+        log_fn("Attempting Schedule Generation (Seed Mod: {seed_mod}, Min Prep: {min_prep})", "DEBUG", 'attempt_begin', seed_mod=attempt_seed_modifier, min_prep=MIN_PREP_BLOCKS_PER_WEEK)
+        if problem is None: problem = self._compile_problem(log_fn)
+        rng = random.Random(self.run_seed + attempt_seed_modifier)
+
+        metrics_template = {'overall_completion_rate': 0, 'unmet_grade_slots_count': float('inf'), 'unmet_prep_teachers_count': float('inf')}
+        if problem.input_error:
+            log_fn(*problem.input_error)
+            return None, False, metrics_template, {} # MODIFIED: Consistent return
+
+        item_names, item_periods, item_grades = problem.item_names, problem.item_periods, problem.item_grades
+        teacher_names = problem.teacher_names
+        early_abort = self.engine_options.get('early_abort', True)
+        dynamic_ordering = self.engine_options.get('ordering', 'dynamic') == 'dynamic'
+        coverage_first = problem.is_hs and self.engine_options.get('coverage_first', True)
+
+        current_schedule = problem.empty_schedule()
+        items_by_term = defaultdict(list)
         is_overall_successful_attempt = True
         attempt_metrics = {'overall_completion_rate': 0.0, 'unmet_grade_slots_count': 0, 'unmet_prep_teachers_count': 0}
         all_terms_overall_completion_rates_for_avg = []
-        for term_idx in range(1, num_terms + 1):
-            log_fn(f"--- Processing Term {term_idx} ---", "DEBUG")
-            current_term_course_list_for_scheduling = items_by_term.get(term_idx, [])
-            if not current_term_course_list_for_scheduling:
+        fingerprint, objective_value = 0, 0.0
+        for term_idx in range(1, problem.num_terms + 1):
+            log_fn("--- Processing Term {term} ---", "DEBUG", 'term_begin', term=term_idx)
+            term_item_ids = problem.term_items.get(term_idx, ())
+            if not term_item_ids:
                 log_fn(f"No courses/subjects defined for Term {term_idx}. Skipping.", "INFO")
                 all_terms_overall_completion_rates_for_avg.append(1.0)
                 continue
-            teacher_busy_this_term = defaultdict(set)
-            item_scheduled_on_day_this_term = defaultdict(set)
-            teacher_teaching_periods_this_week_for_term = defaultdict(int)
+            pinned_state = problem.pinned_states.get(term_idx)
+            state = pinned_state.copy() if pinned_state else TermState(problem, term_idx)
+            for i, t_id in problem.term_teacher_plan.get(term_idx, {}).items(): state.item_teacher.setdefault(i, t_id)
+            if coverage_first:
+                for grade in problem.required_grades:
+                    covered = self._build_grade_cover(state, grade, rng)
+                    log_fn("COVER (Term {term}): Grade {grade} given {covered} slot(s) by construction; {uncovered} still uncovered.", "DEBUG", 'grade_cover',
+                           term=term_idx, grade=grade, covered=covered, uncovered=_popcount(problem.all_slots_mask & ~state.grade_cover[grade]))
             must_assign_items, flexible_items_all = [], []
-            for item_sort in current_term_course_list_for_scheduling:
-                (must_assign_items if any(c.get('type') == 'ASSIGN' for c in item_sort.get('constraints',[])) else flexible_items_all).append(item_sort)
-            required_grades_for_term = self.params.get('grades_requiring_full_schedule', [])
-            grade_coverage_this_term = {g: {d: [False] * num_p_day for d in DAYS_OF_WEEK} for g in required_grades_for_term}
-            def update_grade_coverage_local(item_obj, day_name, p_idx, grade_coverage_dict, req_grades):
-                if not is_hs: return
-                item_grade = item_obj.get('grade_level')
-                if isinstance(item_grade, int) and item_grade in req_grades:
-                    if item_grade in grade_coverage_dict:
-                        grade_coverage_dict[item_grade][day_name][p_idx] = True
-            log_fn(f"DEBUG (Term {term_idx}): Starting processing of {len(must_assign_items)} MUST ASSIGN items.", "DEBUG")
-            log_fn(f"DEBUG (Term {term_idx}): Starting processing of {len(flexible_items_all)} FLEXIBLE items.", "DEBUG")
-            def sort_key(course):
-                grade = course.get('grade_level')
-                is_required_grade = 1 if grade in required_grades_for_term else 0
-                periods = course.get('periods_per_week_in_active_term', 0)
-                return (is_required_grade, periods)
-            flexible_items_processed = sorted(flexible_items_all, key=sort_key, reverse=True)
-            if attempt_seed_modifier > 0:
-                random.seed(datetime.datetime.now().microsecond + attempt_seed_modifier + term_idx)
-                random.shuffle(flexible_items_processed)
-            for item in flexible_items_processed:
-                item_name = item['name']
-                item_subj_area = item.get('subject_area')
-                periods_to_place = item.get('periods_per_week_in_active_term', 0)
-                not_constr = [c for c in item.get('constraints', []) if c.get('type') == 'NOT']
-                if periods_to_place <= 0: continue
-                item_teacher = self._find_best_teacher_for_course(item, teacher_teaching_periods_this_week_for_term, teacher_max_teaching_this_week)
-                if not item_teacher:
-                    log_fn(f"Could not find any available & qualified teacher for '{item_name}'. Skipping.", "WARN")
+            for i in term_item_ids:
+                if problem.item_assign_slots[i]:
+                    must_assign_items.append(i)
+                    # A pinned item with fewer pins than periods still needs its remaining periods searched for.
+                    if i in state.item_teacher and state.item_placed[i] < item_periods[i]: flexible_items_all.append(i)
+                else:
+                    flexible_items_all.append(i)
+            required_grades_for_term = problem.required_grades
+            log_fn("DEBUG (Term {term}): {count} MUST ASSIGN items were pre-placed.", "DEBUG", 'pinned_items', term=term_idx, count=len(must_assign_items))
+            log_fn("DEBUG (Term {term}): Starting processing of {count} FLEXIBLE items.", "DEBUG", 'flexible_items', term=term_idx, count=len(flexible_items_all))
+            flexible_items_processed = sorted(flexible_items_all, key=lambda i: (1 if item_grades[i] in required_grades_for_term else 0, item_periods[i]), reverse=True)
+            if attempt_seed_modifier > 0 and not dynamic_ordering:
+                rng.shuffle(flexible_items_processed)
+            if item_priorities and not dynamic_ordering:
+                flexible_items_processed.sort(key=lambda i: item_priorities.get(i, 0.0), reverse=True)
+            total_periods_needed_term = sum(item_periods[i] for i in term_item_ids)
+            periods_lost_term = 0
+            remaining_periods_by_grade = defaultdict(int)
+            for i in flexible_items_processed:
+                if item_grades[i] in required_grades_for_term: remaining_periods_by_grade[item_grades[i]] += item_periods[i] - state.item_placed[i]
+            abort_reason = None
+            pending_items = [i for i in flexible_items_processed if item_periods[i] > state.item_placed[i]]
+            pending_items.reverse()
+            while pending_items:
+                if abort_reason: break
+                other_masks = None
+                if dynamic_ordering: item, other_masks = self._select_most_constrained_item(state, pending_items, rng, item_priorities)
+                else: item = pending_items.pop()
+                item_name = item_names[item]
+                periods_to_place = item_periods[item] - state.item_placed[item]
+                if item_grades[item] in remaining_periods_by_grade: remaining_periods_by_grade[item_grades[item]] -= periods_to_place
+                t_id = state.item_teacher.get(item)
+                if t_id is not None and state.item_placed[item] == 0:
+                    # A planned teacher is kept unless this attempt has already boxed them in.
+                    open_count = _popcount(state.candidate_mask(item, t_id))
+                    if open_count < periods_to_place:
+                        alternative = self._find_best_teacher_for_item(problem, item, state.teacher_load, rng)
+                        if alternative is not None and _popcount(state.candidate_mask(item, alternative)) > open_count: t_id = alternative
+                if t_id is None: t_id = self._find_best_teacher_for_item(problem, item, state.teacher_load, rng)
+                if t_id is None:
+                    log_fn("Could not find any available & qualified teacher for '{item}'. Skipping.", "WARN", 'no_teacher', item=item_name)
+                    periods_lost_term += periods_to_place
+                    if early_abort: abort_reason = self._hopeless_attempt_reason(state, total_periods_needed_term, periods_lost_term, remaining_periods_by_grade)
                     continue
-                item['teacher'] = item_teacher
-                placed_count = 0
-                available_slots_for_course = [(d, p) for d in DAYS_OF_WEEK for p in range(num_p_day)]
-                random.shuffle(available_slots_for_course)
-                forced_period_for_this_item = None
-                for _ in range(periods_to_place):
-                    slot_was_found_for_this_period = False
-                    for day_name, p_idx in available_slots_for_course:
-                        if force_same_time and forced_period_for_this_item is not None and p_idx != forced_period_for_this_item:
-                            continue
-                        if (day_name, p_idx) in teacher_busy_this_term.get(item_teacher, set()): continue
-                        if any(c['day'] == day_name and c['period'] == p_idx for c in not_constr): continue
-                        if self.params.get('multiple_times_same_day', True) is False and day_name in item_scheduled_on_day_this_term.get(item_name, set()): continue
-                        for track_idx in range(num_tracks):
-                            if current_schedule[term_idx][day_name][p_idx][track_idx] is None:
-                                current_schedule[term_idx][day_name][p_idx][track_idx] = (item_name, item_teacher)
-                                teacher_busy_this_term[item_teacher].add((day_name, p_idx))
-                                item_scheduled_on_day_this_term[item_name].add(day_name)
-                                placed_count += 1
-                                update_grade_coverage_local(item, day_name, p_idx, grade_coverage_this_term, required_grades_for_term)
-                                if force_same_time and forced_period_for_this_item is None:
-                                    forced_period_for_this_item = p_idx
-                                available_slots_for_course.remove((day_name, p_idx))
-                                slot_was_found_for_this_period = True
-                                break
-                        if slot_was_found_for_this_period: break
-                item['placed_this_term_count'] = placed_count
-                teacher_teaching_periods_this_week_for_term[item_teacher] += placed_count
+                state.item_teacher[item] = t_id
+                placed_count = self._place_item_periods(state, item, t_id, periods_to_place, rng, other_masks, tabu_masks.get(item, 0) if tabu_masks else 0)
+                periods_lost_term += periods_to_place - placed_count
+                if early_abort: abort_reason = self._hopeless_attempt_reason(state, total_periods_needed_term, periods_lost_term, remaining_periods_by_grade)
+                periods_to_place, placed_count = item_periods[item], state.item_placed[item]
                 if placed_count > 0 and placed_count < periods_to_place:
-                    log_fn(f"PARTIAL (Term {term_idx}): '{item_name}' (T:{item_teacher}) placed {placed_count}/{periods_to_place} times.", "WARN")
+                    log_fn("PARTIAL (Term {term}): '{item}' (T:{teacher}) placed {placed}/{periods} times.", "WARN", 'partial', term=term_idx, item=item_name, teacher=teacher_names[t_id], placed=placed_count, periods=periods_to_place)
                 elif placed_count == periods_to_place:
-                    log_fn(f"SCHED (Term {term_idx}): Flex item '{item_name}' (T:{item_teacher}) successfully placed {placed_count} times.", "DEBUG")
+                    log_fn("SCHED (Term {term}): Flex item '{item}' (T:{teacher}) successfully placed {placed} times.", "DEBUG", 'placed', term=term_idx, item=item_name, teacher=teacher_names[t_id], placed=placed_count)
                 else:
-                    log_fn(f"FAILED TO PLACE (Term {term_idx}): '{item_name}' could not be fully placed (0/{periods_to_place} periods).", "WARN")
-            total_periods_needed_term = sum(it.get('periods_to_schedule_this_week', 0) for it in current_term_course_list_for_scheduling)
-            total_periods_placed_term = sum(it.get('placed_this_term_count', 0) for it in current_term_course_list_for_scheduling)
-            term_completion_rate = 0.0
-            if total_periods_needed_term > 0:
-                term_completion_rate = total_periods_placed_term / total_periods_needed_term
-                log_fn(f"Term {term_idx} Completion: {total_periods_placed_term}/{total_periods_needed_term} ({term_completion_rate*100:.2f}%).", "INFO")
-                if term_completion_rate < MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE:
-                    log_fn(f"ERROR (Term {term_idx}): Completion ({term_completion_rate*100:.2f}%) < min {MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE*100}%. Invalidating attempt.", "ERROR")
-                    is_overall_successful_attempt = False
-            elif not current_term_course_list_for_scheduling:
-                log_fn(f"INFO (Term {term_idx}): No items to schedule.", "INFO")
-                term_completion_rate = 1.0
-            else:
-                log_fn(f"INFO (Term {term_idx}): All items have 0 periods needed.", "INFO")
-                term_completion_rate = 1.0
+                    log_fn("FAILED TO PLACE (Term {term}): '{item}' could not be fully placed (0/{periods} periods).", "WARN", 'not_placed', term=term_idx, item=item_name, periods=periods_to_place)
+            state.write_schedule(current_schedule[term_idx])
+            fingerprint = (fingerprint * FINGERPRINT_TERM_MULTIPLIER + state.fingerprint) & FINGERPRINT_MASK
+            objective_value += state.objective_value
+            items_by_term[term_idx] = problem.build_term_items(term_idx, [state.item_teacher.get(i) for i in range(len(item_names))], [state.item_placed.get(i, 0) for i in range(len(item_names))])
+            total_periods_placed_term = sum(state.item_placed.values())
+            if abort_reason:
+                # Partial metrics so the attempt can still be ranked as a best-failed candidate. Unprocessed
+                # terms keep only their pinned placements (shown in the result and used as repair seeds) and
+                # are scored on those alone, so a finished attempt practically always outranks this one.
+                log_fn(f"EARLY ABORT (Term {term_idx}): {abort_reason}. Invalidating attempt.", "WARN")
+                is_overall_successful_attempt = False
+                all_terms_overall_completion_rates_for_avg.append(total_periods_placed_term / total_periods_needed_term)
+                if problem.is_hs:
+                    attempt_metrics['unmet_grade_slots_count'] += sum(_popcount(problem.all_slots_mask & ~state.grade_cover[g]) for g in required_grades_for_term)
+                for unprocessed_idx in range(term_idx + 1, problem.num_terms + 1):
+                    if not problem.term_items.get(unprocessed_idx): continue
+                    pinned_state = problem.pinned_states.get(unprocessed_idx) or TermState(problem, unprocessed_idx)
+                    pinned_state.write_schedule(current_schedule[unprocessed_idx])
+                    fingerprint = (fingerprint * FINGERPRINT_TERM_MULTIPLIER + pinned_state.fingerprint) & FINGERPRINT_MASK
+                    objective_value += pinned_state.objective_value
+                    items_by_term[unprocessed_idx] = problem.build_term_items(unprocessed_idx, [pinned_state.item_teacher.get(i) for i in range(len(item_names))], [pinned_state.item_placed.get(i, 0) for i in range(len(item_names))])
+                    all_terms_overall_completion_rates_for_avg.append(sum(pinned_state.item_placed.values()) / sum(item_periods[i] for i in problem.term_items[unprocessed_idx]))
+                    if problem.is_hs:
+                        attempt_metrics['unmet_grade_slots_count'] += sum(_popcount(problem.all_slots_mask & ~pinned_state.grade_cover[g]) for g in required_grades_for_term)
+                attempt_metrics['aborted_early'] = True
+                break
+            term_completion_rate, term_is_valid = self._validate_term_state(state, log_fn, attempt_metrics)
+            if not term_is_valid: is_overall_successful_attempt = False
             all_terms_overall_completion_rates_for_avg.append(term_completion_rate)
-            for teacher_check in self.teachers_data:
-                name_check = teacher_check['name']
-                actual_teaching_this_term_val = teacher_teaching_periods_this_week_for_term.get(name_check, 0)
-                total_personal_avail_this_config = sum(1 for d_avail in DAYS_OF_WEEK for p_avail in range(num_p_day) if teacher_check.get('availability', {}).get(d_avail, {}).get(p_avail, False))
-                actual_prep = total_personal_avail_this_config - actual_teaching_this_term_val
-                if teacher_max_teaching_this_week.get(name_check, -1) < 0 and actual_teaching_this_term_val > 0:
-                    log_fn(f"ERROR (Term {term_idx}): Teacher {name_check} was unscheduleable but taught. Invalidating attempt.", "ERROR")
-                    is_overall_successful_attempt = False
-                    attempt_metrics['unmet_prep_teachers_count'] += 1
-                elif actual_prep < MIN_PREP_BLOCKS_PER_WEEK:
-                    log_fn(f"ERROR (Term {term_idx}): Teacher {name_check} has {actual_prep} prep, < {MIN_PREP_BLOCKS_PER_WEEK}. Invalidating attempt.", "ERROR")
-                    is_overall_successful_attempt = False
-                    attempt_metrics['unmet_prep_teachers_count'] += 1
-            log_fn(f"Term {term_idx} prep blocks verified.", "DEBUG")
-            if is_hs:
-                unmet_slots_for_all_grades_this_term = 0
-                if required_grades_for_term:
-                    placed_grades = {c.get('grade_level') for c in current_term_course_list_for_scheduling if c.get('placed_this_term_count', 0) > 0}
-                    if not any(g in placed_grades for g in required_grades_for_term):
-                        log_fn(f"ERROR (Term {term_idx}): No courses were placed for required grades {required_grades_for_term}. Invalidating.", "ERROR")
-                        is_overall_successful_attempt = False
-                for grade_to_check in required_grades_for_term:
-                    for day_check_fill in DAYS_OF_WEEK:
-                        for period_check_fill in range(num_p_day):
-                            if not grade_coverage_this_term.get(grade_to_check, {}).get(day_check_fill, [])[period_check_fill]:
-                                log_fn(f"ERROR (Term {term_idx}): Grade {grade_to_check} no class {day_check_fill} P{period_check_fill+1}. Invalidating attempt.", "ERROR")
-                                unmet_slots_for_all_grades_this_term += 1
-                if unmet_slots_for_all_grades_this_term > 0:
-                    is_overall_successful_attempt = False
-                    attempt_metrics['unmet_grade_slots_count'] += unmet_slots_for_all_grades_this_term
-                log_fn(f"Term {term_idx}: Full block schedule verified for Grades {required_grades_for_term}.", "DEBUG")
-            log_fn(f"Term {term_idx} scheduling completed and verified.", "DEBUG")
 
         if all_terms_overall_completion_rates_for_avg:
             attempt_metrics['overall_completion_rate'] = sum(all_terms_overall_completion_rates_for_avg) / len(all_terms_overall_completion_rates_for_avg)
+        attempt_metrics['fingerprint'] = fingerprint
+        attempt_metrics['objective'] = round(objective_value, 3)
 
         if is_overall_successful_attempt:
             log_fn("Full Schedule Generation Attempt Finished Successfully.", "INFO")
@@ -590,9 +2468,336 @@ class SchedulingEngine:
         # MODIFIED: Return the final state of all courses for this attempt
         return current_schedule, is_overall_successful_attempt, attempt_metrics, items_by_term
 
-    # ... (All other helper functions like _create_course_object_from_name, _is_teacher_qualified, etc., are unchanged) ...
+    def _validate_term_state(self, state, log_fn, attempt_metrics):
+        """Runs the end-of-term checks (completion, prep, ASSIGN pins, required-grade coverage) on a finished TermState.
+
+        Adds the term's unmet counts to attempt_metrics and returns (term_completion_rate, is_valid).
+        """
+        problem, term_idx = state.problem, state.term_idx
+        term_item_ids = problem.term_items.get(term_idx, ())
+        item_placed, teacher_load, item_grades = state.item_placed, state.teacher_load, problem.item_grades
+        teacher_names, teacher_max_teaching = problem.teacher_names, problem.teacher_max_teaching
+        required_grades_for_term = problem.required_grades
+        total_periods_needed_term = sum(problem.item_periods[i] for i in term_item_ids)
+        total_periods_placed_term = sum(item_placed.values())
+        is_valid = True
+        term_completion_rate = 0.0
+        if total_periods_needed_term > 0:
+            term_completion_rate = total_periods_placed_term / total_periods_needed_term
+            log_fn(f"Term {term_idx} Completion: {total_periods_placed_term}/{total_periods_needed_term} ({term_completion_rate*100:.2f}%).", "INFO")
+            if term_completion_rate < MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE:
+                log_fn(f"ERROR (Term {term_idx}): Completion ({term_completion_rate*100:.2f}%) < min {MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE*100}%. Invalidating attempt.", "ERROR")
+                is_valid = False
+        else:
+            log_fn(f"INFO (Term {term_idx}): All items have 0 periods needed.", "INFO")
+            term_completion_rate = 1.0
+        for t_id, name_check in enumerate(teacher_names):
+            actual_teaching_this_term_val = teacher_load[t_id]
+            actual_prep = problem.teacher_avail_count[t_id] - actual_teaching_this_term_val
+            if teacher_max_teaching[t_id] < 0 and actual_teaching_this_term_val > 0:
+                log_fn(f"ERROR (Term {term_idx}): Teacher {name_check} was unscheduleable but taught. Invalidating attempt.", "ERROR")
+                is_valid = False
+                attempt_metrics['unmet_prep_teachers_count'] += 1
+            elif actual_prep < MIN_PREP_BLOCKS_PER_WEEK:
+                log_fn(f"ERROR (Term {term_idx}): Teacher {name_check} has {actual_prep} prep, < {MIN_PREP_BLOCKS_PER_WEEK}. Invalidating attempt.", "ERROR")
+                is_valid = False
+                attempt_metrics['unmet_prep_teachers_count'] += 1
+        log_fn("Term {term} prep blocks verified.", "DEBUG", 'prep_verified', term=term_idx)
+        pinned_state = problem.pinned_states.get(term_idx)
+        if pinned_state is not None:
+            for i in term_item_ids:
+                for slot in _iter_bits(pinned_state.item_slot_mask[i] & ~state.item_slot_mask[i]):
+                    log_fn(f"ERROR (Term {term_idx}): '{problem.item_names[i]}' is not at its ASSIGN slot {DAYS_OF_WEEK[problem.slot_day[slot]]} P{problem.slot_period[slot]+1}. Invalidating attempt.", "ERROR")
+                    is_valid = False
+        if problem.is_hs:
+            unmet_slots_for_all_grades_this_term = 0
+            if required_grades_for_term:
+                placed_grades = {item_grades[i] for i in term_item_ids if item_placed[i] > 0}
+                if not any(g in placed_grades for g in required_grades_for_term):
+                    log_fn(f"ERROR (Term {term_idx}): No courses were placed for required grades {list(required_grades_for_term)}. Invalidating.", "ERROR")
+                    is_valid = False
+            for grade_to_check in required_grades_for_term:
+                for slot in _iter_bits(problem.all_slots_mask & ~state.grade_cover[grade_to_check]):
+                    log_fn(f"ERROR (Term {term_idx}): Grade {grade_to_check} no class {DAYS_OF_WEEK[problem.slot_day[slot]]} P{problem.slot_period[slot]+1}. Invalidating attempt.", "ERROR")
+                    unmet_slots_for_all_grades_this_term += 1
+            if unmet_slots_for_all_grades_this_term > 0:
+                is_valid = False
+                attempt_metrics['unmet_grade_slots_count'] += unmet_slots_for_all_grades_this_term
+            log_fn("Term {term}: Full block schedule verified for Grades {grades}.", "DEBUG", 'grades_verified', term=term_idx, grades=list(required_grades_for_term))
+        log_fn("Term {term} scheduling completed and verified.", "DEBUG", 'term_verified', term=term_idx)
+        return term_completion_rate, is_valid
+
+    def _attempt_result_from_states(self, problem, term_states, log_fn):
+        """Validates a full set of TermStates and returns them in the attempt result format."""
+        current_schedule = problem.empty_schedule()
+        items_by_term = defaultdict(list)
+        is_overall_successful_attempt = True
+        attempt_metrics = {'overall_completion_rate': 0.0, 'unmet_grade_slots_count': 0, 'unmet_prep_teachers_count': 0}
+        completion_rates = []
+        fingerprint, objective_value = 0, 0.0
+        for term_idx in range(1, problem.num_terms + 1):
+            state = term_states.get(term_idx)
+            if state is None or not problem.term_items.get(term_idx):
+                completion_rates.append(1.0)
+                continue
+            state.write_schedule(current_schedule[term_idx])
+            fingerprint = (fingerprint * FINGERPRINT_TERM_MULTIPLIER + state.fingerprint) & FINGERPRINT_MASK
+            objective_value += state.objective_value
+            items_by_term[term_idx] = problem.build_term_items(term_idx, [state.item_teacher.get(i) for i in range(len(problem.item_names))], [state.item_placed.get(i, 0) for i in range(len(problem.item_names))])
+            term_completion_rate, term_is_valid = self._validate_term_state(state, log_fn, attempt_metrics)
+            if not term_is_valid: is_overall_successful_attempt = False
+            completion_rates.append(term_completion_rate)
+        attempt_metrics['overall_completion_rate'] = sum(completion_rates) / len(completion_rates) if completion_rates else 0.0
+        attempt_metrics['fingerprint'] = fingerprint
+        attempt_metrics['objective'] = round(objective_value, 3)
+        return current_schedule, is_overall_successful_attempt, attempt_metrics, items_by_term
+
+    # --- Local-search repair ---
+    def _repair_failed_attempts(self, problem, run_state, id_suffix):
+        """Runs local-search repair on the best failed attempts of the last pass.
+
+        Each failed schedule is rebuilt into TermStates and improved against a weighted penalty of unmet
+        required-grade slots, teachers short of prep and unplaced periods, first by simulated annealing
+        ('repair') and then by large-neighbourhood search ('lns'). Repaired schedules that pass
+        validation are added like any other valid schedule; otherwise they compete for best-failed.
+        """
+        seeds = run_state.get('failed_pool', [])
+        weights = {**DEFAULT_ENGINE_OPTIONS['repair_weights'], **(self.engine_options.get('repair_weights') or {})}
+        iterations = int(self.engine_options.get('repair_iterations', 0) or 0) if self.engine_options.get('repair', True) else 0
+        lns_iterations = int(self.engine_options.get('lns_iterations', 0) or 0) if self.engine_options.get('lns', True) else 0
+        deadline = self._deadline(self.engine_options.get('repair_time_limit'))
+        self._log_message(f"--- REPAIR: Running local search on {len(seeds)} best failed attempt(s) ({iterations} moves, {lns_iterations} neighbourhoods per term) ---", "INFO")
+        for seed_idx, failed_result in enumerate(seeds):
+            if time.monotonic() > deadline:
+                self._log_message("REPAIR: Time limit reached.", "INFO")
+                break
+            repair_log = log_fn = self._new_log()
+            rng = random.Random(self.run_seed + REPAIR_SEED_OFFSET + seed_idx)
+            term_states = {t: TermState.from_schedule(problem, t, failed_result['schedule'].get(t, {}), (failed_result['placed_courses'] or {}).get(t), problem.pinned_states.get(t))
+                           for t in problem.term_items}
+            penalty_before = sum(state.penalty(weights) for state in term_states.values())
+            for term_idx, state in term_states.items():
+                state = term_states[term_idx] = self._anneal_term_state(state, weights, rng, iterations // max(1, len(term_states)), deadline)
+                annealed_penalty = state.penalty(weights)
+                improvements = self._lns_improve_term_state(state, weights, rng, lns_iterations, deadline)
+                if improvements: log_fn("REPAIR: Term {term} LNS improved {improvements} neighbourhood(s), penalty {before} -> {after}.", "DEBUG", 'lns_improved',
+                                        term=term_idx, improvements=improvements, before=annealed_penalty, after=state.penalty(weights))
+            penalty_after = sum(state.penalty(weights) for state in term_states.values())
+            log_fn(f"REPAIR: Seed {seed_idx + 1} penalty {penalty_before} -> {penalty_after}.", "INFO")
+            current_schedule, is_valid, attempt_metrics, placed_courses = self._attempt_result_from_states(problem, term_states, log_fn)
+            attempt_metrics['repaired'] = True
+            self.current_run_log.extend(repair_log)
+            if is_valid:
+                self._record_valid_schedule(problem, run_state, current_schedule, attempt_metrics, placed_courses, repair_log, id_suffix)
+            else:
+                self._log_message("REPAIR: Seed {seed} still fails validation (Completion: {completion:.2f}%).", "DEBUG", 'repair_invalid', seed=seed_idx + 1, completion=attempt_metrics['overall_completion_rate'] * 100)
+                self._record_failed_attempt(problem, run_state, current_schedule, attempt_metrics, placed_courses, repair_log)
+
+    def _anneal_term_state(self, state, weights, rng, iterations, deadline):
+        """Simulated annealing over one term. Returns the lowest-penalty TermState seen."""
+        items = [i for i in state.item_placed if state.problem.item_periods[i] > 0]
+        current_penalty = state.penalty(weights)
+        best_penalty, best_state = current_penalty, state.copy()
+        if not items or iterations <= 0: return best_state
+        temperature = REPAIR_START_TEMPERATURE
+        cooling = (REPAIR_END_TEMPERATURE / REPAIR_START_TEMPERATURE) ** (1.0 / iterations)
+        for iteration in range(iterations):
+            if best_penalty == 0 or (iteration % 64 == 0 and time.monotonic() > deadline): break
+            temperature *= cooling
+            undo = self._apply_random_repair_move(state, items, rng)
+            if undo is None: continue
+            delta = state.penalty(weights) - current_penalty
+            if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+                current_penalty += delta
+                if current_penalty < best_penalty:
+                    best_penalty, best_state = current_penalty, state.copy()
+            else:
+                undo()
+        return best_state
+
+    def _lns_improve_term_state(self, state, weights, rng, iterations, deadline):
+        """Large-neighbourhood search over one term, in place.
+
+        Each iteration frees one neighbourhood (a day, a subject area or one teacher's classes, picked
+        around an item that is still short of periods when there is one) and re-places it with
+        _exact_replace. Returns the number of neighbourhoods that lowered the penalty.
+        """
+        problem = state.problem
+        items = [i for i in state.item_placed if problem.item_periods[i] > 0]
+        max_items = max(1, int(self.engine_options.get('lns_max_items', 1) or 1))
+        node_limit = int(self.engine_options.get('lns_node_limit', 0) or 0)
+        improvements = 0
+        for _ in range(iterations):
+            if not items or state.penalty(weights) == 0 or time.monotonic() > deadline: break
+            short_items = [i for i in items if state.item_placed[i] < problem.item_periods[i]]
+            focus = rng.choice(short_items or items)
+            kind = rng.choice(("day", "subject", "teacher") if focus in state.item_teacher else ("day", "subject"))
+            region = problem.all_slots_mask
+            if kind == "day":
+                region = problem.day_masks[rng.randrange(problem.num_days)]
+                members = [i for i in items if i == focus or state.item_slot_mask[i] & region]
+            elif kind == "subject":
+                members = [i for i in items if problem.item_subjects[i] == problem.item_subjects[focus]]
+            else:
+                members = [i for i in items if state.item_teacher.get(i) == state.item_teacher[focus]]
+            others = [i for i in members if i != focus]
+            members = [focus] + rng.sample(others, min(len(others), max_items - 1))
+            if self._exact_replace(state, members, region, weights, node_limit, rng): improvements += 1
+        return improvements
+
+    def _exact_replace(self, state, members, region, weights, node_limit, rng):
+        """Frees members' movable placements inside region and re-places them by exhaustive search.
+
+        Depth-first search with a penalty lower bound (each further placement can lower the penalty by at
+        most one unplaced period and one uncovered grade slot), capped at node_limit nodes. The current
+        placement is the incumbent, so the state only changes when a strictly better one is found.
+        Returns True if it did.
+        """
+        problem = state.problem
+        incumbent = state.penalty(weights)
+        freed = [(i, slot) for i in members for slot in _iter_bits(state.item_slot_mask[i] & region & ~problem.item_assign_masks[i])]
+        new_teachers = []
+        for i in members:
+            if i not in state.item_teacher:
+                t_id = self._find_best_teacher_for_item(problem, i, state.teacher_load, rng)
+                if t_id is not None:
+                    state.item_teacher[i] = t_id
+                    new_teachers.append(i)
+        for i, slot in freed: state.unplace(i, slot)
+        search_items = [i for i in members if i in state.item_teacher and state.item_placed[i] < problem.item_periods[i]]
+        max_gain = weights['unplaced'] + weights['grade_slot']
+        best = {'penalty': incumbent, 'placements': None}
+        chosen, nodes = [], [0]
+
+        def open_node(idx, remaining, min_slot):
+            """Bounds the node; returns the _ReplaceFrame to branch on, or None for a leaf or a pruned node."""
+            nodes[0] += 1
+            if nodes[0] > node_limit: return None
+            current = state.penalty(weights)
+            if current - remaining * max_gain >= best['penalty']: return None
+            if idx == len(search_items):
+                best['penalty'], best['placements'] = current, list(chosen)
+                return None
+            item = search_items[idx]
+            still_needed = problem.item_periods[item] - state.item_placed[item]
+            slots = ()
+            if still_needed > 0:
+                candidates = state.candidate_mask(item, state.item_teacher[item], state.forced_period(item)) & region & ~((1 << min_slot) - 1)
+                uncovered = problem.all_slots_mask & ~state.grade_cover.get(problem.item_grades[item], problem.all_slots_mask)
+                slots = [*_iter_bits(candidates & uncovered), *_iter_bits(candidates & ~uncovered)]
+            return _ReplaceFrame(idx, remaining, item, still_needed, slots)
+
+        # Depth-first on an explicit stack: a frame places its item's next slot and opens that child; once its
+        # slots run out it is replaced by the next item's node, which is always its last branch.
+        stack = [open_node(0, sum(problem.item_periods[i] - state.item_placed[i] for i in search_items), 0)]
+        if stack[0] is None: stack.pop()
+        while stack:
+            frame = stack[-1]
+            if frame.placed is not None:
+                chosen.pop()
+                state.unplace(frame.item, frame.placed)
+                frame.placed = None
+            slot = next(frame.slots, None)
+            if slot is not None:
+                state.place(frame.item, state.item_teacher[frame.item], slot)
+                chosen.append((frame.item, slot))
+                frame.placed = slot
+                child = open_node(frame.idx, frame.remaining - 1, slot + 1)
+            else:
+                stack.pop()
+                child = open_node(frame.idx + 1, frame.remaining - max(0, frame.still_needed), 0)
+            if child is not None: stack.append(child)
+        placements = best['placements'] if best['placements'] is not None else freed
+        for i, slot in placements: state.place(i, state.item_teacher[i], slot)
+        for i in new_teachers:
+            if state.item_placed[i] == 0: del state.item_teacher[i]
+        return best['placements'] is not None
+
+    def _apply_random_repair_move(self, state, items, rng):
+        """Applies one random move (insert, relocate, swap, eject, teacher change) to state.
+
+        Returns a callable that reverts the move, or None if the drawn move was not possible. ASSIGN pins
+        are never moved.
+        """
+        problem = state.problem
+        move = rng.random()
+        item = rng.choice(items)
+        movable = state.item_slot_mask[item] & ~problem.item_assign_masks[item]
+        if move < 0.35:
+            if state.item_placed[item] >= problem.item_periods[item]: return None
+            t_id = state.item_teacher.get(item)
+            new_teacher = t_id is None
+            if new_teacher:
+                t_id = self._find_best_teacher_for_item(problem, item, state.teacher_load, rng)
+                if t_id is None: return None
+            candidates = state.candidate_mask(item, t_id, state.forced_period(item))
+            if not candidates: return None
+            slot = rng.choice(list(_iter_bits(candidates)))
+            state.item_teacher[item] = t_id
+            state.place(item, t_id, slot)
+            def undo():
+                state.unplace(item, slot)
+                if new_teacher: del state.item_teacher[item]
+            return undo
+        if not movable: return None
+        old_slot = rng.choice(list(_iter_bits(movable)))
+        t_id = state.item_teacher[item]
+        if move < 0.65:
+            state.unplace(item, old_slot)
+            candidates = state.candidate_mask(item, t_id, state.forced_period(item)) & ~(1 << old_slot)
+            if not candidates:
+                state.place(item, t_id, old_slot)
+                return None
+            new_slot = rng.choice(list(_iter_bits(candidates)))
+            state.place(item, t_id, new_slot)
+            def undo():
+                state.unplace(item, new_slot)
+                state.place(item, t_id, old_slot)
+            return undo
+        if move < 0.85:
+            other = rng.choice(items)
+            other_movable = state.item_slot_mask[other] & ~problem.item_assign_masks[other] & ~(1 << old_slot)
+            if other == item or not other_movable: return None
+            other_slot = rng.choice(list(_iter_bits(other_movable)))
+            other_t_id = state.item_teacher[other]
+            state.unplace(item, old_slot)
+            state.unplace(other, other_slot)
+            if state.candidate_mask(item, t_id, state.forced_period(item)) >> other_slot & 1:
+                state.place(item, t_id, other_slot)
+                if state.candidate_mask(other, other_t_id, state.forced_period(other)) >> old_slot & 1:
+                    state.place(other, other_t_id, old_slot)
+                    def undo():
+                        state.unplace(item, other_slot)
+                        state.unplace(other, old_slot)
+                        state.place(item, t_id, old_slot)
+                        state.place(other, other_t_id, other_slot)
+                    return undo
+                state.unplace(item, other_slot)
+            state.place(item, t_id, old_slot)
+            state.place(other, other_t_id, other_slot)
+            return None
+        if move < 0.92:
+            state.unplace(item, old_slot)
+            return lambda: state.place(item, t_id, old_slot)
+        if state.item_slot_mask[item] & problem.item_assign_masks[item]: return None
+        item_slots = list(_iter_bits(state.item_slot_mask[item]))
+        alternatives = [t for t in problem.item_qualified_teachers[item]
+                        if t != t_id and problem.teacher_max_teaching[t] >= state.teacher_load[t] + len(item_slots)
+                        and problem.teacher_avail_masks[t] & state.item_slot_mask[item] == state.item_slot_mask[item]
+                        and not state.teacher_busy[t] & state.item_slot_mask[item]]
+        if not alternatives: return None
+        new_t_id = rng.choice(alternatives)
+        self._reassign_teacher(state, item, item_slots, new_t_id)
+        return lambda: self._reassign_teacher(state, item, item_slots, t_id)
+
+    @staticmethod
+    def _reassign_teacher(state, item, item_slots, t_id):
+        for slot in item_slots: state.unplace(item, slot)
+        state.item_teacher[item] = t_id
+        for slot in item_slots: state.place(item, t_id, slot)
+
     def _create_course_object_from_name(self, name, credits):
-        params = self.get_parameters()
+        params = self.params
         grade = "Mixed"
         if " 10" in name: grade = 10
         if " 20" in name: grade = 11
@@ -615,37 +2820,139 @@ class SchedulingEngine:
             periods_year = math.ceil(course_mins / p_dur_min)
             periods_per_week = math.ceil(periods_year / weeks_course_dur)
         return {'name': name, 'credits': credits, 'grade_level': grade, 'subject_area': subject_area, 'periods_per_week_in_active_term': max(1, periods_per_week), 'term_assignment': 1, 'scheduling_constraints_raw': "", 'parsed_constraints': [], '_is_one_credit_buffer_item': False, '_is_suggestion': True}
-    def _is_teacher_qualified(self, teacher_obj, subject_area):
-        if subject_area == "Other": return True
-        return subject_area in teacher_obj.get('qualifications', [])
-    def _find_best_teacher_for_course(self, item_obj, teacher_teaching_periods_this_week_for_term, teacher_max_teaching_this_week):
-        subject_area = item_obj.get('subject_area')
-        periods_for_this_course = item_obj.get('periods_per_week_in_active_term', 0)
+    def _hopeless_attempt_reason(self, state, total_periods_needed, periods_lost, remaining_periods_by_grade):
+        """Returns why the term can no longer pass validation, or None while it still can.
+
+        Completion is bounded by assuming every unprocessed period gets placed; coverage of a required
+        grade is bounded by the periods its unprocessed items still have, one new slot per period.
+        """
+        problem = state.problem
+        if total_periods_needed > 0:
+            completion_bound = (total_periods_needed - periods_lost) / total_periods_needed
+            if completion_bound < MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE:
+                return f"best reachable completion {completion_bound*100:.2f}% < min {MIN_ACCEPTABLE_SCHEDULE_COMPLETION_RATE*100}%"
+        if problem.is_hs:
+            for grade in problem.required_grades:
+                uncovered = _popcount(problem.all_slots_mask & ~state.grade_cover[grade])
+                if uncovered > remaining_periods_by_grade.get(grade, 0):
+                    return f"Grade {grade} has {uncovered} uncovered slots but only {remaining_periods_by_grade.get(grade, 0)} periods left to place"
+        return None
+
+    def _place_item_periods(self, state, item, t_id, periods_to_place, rng, other_masks=None, tabu_mask=0):
+        """Places up to periods_to_place periods of an item, drawing each slot from the bitmask kernel.
+
+        Without other_masks each slot is drawn at random. With the other pending items' candidate masks,
+        slots are least-constraining first: uncovered required-grade slots, then the lowest ratio of
+        competing items to free tracks, then the best objective gain, with rng only breaking ties. Random
+        draws take the better of two slots by objective gain when there is an objective. Slots in
+        tabu_mask are only used when no other candidate is left.
+        """
+        problem = state.problem
+        objective = problem.objective
+        forced_period = state.forced_period(item)
+        grade_cover = state.grade_cover.get(problem.item_grades[item])
+        placed_count = 0
+        for _ in range(periods_to_place):
+            candidates = state.candidate_mask(item, t_id, forced_period)
+            if not candidates: break
+            if candidates & ~tabu_mask: candidates &= ~tabu_mask
+            if other_masks is None:
+                slot = rng.choice(list(_iter_bits(candidates)))
+                if objective is not None:
+                    rival = rng.choice(list(_iter_bits(candidates)))
+                    if objective.place_delta(state, item, t_id, rival) > objective.place_delta(state, item, t_id, slot): slot = rival
+            else:
+                slot = min(_iter_bits(candidates), key=lambda s: (grade_cover is not None and bool(grade_cover >> s & 1),
+                                                                  sum(m >> s & 1 for m in other_masks) / state.free_tracks[s],
+                                                                  -objective.place_delta(state, item, t_id, s) if objective is not None else 0, rng.random()))
+            state.place(item, t_id, slot)
+            placed_count += 1
+            if state.problem.force_same_time and forced_period is None: forced_period = state.problem.slot_period[slot]
+        return placed_count
+
+    def _build_grade_cover(self, state, grade, rng):
+        """Places periods of one required grade's items so that every slot gets a class of that grade.
+
+        Solved as a max-flow matching: uncovered slot -> (item, day) -> item -> sink, where an arc from a
+        slot exists only if the item's teacher can take it now, each (item, day) holds one period unless
+        several per day are allowed, and an item holds at most its unplaced periods. Arc order is shuffled
+        with rng so attempts get different covers. Items without a teacher get one from the greedy choice.
+        Returns the number of slots covered by the stage.
+        """
+        problem = state.problem
+        items = []
+        for i in problem.term_items.get(state.term_idx, ()):
+            if problem.item_grades[i] != grade or problem.item_assign_slots[i] or state.item_placed[i] >= problem.item_periods[i]: continue
+            if i not in state.item_teacher:
+                t_id = self._find_best_teacher_for_item(problem, i, state.teacher_load, rng)
+                if t_id is None: continue
+                state.item_teacher[i] = t_id
+            items.append(i)
+        slots = list(_iter_bits(problem.all_slots_mask & ~state.grade_cover[grade]))
+        if not items or not slots: return 0
+        rng.shuffle(items)
+        rng.shuffle(slots)
+        day_slots_per_item = problem.num_periods_per_day if problem.allow_multiple_same_day else 1
+        day_node = lambda n, day: 1 + len(slots) + n * problem.num_days + day
+        item_node = lambda n: 1 + len(slots) + len(items) * problem.num_days + n
+        sink = 1 + len(slots) + len(items) * (problem.num_days + 1)
+        arcs, cover_arcs = [], []
+        for k, slot in enumerate(slots):
+            arcs.append((0, 1 + k, 1, 0))
+            for n, i in enumerate(items):
+                if state.candidate_mask(i, state.item_teacher[i], state.forced_period(i)) >> slot & 1:
+                    cover_arcs.append((slot, i, len(arcs)))
+                    arcs.append((1 + k, day_node(n, problem.slot_day[slot]), 1, 0))
+        for n, i in enumerate(items):
+            for day in range(problem.num_days):
+                arcs.append((day_node(n, day), item_node(n), day_slots_per_item, 0))
+            arcs.append((item_node(n), sink, problem.item_periods[i] - state.item_placed[i], 0))
+        flows = _min_cost_flow(sink + 1, arcs, 0, sink)
+        covered = 0
+        for slot, i, arc_idx in cover_arcs:
+            if flows[arc_idx] and state.candidate_mask(i, state.item_teacher[i], state.forced_period(i)) >> slot & 1:
+                state.place(i, state.item_teacher[i], slot)
+                covered += 1
+        return covered
+
+    def _select_most_constrained_item(self, state, pending, rng, item_priorities=None):
+        """Removes and returns the pending item with the least placement slack (DSATUR-style).
+
+        Slack is the number of slots still open to the item (over its assigned teacher, or every qualified
+        teacher with capacity) minus the periods it still needs, less any squeaky-wheel priority; fewer candidate teachers and required
+        grades break ties, then rng. Also returns the other pending items' candidate masks so the slot
+        choice can be least-constraining.
+        """
+        problem = state.problem
+        best_key, best_idx, masks = None, 0, []
+        for idx, i in enumerate(pending):
+            if i in state.item_teacher:
+                teachers = (state.item_teacher[i],)
+            else:
+                teachers = [t for t in problem.item_qualified_teachers[i] if 0 <= problem.teacher_max_teaching[t] and state.teacher_load[t] + problem.item_periods[i] <= problem.teacher_max_teaching[t]]
+            forced_period = state.forced_period(i)
+            mask = 0
+            for t_id in teachers: mask |= state.candidate_mask(i, t_id, forced_period)
+            masks.append(mask)
+            slack = _popcount(mask) - (problem.item_periods[i] - state.item_placed[i]) - (item_priorities.get(i, 0.0) if item_priorities else 0.0)
+            key = (slack, len(teachers), problem.item_grades[i] not in problem.required_grades, rng.random())
+            if best_key is None or key < best_key: best_key, best_idx = key, idx
+        del masks[best_idx]
+        return pending.pop(best_idx), masks
+
+    def _find_best_teacher_for_item(self, problem, item_id, teacher_load, rng=random):
+        periods_for_this_course = problem.item_periods[item_id]
         candidate_teachers = []
-        for teacher in self.teachers_data:
-            teacher_name = teacher['name']
-            if not self._is_teacher_qualified(teacher, subject_area):
-                continue
-            projected_load = teacher_teaching_periods_this_week_for_term.get(teacher_name, 0) + periods_for_this_course
-            max_load = teacher_max_teaching_this_week.get(teacher_name, -1)
+        for t_id in _break_teacher_symmetry(problem, problem.item_qualified_teachers[item_id], teacher_load):
+            max_load = problem.teacher_max_teaching[t_id]
             if max_load < 0: continue
+            projected_load = teacher_load[t_id] + periods_for_this_course
             if projected_load > max_load: continue
-            candidate_teachers.append({'name': teacher_name, 'load_score': max_load - projected_load})
+            candidate_teachers.append((t_id, max_load - projected_load))
         if not candidate_teachers: return None
-        random.shuffle(candidate_teachers)
-        candidate_teachers.sort(key=lambda x: x['load_score'], reverse=True)
-        return candidate_teachers[0]['name']
-    def _check_cohort_clash_in_slot(self, item_name_to_schedule, term_idx, day_name, period_idx, current_schedule):
-        num_tracks = self.params.get('num_concurrent_tracks_per_period', 1)
-        base_item_name = item_name_to_schedule.split(' (')[0].strip()
-        for track_idx_check in range(num_tracks):
-            existing_item_tuple = current_schedule[term_idx][day_name][period_idx][track_idx_check]
-            if existing_item_tuple:
-                existing_base_name = existing_item_tuple[0].split(' (')[0].strip()
-                for clash_group in self.cohort_constraints:
-                    if isinstance(clash_group, (list, tuple)) and base_item_name in clash_group and existing_base_name in clash_group:
-                        return True
-        return False
+        rng.shuffle(candidate_teachers)
+        candidate_teachers.sort(key=lambda x: x[1], reverse=True)
+        return candidate_teachers[0][0]
     def _attempt_course_combination(self):
         if self.params.get('school_type') != 'High School': return False
         courses_modified = False
@@ -680,13 +2987,42 @@ class SchedulingEngine:
             remap_for_cohorts[course2_name] = new_name
             courses_modified = True
         if courses_modified:
-            self.courses_data = [c for c in self.courses_data if c['name'] not in course_names_to_remove]
-            self.courses_data.extend(courses_to_add)
+            self.courses_data = freeze([c for c in self.courses_data if c['name'] not in course_names_to_remove] + courses_to_add)
             new_cohort_constraints = []
             for group in self.cohort_constraints:
                 new_group = list(set(remap_for_cohorts.get(name, name) for name in group))
                 if len(new_group) > 1:
                     new_cohort_constraints.append(new_group)
-            self.cohort_constraints = new_cohort_constraints
-            self._log_message(f"Updated cohort constraints after combination: {len(self.cohort_constraints)} remaining.", "DEBUG")
-        return courses_modified
\ No newline at end of file
+            self.cohort_constraints = freeze(new_cohort_constraints)
+            self._log_message("Updated cohort constraints after combination: {remaining} remaining.", "DEBUG", 'cohorts_combined', remaining=len(self.cohort_constraints))
+        return courses_modified
+
+
+# --- Process-pool workers for parallel attempts ---
+# Each worker process receives the compiled problem once, then runs attempts by seed modifier.
+_worker_engine = None
+_worker_problem = None
+
+def _init_attempt_worker(problem, run_seed, engine_options):
+    global _worker_engine, _worker_problem
+    _worker_engine = SchedulingEngine()
+    _worker_engine.run_seed = run_seed
+    _worker_engine.engine_options = engine_options
+    _worker_problem = problem
+
+def _run_portfolio_strategy(payload):
+    name, inputs, options, num_schedules_to_generate, max_total_attempts = payload
+    engine = SchedulingEngine()
+    engine.set_parameters(inputs['params'])
+    engine.set_teachers(inputs['teachers'])
+    engine.set_courses(inputs['courses'])
+    engine.set_subjects(inputs['subjects'])
+    engine.set_cohort_constraints(inputs['cohort_constraints'])
+    engine.set_hs_credits_db(inputs['credits_db'])
+    engine.set_engine_options({**options, 'log_echo': False})
+    success = engine.generate_schedules(num_schedules_to_generate, max_total_attempts)
+    return {'strategy': name, 'success': bool(success), 'schedules': engine.get_generated_schedules(), 'log': list(engine.current_run_log)}
+
+def _run_attempt_in_worker(attempt_seed_modifier, item_priorities=None, tabu_masks=None):
+    attempt_log = _worker_engine._new_log()
+    return _worker_engine._generate_single_schedule_attempt(attempt_seed_modifier=attempt_seed_modifier, attempt_log_list=attempt_log, problem=_worker_problem, item_priorities=item_priorities, tabu_masks=tabu_masks) + (attempt_log,)
@@ -283,6 +283,9 @@ class PageResults(QWidget):
     def handle_schedule_update(self, schedule_id, new_schedule_data):
         if schedule_id in self.schedules_data:
             self.schedules_data[schedule_id]['schedule'] = new_schedule_data
+            evaluation = self.engine.evaluate_schedules([self.schedules_data[schedule_id]])
+            if evaluation:
+                self.schedules_data[schedule_id]['metrics'] = {**self.schedules_data[schedule_id].get('metrics', {}), **evaluation[0]}
             self.refresh_all_schedule_views()
 
     def _calculate_period_times_for_display(self, params):
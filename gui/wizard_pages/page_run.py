@@ -62,6 +62,12 @@ class PageRun(QWidget):
         self.engine.set_courses(self.data_handler.get_value('courses_data_raw_input', []))
         self.engine.set_cohort_constraints(self.data_handler.get_value('cohort_constraints', []))
 
+        bottlenecks = self.engine.analyze_feasibility()
+        if bottlenecks:
+            self.log_view.append("--- Feasibility Check (worst first) ---")
+            for bottleneck in bottlenecks[:10]:
+                self.log_view.append(f"[{bottleneck['severity'].upper()}] {bottleneck['message']}")
+
         # These would be configurable in a more advanced UI
         num_schedules = 1
         max_attempts = 200
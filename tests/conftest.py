@@ -0,0 +1,42 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gui.scheduler_engine import SchedulingEngine, parse_teacher_availability
+
+
+def build_engine(seed=1, num_courses=36, num_teachers=14, num_periods=4, num_tracks=4, num_terms=2, required_grades=(10,), options=None):
+    """A random but reproducible high school instance."""
+    rng = random.Random(seed)
+    params = {'school_type': 'High School', 'num_periods_per_day': num_periods, 'num_terms': num_terms,
+              'num_concurrent_tracks_per_period': num_tracks, 'period_duration_minutes': 60, 'weeks_per_term': 18,
+              'grades_requiring_full_schedule': list(required_grades), 'multiple_times_same_day': False}
+    subjects = ["Math", "Science", "Social Studies", "English", "PE", "CTS", "Other", "French"]
+    teachers = []
+    for i in range(num_teachers):
+        raw = rng.choice(["always", "always", "Mon P1", "Fri afternoon unavailable"])
+        teachers.append({'name': f"T{i}", 'qualifications': rng.sample(subjects[:6], 2), 'raw_availability_str': raw,
+                         'availability': parse_teacher_availability(raw, num_periods)})
+    courses = []
+    for i in range(num_courses):
+        grade = rng.choice([10, 10, 11, 12])
+        subject = rng.choice(subjects)
+        constraint = rng.choice(["", "", "", "NOT Mon P1", "NOT Fri", "ASSIGN Tue P2" if i % 11 == 0 else ""])
+        courses.append({'name': f"{subject} {grade}-{i}", 'credits': rng.choice([5, 5, 3, 1]), 'grade_level': str(grade),
+                        'subject_area': subject, 'term_assignment': 1 + i % num_terms, 'scheduling_constraints_raw': constraint})
+    engine = SchedulingEngine()
+    engine.set_parameters(params)
+    engine.set_teachers(teachers)
+    engine.set_courses(courses)
+    engine.set_cohort_constraints([[courses[0]['name'], courses[1]['name']]])
+    engine.set_engine_options({'log_echo': False, **(options or {})})
+    return engine
+
+
+@pytest.fixture
+def make_engine():
+    return build_engine
@@ -0,0 +1,322 @@
+import random
+
+import pytest
+
+from gui.scheduler_engine import DAYS_OF_WEEK, DEFAULT_ENGINE_OPTIONS, RunLog, SchedulingEngine, TermState, parse_teacher_availability
+
+
+def _edited(schedule):
+    """A copy with one cell emptied, one naming an unknown teacher and one naming an unknown course."""
+    edited = {t: {d: [list(tracks) for tracks in periods] for d, periods in grid.items()} for t, grid in schedule.items()}
+    cells = [(t, d, p, k) for t, grid in edited.items() for d in DAYS_OF_WEEK for p, tracks in enumerate(grid[d]) for k, cell in enumerate(tracks) if cell]
+    (t0, d0, p0, k0), (t1, d1, p1, k1), (t2, d2, p2, k2) = cells[0], cells[len(cells) // 2], cells[-1]
+    edited[t0][d0][p0][k0] = None
+    edited[t1][d1][p1][k1] = (edited[t1][d1][p1][k1][0], "Nobody")
+    edited[t2][d2][p2][k2] = ("Unknown Course", edited[t2][d2][p2][k2][1])
+    return edited
+
+
+def _pinned_cells(problem, term_idx):
+    """(course, teacher, day, period) of every placement in a term's pinned state."""
+    state = problem.pinned_states[term_idx]
+    return {(problem.item_names[item], problem.teacher_names[state.item_teacher[item]], DAYS_OF_WEEK[problem.slot_day[slot]], problem.slot_period[slot])
+            for slot, tracks in enumerate(state.cells) for item in tracks if item is not None}
+
+
+def _schedule_cells(schedule, term_idx):
+    return {(cell[0], cell[1], day, p_idx) for day in DAYS_OF_WEEK for p_idx, tracks in enumerate(schedule[term_idx][day]) for cell in tracks if cell}
+
+
+@pytest.mark.parametrize("seed", [2, 4])
+def test_evaluate_schedules_numpy_matches_python(make_engine, seed):
+    pytest.importorskip("numpy")
+    engine = make_engine(seed, options={'random_seed': 5})
+    engine.generate_schedules(3, 40)
+    schedules = [s['schedule'] for s in engine.get_generated_schedules()]
+    schedules += [_edited(schedule) for schedule in schedules]
+    vectorized = engine.evaluate_schedules(schedules)
+    engine.set_engine_options({'log_echo': False, 'vectorized_evaluation': False})
+    serial = engine.evaluate_schedules(schedules)
+    assert len(vectorized) == len(serial) == len(schedules)
+    for fast, slow in zip(vectorized, serial):
+        assert fast.keys() == slow.keys()
+        assert fast['overall_completion_rate'] == pytest.approx(slow['overall_completion_rate'])
+        assert {k: v for k, v in fast.items() if k != 'overall_completion_rate'} == {k: v for k, v in slow.items() if k != 'overall_completion_rate'}
+
+
+def test_evaluate_schedules_uses_the_course_set_of_a_result(make_engine):
+    engine = make_engine(2, options={'random_seed': 5})
+    engine.generate_schedules(1, 40)
+    result = engine.get_generated_schedules()[0]
+    before = engine.evaluate_schedules([result])[0]
+    assert before == engine.evaluate_schedules([result['schedule']])[0]
+    assert before['overall_completion_rate'] > 0
+    engine.set_courses(engine.courses_data[:10])
+    assert engine.evaluate_schedules([result])[0] == before
+    assert engine.evaluate_schedules([result['schedule']])[0] != before
+
+
+def test_exact_infeasible_still_reports_best_failed_attempt(make_engine):
+    engine = make_engine(0, num_courses=10, num_teachers=5, num_periods=3, num_tracks=2, options={'solver': 'exact', 'random_seed': 3})
+    assert engine.generate_schedules(2, 20) is False
+    assert any('Proven infeasible' in line for line in engine.current_run_log.lines())
+    assert [s['id'] for s in engine.get_generated_schedules()] == ['Best_Failed_Attempt']
+
+
+@pytest.mark.parametrize("options", [{}, {'diversity': True}], ids=["squeaky-wheel", "diversity"])
+def test_parallel_run_matches_serial_run(make_engine, options):
+    outputs = []
+    for num_workers in (1, 2):
+        engine = make_engine(2, options={'random_seed': 11, 'num_workers': num_workers, **options})
+        engine.generate_schedules(5, 60)
+        outputs.append([(s['id'], s['metrics'].get('fingerprint'), s['schedule']) for s in engine.get_generated_schedules()])
+    assert outputs[0]
+    assert outputs[0] == outputs[1]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_exact_solver_is_sound_on_small_instances(make_engine, seed):
+    shape = {'num_courses': 12, 'num_teachers': 8, 'num_periods': 3, 'num_tracks': 3, 'required_grades': ()}
+    exact = make_engine(seed, **shape, options={'solver': 'exact', 'random_seed': 1})
+    if exact.generate_schedules(1, 30):
+        results = exact.get_generated_schedules()
+        assert results[0]['id'].endswith("Exact")
+        assert all(metrics['is_valid'] for metrics in exact.evaluate_schedules(results))
+    else:
+        assert any('Proven infeasible' in line for line in exact.get_run_log())
+        greedy = make_engine(seed, **shape, options={'random_seed': 1})
+        assert greedy.generate_schedules(1, 200) is False
+
+
+def test_early_aborted_attempt_keeps_pinned_courses_of_later_terms(make_engine):
+    engine = make_engine(5)
+    engine.run_seed = 1
+    problem = engine._compile_problem(RunLog())
+    log = RunLog("WARN")
+    schedule, is_valid, metrics, items_by_term = engine._generate_single_schedule_attempt(0, log, problem)
+    assert not is_valid and metrics['aborted_early']
+    assert any('EARLY ABORT (Term 1)' in line for line in log.lines())
+    pinned = _pinned_cells(problem, 2)
+    assert pinned and pinned <= _schedule_cells(schedule, 2)
+    placed = {course['name']: course['placed_this_term_count'] for course in items_by_term[2]}
+    assert all(placed[name] >= 1 for name, _, _, _ in pinned)
+    assert metrics['overall_completion_rate'] > 0
+
+
+def test_repair_keeps_pinned_courses_of_an_aborted_attempt(make_engine):
+    engine = make_engine(5)
+    engine.run_seed = 1
+    problem = engine._compile_problem(RunLog())
+    schedule, _, metrics, items_by_term = engine._generate_single_schedule_attempt(0, RunLog(), problem)
+    assert metrics['aborted_early']
+    # A seed whose aborted term 2 holds nothing, not even its pinned course.
+    schedule[2], items_by_term[2] = problem.empty_schedule()[2], []
+    run_state = {'target': 1, 'placements': None, 'tabu': {}, 'hashes': set(), 'failed_pool': [{'schedule': schedule, 'placed_courses': items_by_term, 'metrics': metrics}],
+                 'best_failed': {'schedule': None, 'log_summary': None, 'placed_courses': None,
+                                 'metrics': {'overall_completion_rate': 0.0, 'unmet_grade_slots_count': float('inf'), 'unmet_prep_teachers_count': float('inf')}}}
+    engine._repair_failed_attempts(problem, run_state, "Repaired")
+    results = engine.get_generated_schedules() + [run_state['best_failed']]
+    assert results[-1]['schedule'] is not None
+    pinned = _pinned_cells(problem, 2)
+    for result in results:
+        assert pinned <= _schedule_cells(result['schedule'], 2)
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_evaluate_schedules_rejects_a_schedule_without_its_pins(make_engine, vectorized):
+    if vectorized: pytest.importorskip("numpy")
+    engine = make_engine(0, required_grades=(), options={'random_seed': 2, 'vectorized_evaluation': vectorized})
+    assert engine.generate_schedules(1, 30)
+    problem = engine._compile_problem(RunLog())
+    schedule = engine.get_generated_schedules()[0]['schedule']
+    (course, _, day, p_idx), = _pinned_cells(problem, 1)
+    edited = {t: {d: [list(tracks) for tracks in periods] for d, periods in grid.items()} for t, grid in schedule.items()}
+    edited[1][day][p_idx] = [None if cell and cell[0] == course else cell for cell in edited[1][day][p_idx]]
+    original, unpinned = engine.evaluate_schedules([schedule, edited])
+    assert original['is_valid'] and not unpinned['is_valid']
+
+
+def test_cohort_courses_never_share_a_slot(make_engine):
+    engine = make_engine(2, options={'random_seed': 3})
+    term_courses = [c['name'] for c in engine.courses_data if c['term_assignment'] == 1]
+    cohorts = [term_courses[i:i + 2] for i in range(0, 12, 2)]
+    engine.set_cohort_constraints(cohorts)
+    problem = engine._compile_problem(RunLog())
+    item_ids = {name: i for i, name in enumerate(problem.item_names)}
+    assert all(item_ids[b] in problem.item_conflicts[item_ids[a]] for a, b in cohorts)
+    assert engine.generate_schedules(5, 60)
+    results = engine.get_generated_schedules()
+    assert results
+    for result in results:
+        for day in DAYS_OF_WEEK:
+            for tracks in result['schedule'][1][day]:
+                names = {cell[0] for cell in tracks if cell}
+                assert not any(set(cohort) <= names for cohort in cohorts)
+
+
+def _assert_hard_constraints(problem, state):
+    """No double-booked teacher or overfull slot, NOT/availability/cohort/same-day rules kept, every pin in place."""
+    for slot, tracks in enumerate(state.cells):
+        items = [item for item in tracks if item is not None]
+        teachers = [state.item_teacher[item] for item in items]
+        assert len(set(teachers)) == len(teachers) and len(items) <= problem.num_tracks
+        assert all(problem.teacher_avail_masks[t_id] >> slot & 1 for t_id in teachers)
+        assert not any(problem.item_not_masks[item] >> slot & 1 for item in items)
+        assert not any(other in problem.item_conflicts[item] for item in items for other in items)
+    if not problem.allow_multiple_same_day:
+        for item, mask in state.item_slot_mask.items():
+            assert all(bin(mask & day_mask).count("1") <= 1 for day_mask in problem.day_masks)
+    pinned = problem.pinned_states.get(state.term_idx)
+    if pinned is not None:
+        for item, mask in pinned.item_slot_mask.items():
+            assert state.item_slot_mask[item] & mask == mask
+            if mask: assert state.item_teacher[item] == pinned.item_teacher[item]
+
+
+@pytest.mark.parametrize("seed", [3, 5, 34])
+def test_lns_never_raises_the_penalty_or_breaks_hard_constraints(make_engine, seed):
+    engine = make_engine(seed)
+    engine.run_seed = 1
+    problem = engine._compile_problem(RunLog())
+    schedule, _, _, items_by_term = engine._generate_single_schedule_attempt(0, RunLog(), problem)
+    weights = DEFAULT_ENGINE_OPTIONS['repair_weights']
+    rng = random.Random(seed)
+    for term_idx in problem.term_items:
+        state = TermState.from_schedule(problem, term_idx, schedule[term_idx], items_by_term[term_idx], problem.pinned_states.get(term_idx))
+        penalty = state.penalty(weights)
+        for _ in range(30):
+            engine._lns_improve_term_state(state, weights, rng, 1, float('inf'))
+            assert state.penalty(weights) <= penalty
+            penalty = state.penalty(weights)
+            _assert_hard_constraints(problem, state)
+
+
+SMALL_TEACHERS = (("T0", "Math", "always"), ("T1", "Science", "always"), ("T2", "Science", "always"))
+
+
+def _small_engine(courses, cohorts=(), num_tracks=2, teachers=SMALL_TEACHERS, credits=3, required_grades=()):
+    """One-term high school with the given (name, subject, availability) teachers and (name, subject, constraint) courses."""
+    engine = SchedulingEngine()
+    engine.set_parameters({'school_type': 'High School', 'num_periods_per_day': 4, 'num_terms': 1, 'num_concurrent_tracks_per_period': num_tracks,
+                           'period_duration_minutes': 60, 'weeks_per_term': 18, 'grades_requiring_full_schedule': list(required_grades), 'multiple_times_same_day': False})
+    engine.set_teachers([{'name': name, 'qualifications': [subject], 'raw_availability_str': raw, 'availability': parse_teacher_availability(raw, 4)}
+                         for name, subject, raw in teachers])
+    engine.set_courses([{'name': name, 'credits': credits, 'grade_level': '10', 'subject_area': subject, 'term_assignment': 1, 'scheduling_constraints_raw': constraint}
+                        for name, subject, constraint in courses])
+    engine.set_cohort_constraints([list(cohort) for cohort in cohorts])
+    engine.set_engine_options({'log_echo': False, 'random_seed': 1})
+    return engine
+
+
+@pytest.mark.parametrize("courses, cohorts, expected", [
+    ([("Math A", "Math", "ASSIGN Tue P2"), ("Math B", "Math", "ASSIGN Tue P2")], (), "no qualified teacher is free for every pin of 'Math B' (T0 teaching pinned 'Math A' at Tuesday P2)"),
+    ([("Sci A", "Science", "ASSIGN Mon P1"), ("Sci B", "Science", "ASSIGN Mon P1"), ("Math A", "Math", "ASSIGN Mon P1")], (), "'Math A' is pinned to a slot whose 2 track(s) are already pinned by 'Sci A', 'Sci B'"),
+    ([("Sci A", "Science", "ASSIGN Wed P3"), ("Math A", "Math", "ASSIGN Wed P3")], [("Sci A", "Math A")], "'Math A' is pinned alongside cohort-mate 'Sci A'"),
+], ids=["same-teacher", "tracks-full", "cohort"])
+def test_conflicting_pins_are_reported(courses, cohorts, expected):
+    engine = _small_engine(courses, cohorts)
+    assert engine.generate_schedules(1, 5) is False
+    assert any(expected in line for line in engine.get_run_log())
+    assert engine.get_generated_schedules() == []
+
+
+def test_valid_pins_are_honoured():
+    engine = _small_engine([("Math A", "Math", "ASSIGN Wed P3"), ("Sci A", "Science", "ASSIGN Wed P3"), ("Sci B", "Science", "")])
+    assert engine.generate_schedules(2, 10)
+    for result in engine.get_generated_schedules():
+        cells = _schedule_cells(result['schedule'], 1)
+        assert {("Math A", "T0", "Wednesday", 2)} <= cells
+        assert any(cell[0] == "Sci A" and cell[2:] == ("Wednesday", 2) for cell in cells)
+
+
+def test_domain_propagation_removes_slots_of_a_committed_cohort_mate():
+    # T1 can only teach Wednesday P1-P2 and 'Sci A' may not use P2, so its single period is committed to Wednesday P1.
+    teachers = (("T0", "Math", "always"), ("T1", "Science", "Mon P1-4; Tue P1-4; Thu P1-4; Fri P1-4; Wed P3-4"))
+    engine = _small_engine([("Sci A", "Science", "NOT Wed P2"), ("Math A", "Math", "")], [("Sci A", "Math A")], teachers=teachers, credits=1)
+    problem = engine._compile_problem(RunLog())
+    sci, math = problem.item_names.index("Sci A"), problem.item_names.index("Math A")
+    wednesday_p1 = 1 << problem.slot_id(DAYS_OF_WEEK.index("Wednesday"), 0)
+    assert problem.item_domain_masks[sci] == wednesday_p1
+    assert problem.item_static_domain_masks[math] & wednesday_p1
+    assert not problem.item_domain_masks[math] & wednesday_p1
+    assert not problem.domain_conflicts
+    assert engine.generate_schedules(1, 10)
+
+
+def test_empty_domains_fail_fast_without_repair():
+    engine = _small_engine([("French A", "French", ""), ("Math A", "Math", "")])
+    engine.set_engine_options({'log_echo': False, 'random_seed': 1, 'log_level': 'DEBUG'})
+    problem = engine._compile_problem(RunLog())
+    assert problem.item_static_domain_masks[problem.item_names.index("French A")] == 0
+    assert problem.domain_conflicts
+    assert engine.generate_schedules(1, 50) is False
+    log = engine.get_run_log()
+    assert any("INFEASIBLE: Term 1: at least 3/6 periods cannot be placed" in line for line in log)
+    assert sum("Overall Schedule Gen Attempt" in line for line in log) == 1
+    assert not any("REPAIR" in line for line in log)
+    assert [s['id'] for s in engine.get_generated_schedules()] == ['Best_Failed_Attempt']
+
+
+def test_fingerprints_ignore_track_order_and_drop_duplicates(make_engine):
+    engine = make_engine(2, options={'random_seed': 5})
+    assert engine.generate_schedules(5, 60)
+    results = engine.get_generated_schedules()
+    assert len({r['metrics']['fingerprint'] for r in results}) == len(results) > 1
+    problem = engine._compile_problem(RunLog())
+    result = results[0]
+    reordered = {t: {d: [list(reversed(tracks)) for tracks in periods] for d, periods in grid.items()} for t, grid in result['schedule'].items()}
+    assert reordered != result['schedule']
+
+    def rebuilt(schedule):
+        term_states = {t: TermState.from_schedule(problem, t, schedule[t], result['placed_courses'].get(t)) for t in problem.term_items}
+        return term_states, engine._attempt_result_from_states(problem, term_states, RunLog())
+    states, (_, _, metrics, placed_courses) = rebuilt(result['schedule'])
+    reordered_states, (_, is_valid, reordered_metrics, _) = rebuilt(reordered)
+    assert metrics['fingerprint'] == reordered_metrics['fingerprint'] == result['metrics']['fingerprint']
+    assert all(states[t].fingerprint == reordered_states[t].fingerprint for t in states)
+    assert rebuilt(result['schedule'])[1][2]['fingerprint'] == metrics['fingerprint']
+    assert is_valid
+    run_state = {'hashes': {r['metrics']['fingerprint'] for r in results}, 'placements': None}
+    assert engine._record_valid_schedule(problem, run_state, reordered, reordered_metrics, placed_courses, RunLog()) is False
+    assert len(engine.get_generated_schedules()) == len(results)
+
+
+SCIENCE_TEACHERS = SMALL_TEACHERS + (("T3", "Science", "always"),)
+
+
+def test_symmetry_classes_group_identical_sections_and_interchangeable_teachers():
+    engine = _small_engine([("Math A", "Math", ""), ("Sci A", "Science", ""), ("Sci B", "Science", ""), ("Sci C", "Science", "NOT Mon P1"),
+                            ("Sci D", "Science", "ASSIGN Tue P2"), ("Sci E", "Science", "")], teachers=SCIENCE_TEACHERS)
+    engine.run_seed = 1
+    problem = engine._compile_problem(RunLog())
+    classes = dict(zip(problem.item_names, problem.item_class))
+    assert classes == {'Math A': 0, 'Sci A': 1, 'Sci B': 1, 'Sci C': 3, 'Sci D': 4, 'Sci E': 1}
+    assert dict(zip(problem.teacher_names, problem.teacher_class)) == {'T0': 0, 'T1': 1, 'T2': 1, 'T3': 1}
+    assert engine.get_symmetry_report() == {'teacher_classes': 1, 'interchangeable_teachers': 3, 'track_classes': 1, 'interchangeable_tracks': 2,
+                                            'section_classes': 1, 'identical_sections': 3}
+
+
+@pytest.mark.parametrize("num_sections, num_tracks", [(8, 2), (12, 2), (15, 2), (13, 3), (15, 3)])
+def test_symmetry_breaking_keeps_feasible_instances_solvable(num_sections, num_tracks):
+    courses = [(f"Sci {k}", "Science", "") for k in range(num_sections)] + [("Math A", "Math", "")]
+    for symmetry_breaking in (False, True):
+        engine = _small_engine(courses, num_tracks=num_tracks, teachers=SCIENCE_TEACHERS)
+        engine.set_engine_options({'log_echo': False, 'random_seed': 1, 'solver': 'exact', 'exact_node_limit': 20000, 'symmetry_breaking': symmetry_breaking})
+        assert engine.generate_schedules(1, 5)
+        result = engine.get_generated_schedules()[0]
+        assert result['id'].endswith("Exact")
+        assert engine.evaluate_schedules([result])[0]['is_valid']
+    assert engine.get_symmetry_report()['identical_sections'] == num_sections
+
+
+def test_feasibility_report_ranks_an_uncoverable_grade_before_shortfalls():
+    teachers = (("T0", "Math", "Mon P1-4; Tue P1-4; Wed P1-4"),) + SMALL_TEACHERS[1:]
+    engine = _small_engine([(f"Math {k}", "Math", "") for k in range(3)] + [(f"Sci {k}", "Science", "") for k in range(3)],
+                           teachers=teachers, required_grades=(10,))
+    findings = engine.analyze_feasibility()
+    assert findings[0]['kind'] == 'grade' and findings[0]['severity'] == 'infeasible'
+    assert (findings[0]['demand'], findings[0]['capacity']) == (20, 15)
+    assert [(f['kind'], f['name'], f['severity'], f['demand'], f['capacity']) for f in findings[1:]] == [
+        ('subject', 'Math', 'shortfall', 9, 7), ('teacher', 'T0', 'shortfall', 9, 7)]
+    ranks = [('infeasible', 'shortfall', 'tight').index(f['severity']) for f in findings]
+    assert ranks == sorted(ranks)